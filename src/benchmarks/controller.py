@@ -0,0 +1,130 @@
+from argparse import ArgumentParser
+from collections.abc import Callable
+import json
+from platform import python_version
+import sqlite3
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from lib.functions import get_time_now
+
+from .ledger import FIELDS, create_ledger, make_config
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict[str, float]:
+    """
+    Ejecuta <fn> <repeat> veces y devuelve el mejor tiempo y la mediana en segundos
+    """
+
+    times = []
+
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+
+    return {"best": min(times), "median": median(times)}
+
+
+def run(rows: int, repeat: int, seed: int) -> list[dict]:
+    """
+    Crea un ledger sintético de <rows> movimientos y mide las operaciones de `RGController` sobre él
+    """
+
+    results = []
+
+    with TemporaryDirectory() as folder:
+        start = perf_counter()
+        controller = create_ledger(make_config(folder), rows, seed)
+        results.append(
+            {"rows": rows, "operation": "generate", "best": perf_counter() - start}
+        )
+
+        print("{rows:>9} {operation:<28} {best:>10.4f} s".format(**results[-1]))
+
+        field = next(iter(FIELDS))
+        group = FIELDS[field]
+
+        def cold(fn: Callable[[], object]) -> Callable[[], object]:
+            # Las repeticiones sobre la base de datos sin cambios solo medirían aciertos de la caché de totales
+            return lambda: (controller.invalidate_cache(), fn())
+
+        operations = {
+            "update_db": lambda: controller.update_db(field, 1.0, "benchmark"),
+            "get_sum_of[field]": cold(lambda: controller.get_sum_of(field)),
+            "get_sum_of[group]": cold(lambda: controller.get_sum_of(group)),
+            "get_sums": cold(controller.get_sums),
+            "get_sum_of[field,cached]": lambda: controller.get_sum_of(field),
+            "get_sums[cached]": controller.get_sums,
+            "get_df_blockchain": controller.get_df_blockchain,
+            "get_df_blockchain[field]": lambda: controller.get_df_blockchain(field),
+            "page_blockchain[group]": lambda: controller.page_blockchain(
+                group, after_id=rows // 2
+            ),
+            "adjust_total[full]": lambda: controller.adjust_total(full=True),
+            "adjust_total": controller.adjust_total,
+            "get_daily_balance": lambda: controller.get_daily_balance(group),
+            "move_data": lambda: (
+                controller.move_data(10, ammount_to_move=1, create_backup=False),
+                controller.move_data(11, ammount_to_move=-1, create_backup=False),
+            ),
+            "create_local_backup": lambda: controller.create_local_backup(
+                verbose=False
+            ),
+            "restore_local_backup": lambda: controller.restore_local_backup(
+                delete_old_backups=True, create_backup=False, verbose=False
+            ),
+        }
+
+        for operation, fn in operations.items():
+            results.append({"rows": rows, "operation": operation, **measure(fn, repeat)})
+
+            print(
+                "{rows:>9} {operation:<28} {best:>10.4f} s".format(**results[-1]),
+                flush=True,
+            )
+
+        controller.close()
+
+    return results
+
+
+def main():
+    parser = ArgumentParser(
+        description="Mide las operaciones de RGController sobre ledgers sintéticos"
+    )
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", default="bench_output.json", help="archivo JSON de resultados"
+    )
+    args = parser.parse_args()
+
+    results = []
+
+    for rows in args.rows:
+        results.extend(run(rows, args.repeat, args.seed))
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "date": get_time_now(),
+                "python": python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+
+    print("Resultados guardados en %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
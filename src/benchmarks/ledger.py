@@ -0,0 +1,81 @@
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from os import makedirs, path
+from random import Random
+
+from lib.rg_controller import RGController
+
+FIELDS = {
+    "CASH": "EFECTIVO",
+    "BANK": "BANCO",
+    "CARD": "BANCO",
+    "SAVINGS": "AHORRO",
+}
+
+START = datetime(2020, 1, 1)
+SPAN = timedelta(days=3 * 365)
+
+
+def make_config(folder: str, fields: dict[str, str] | None = None, **options) -> dict:
+    """
+    Devuelve una configuración de rgcap con la base de datos y los backups dentro de <folder>
+    """
+
+    fields = fields or FIELDS
+
+    return {
+        "db_route": path.join(folder, "rgcap.db"),
+        "backups": path.join(folder, "backups") + "/",
+        "default_field": next(iter(fields)),
+        "fields": fields,
+        **options,
+    }
+
+
+def generate_rows(
+    fields: list[str], rows: int, seed: int = 0
+) -> Iterator[tuple[str, float, str, str]]:
+    """
+    Genera <rows> movimientos deterministas (fuente, cantidad, descripción, hora) repartidos entre
+    las fuentes <fields> y en orden cronológico a lo largo de tres años.
+    """
+
+    random = Random(seed)
+    step = SPAN / max(rows, 1)
+
+    for i in range(rows):
+        ammount = round(random.uniform(-500, 1000), 2) or 0.01
+
+        yield (
+            random.choice(fields),
+            ammount,
+            "movimiento %d" % i,
+            (START + step * i).strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+
+def create_ledger(
+    config: dict, rows: int, seed: int = 0, chunk_size: int = 50_000
+) -> RGController:
+    """
+    Crea una base de datos con <rows> movimientos sintéticos y devuelve el controlador abierto
+    """
+
+    makedirs(config["backups"], exist_ok=True)
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    chunk = []
+
+    for row in generate_rows(list(config["fields"]), rows, seed):
+        chunk.append(row)
+
+        if len(chunk) == chunk_size:
+            controller.update_db_many(chunk)
+            chunk.clear()
+
+    if chunk:
+        controller.update_db_many(chunk)
+
+    return controller
@@ -0,0 +1,230 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+import json
+from os import devnull, environ
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+
+from lib.functions import get_time_now, load_config
+from lib.mainloop import command_type, read_command, run_command
+from lib.rg_controller import RGController
+from lib.session import replay_input
+
+from .ledger import FIELDS, create_ledger, make_config
+
+
+def synthetic_session(fields: dict[str, str], commands: int, seed: int = 0) -> list[str]:
+    """
+    Genera las respuestas de una sesión de <commands> comandos con una mezcla parecida a la de uso real:
+    sobre todo movimientos y consultas de totales, y de vez en cuando informes, exportaciones y ajustes
+    """
+
+    random = Random(seed)
+    names = list(fields)
+    groups = sorted(set(fields.values()))
+
+    def ammount() -> str:
+        return "%.2f" % (round(random.uniform(-200, 500), 2) or 0.01)
+
+    generators = [
+        (40, lambda: [ammount(), "sintético"]),
+        (20, lambda: [random.choice(names).lower(), ammount(), "sintético"]),
+        (15, lambda: ["t", random.choice(names + groups)]),
+        (8, lambda: ["txt"]),
+        (5, lambda: ["printb", random.choice(names + groups), "s", "s", "a", "q"]),
+        (5, lambda: ["adjust"]),
+        (3, lambda: ["csv %s" % random.choice(names).lower()]),
+        (2, lambda: ["sql", "select count(*) from blockchain", "q"]),
+        (2, lambda: ["move 10 1", "move undo"]),
+    ]
+
+    weights = [weight for weight, _ in generators]
+    answers = []
+
+    for _ in range(commands):
+        answers += random.choices(generators, weights)[0][1]()
+
+    return answers + ["q"]
+
+
+def replay(
+    controller: RGController, answers: list[str], memory: bool = True
+) -> list[dict]:
+    """
+    Ejecuta la sesión <answers> con `mainloop` sobre <controller> sin mostrar su salida y devuelve, por
+    comando, su tipo, el tiempo, el número de sentencias SQL ejecutadas (incluidas las de los triggers)
+    y el pico de memoria reservada durante el comando
+    """
+
+    input_fn = replay_input(answers)
+    statements = 0
+    results = []
+
+    def count_statement(statement: str):
+        nonlocal statements
+        statements += 1
+
+    controller.set_trace_callback(count_statement)
+
+    if memory:
+        tracemalloc.start()
+
+    try:
+        with open(devnull, "w") as output, redirect_stdout(output):
+            while True:
+                try:
+                    cmd = read_command(controller, input_fn)
+
+                except EOFError:
+                    break
+
+                statements = 0
+                baseline = 0
+
+                if memory:
+                    tracemalloc.reset_peak()
+                    baseline = tracemalloc.get_traced_memory()[0]
+
+                start = perf_counter()
+
+                try:
+                    keep_going = run_command(controller, cmd, input_fn)
+
+                except EOFError:
+                    # La sesión grabada terminó en medio de un comando
+                    keep_going = False
+
+                results.append(
+                    {
+                        "command": command_type(controller, cmd),
+                        "seconds": perf_counter() - start,
+                        "statements": statements,
+                        "peak_bytes": (
+                            tracemalloc.get_traced_memory()[1] - baseline if memory else 0
+                        ),
+                    }
+                )
+
+                if not keep_going:
+                    break
+
+    finally:
+        controller.set_trace_callback(None)
+
+        if memory:
+            tracemalloc.stop()
+
+    return results
+
+
+def summarize(results: list[dict]) -> list[dict]:
+    """
+    Agrupa los resultados de `replay` por tipo de comando, ordenados por tiempo total
+    """
+
+    summary = {}
+
+    for result in results:
+        entry = summary.setdefault(
+            result["command"],
+            {
+                "command": result["command"],
+                "count": 0,
+                "total_s": 0.0,
+                "max_ms": 0.0,
+                "statements": 0,
+                "peak_kib": 0.0,
+            },
+        )
+
+        entry["count"] += 1
+        entry["total_s"] += result["seconds"]
+        entry["max_ms"] = max(entry["max_ms"], result["seconds"] * 1000)
+        entry["statements"] += result["statements"]
+        entry["peak_kib"] = max(entry["peak_kib"], result["peak_bytes"] / 1024)
+
+    for entry in summary.values():
+        entry["mean_ms"] = entry["total_s"] * 1000 / entry["count"]
+
+    return sorted(summary.values(), key=lambda entry: entry["total_s"], reverse=True)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Reproduce una sesión de rgcap (grabada con `main.py record` o sintética) sobre una "
+        "base de datos temporal y mide cada tipo de comando"
+    )
+    parser.add_argument("session", nargs="?", help="sesión grabada. Por defecto, una sintética")
+    parser.add_argument("--rows", type=int, default=10_000, help="movimientos del ledger inicial")
+    parser.add_argument("--commands", type=int, default=200, help="comandos de la sesión sintética")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--user-fields",
+        action="store_true",
+        help="usar las fuentes de la configuración del usuario (para sesiones grabadas)",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="no medir la memoria (tracemalloc ralentiza los comandos)",
+    )
+    parser.add_argument("--output", help="guardar los resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    # Las gráficas de `stat` no pueden abrir ventanas
+    environ.setdefault("MPLBACKEND", "Agg")
+
+    fields = load_config()["fields"] if args.user_fields else FIELDS
+
+    if args.session:
+        with open(args.session, encoding="utf-8") as file:
+            answers = file.read().splitlines()
+
+    else:
+        answers = synthetic_session(fields, args.commands, args.seed)
+
+    with TemporaryDirectory() as folder:
+        controller = create_ledger(make_config(folder, fields), args.rows, args.seed)
+
+        start = perf_counter()
+        results = replay(controller, answers, memory=not args.no_memory)
+        elapsed = perf_counter() - start
+
+        controller.close()
+
+    summary = summarize(results)
+
+    print(
+        "{:<12} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "comando", "veces", "total s", "media ms", "max ms", "sql/cmd", "pico KiB"
+        )
+    )
+
+    for entry in summary:
+        print(
+            "{command:<12} {count:>6} {total_s:>10.3f} {mean_ms:>10.2f} {max_ms:>10.2f} {0:>10.1f} {peak_kib:>10.0f}".format(
+                entry["statements"] / entry["count"], **entry
+            )
+        )
+
+    print("\n%d comandos en %.2f s (%d movimientos iniciales)" % (len(results), elapsed, args.rows))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "date": get_time_now(),
+                    "rows": args.rows,
+                    "session": args.session or "synthetic",
+                    "summary": summary,
+                    "commands": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from argparse import ArgumentParser
+import json
+from os import environ, makedirs, path
+from statistics import median
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from lib.constants import CONFIG_FILE
+
+MAIN = path.join(path.dirname(path.dirname(path.abspath(__file__))), "main.py")
+PROMPT = "Ingresa una opción".encode()
+
+CONFIG = """
+db_route = "{home}/rgcap/rgcap.db"
+backups = "{home}/rgcap/backups/"
+default_field = "CASH"
+
+[fields]
+CASH = "EFECTIVO"
+BANK = "BANCO"
+"""
+
+
+def time_startup(home: str) -> float:
+    """
+    Lanza `main.py` y devuelve los segundos que tarda en mostrar el primer prompt
+    """
+
+    start = perf_counter()
+
+    process = subprocess.Popen(
+        [sys.executable, MAIN],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env={**environ, "HOME": home},
+    )
+
+    output = b""
+
+    while PROMPT not in output:
+        chunk = process.stdout.read1(4096)
+
+        if not chunk:
+            raise RuntimeError("main.py terminó sin mostrar el prompt")
+
+        output += chunk
+
+    elapsed = perf_counter() - start
+
+    process.communicate(b"q\n")
+
+    return elapsed
+
+
+def time_client(home: str) -> float:
+    """
+    Lanza `main.py client` para registrar un movimiento en el demonio y devuelve los segundos que tarda
+    """
+
+    start = perf_counter()
+
+    subprocess.run(
+        [sys.executable, MAIN, "client", "1", "benchmark"],
+        stdout=subprocess.DEVNULL,
+        env={**environ, "HOME": home},
+        check=True,
+    )
+
+    return perf_counter() - start
+
+
+def start_daemon(home: str) -> subprocess.Popen:
+    """
+    Lanza `main.py daemon` y espera a que escuche en su socket
+    """
+
+    process = subprocess.Popen(
+        [sys.executable, MAIN, "daemon"],
+        stdout=subprocess.PIPE,
+        env={**environ, "HOME": home},
+    )
+
+    if not process.stdout.readline().startswith(b"Escuchando"):
+        raise RuntimeError("el demonio terminó sin escuchar en su socket")
+
+    return process
+
+
+def summary(name: str, times: list[float]) -> dict:
+    results = {
+        "benchmark": name,
+        "runs": len(times),
+        "min_ms": min(times) * 1000,
+        "median_ms": median(times) * 1000,
+        "max_ms": max(times) * 1000,
+    }
+
+    print(
+        "{benchmark}: min {min_ms:.1f} ms | mediana {median_ms:.1f} ms | max {max_ms:.1f} ms".format(
+            **results
+        )
+    )
+
+    return results
+
+
+def main():
+    parser = ArgumentParser(
+        description="Mide el tiempo desde que se lanza rgcap hasta el primer prompt, y el de registrar un movimiento a través del demonio"
+    )
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as home:
+        config_route = path.join(home, CONFIG_FILE.removeprefix("~/"))
+
+        makedirs(path.dirname(config_route), exist_ok=True)
+
+        with open(config_route, "w") as file:
+            file.write(CONFIG.format(home=home))
+
+        # El primer arranque crea la base de datos y no se cuenta
+        time_startup(home)
+
+        results = [summary("startup", [time_startup(home) for _ in range(args.runs)])]
+
+        # Registrar un movimiento a través del demonio, que ya tiene la base de datos abierta
+        daemon = start_daemon(home)
+
+        try:
+            results.append(
+                summary("client", [time_client(home) for _ in range(args.runs)])
+            )
+
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from .read_pool import ReadPool
+from .rg_controller import RGController
+
+
+class AsyncRGController:
+    """
+    Versión asíncrona de `RGController` para usarla desde un bucle de asyncio.
+
+    Todas las escrituras se ejecutan en orden en un único hilo con su propia conexión, y las lecturas
+    se reparten entre las conexiones de solo lectura de un `ReadPool`. Una escritura ya enviada se
+    completa aunque se cancele la tarea que la espera, y `aclose` espera a todas las pendientes.
+
+        async with AsyncRGController(config) as controller:
+            await controller.update_db("CASH", 10)
+            total = await controller.get_sum_of("CASH")
+    """
+
+    def __init__(self, config: dict, readers: int = 4):
+        """
+        config:     configuración de rgcap (ver `load_config`)
+        readers:    número de conexiones de solo lectura
+        """
+
+        self.config = config
+        self.closed = False
+
+        self.__connection = None
+        self.__writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="rgcap-write",
+            initializer=self.__open_writer,
+        )
+        self.__readers = ReadPool(config, readers)
+
+    def __open_writer(self):
+        """
+        Abre la conexión de escritura dentro del hilo de escritura y crea la base de datos si no existe
+        """
+
+        self.__connection = RGController(self.config, autocommit=True)
+        self.__connection.create_db()
+
+    def __close_writer(self):
+        self.__connection.close()
+
+    async def __write(self, fn: Callable, *args, **kwargs):
+        """
+        Encola `fn(conexión de escritura, *args, **kwargs)` en el hilo de escritura y espera su resultado
+        """
+
+        if self.closed:
+            raise RuntimeError("AsyncRGController cerrado")
+
+        future = self.__writer.submit(
+            lambda: fn(self.__connection, *args, **kwargs)
+        )
+
+        # `shield` evita que cancelar la espera cancele la escritura ya encolada
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def __read(self, fn: Callable, *args, **kwargs):
+        """
+        Ejecuta `fn(conexión de solo lectura, *args, **kwargs)` en el pool de lectura y espera su resultado
+        """
+
+        if self.closed:
+            raise RuntimeError("AsyncRGController cerrado")
+
+        return await asyncio.wrap_future(self.__readers.submit(fn, *args, **kwargs))
+
+    async def open(self):
+        """
+        Espera a que la conexión de escritura esté abierta y la base de datos creada
+        """
+
+        await self.__write(lambda connection: None)
+
+    async def update_db(
+        self,
+        field: str,
+        ammount: float,
+        description: str = "",
+        update_total: bool = True,
+        external_id: str | None = None,
+    ) -> int:
+        return await self.__write(
+            RGController.update_db, field, ammount, description, update_total, external_id
+        )
+
+    async def update_db_many(
+        self, rows: list, update_total: bool = True, dedup: bool = False
+    ) -> dict:
+        return await self.__write(RGController.update_db_many, list(rows), update_total, dedup)
+
+    async def adjust_total(self, full: bool = False) -> dict:
+        return await self.__write(RGController.adjust_total, full)
+
+    async def create_local_backup(self, verbose: bool = False) -> str:
+        return await self.__write(RGController.create_local_backup, verbose)
+
+    async def restore_local_backup(self, **kwargs) -> int:
+        return await self.__write(RGController.restore_local_backup, **kwargs)
+
+    async def get_sum_of(self, fuente: str, ndigits: int = 2) -> float:
+        return await self.__read(RGController.get_sum_of, fuente, ndigits)
+
+    async def get_sums(self, ndigits: int = 2) -> dict:
+        return await self.__read(RGController.get_sums, ndigits)
+
+    async def get_df_blockchain(self, fuente: str = ""):
+        return await self.__read(RGController.get_df_blockchain, fuente)
+
+    async def get_df_total(self, fuente: str = ""):
+        return await self.__read(RGController.get_df_total, fuente)
+
+    async def get_daily_balance(self, activo: str):
+        return await self.__read(RGController.get_daily_balance, activo)
+
+    async def get_balance_at(self, activo: str, day: str | date) -> float | None:
+        return await self.__read(RGController.get_balance_at, activo, day)
+
+    async def aclose(self):
+        """
+        Espera a que terminen todas las escrituras encoladas y cierra todas las conexiones
+        """
+
+        if self.closed:
+            return
+
+        self.closed = True
+
+        loop = asyncio.get_running_loop()
+
+        # La conexión de escritura solo se puede cerrar desde su hilo, detrás de las escrituras pendientes
+        self.__writer.submit(self.__close_writer)
+
+        await loop.run_in_executor(None, self.__writer.shutdown, True)
+        await loop.run_in_executor(None, self.__readers.close)
+
+    async def __aenter__(self) -> "AsyncRGController":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,86 @@
+from codecs import getincrementaldecoder
+import socket
+import sys
+from threading import Thread
+
+
+def connect(route: str, prompts: bool) -> socket.socket:
+    """
+    Abre una sesión con el demonio que escucha en <route>
+    """
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(route)
+    client.sendall(b"prompts=1\n" if prompts else b"prompts=0\n")
+
+    return client
+
+
+def send(route: str, lines: list[str]) -> str:
+    """
+    Envía al demonio las respuestas <lines>, una por línea (p. ej. ["25", "comida"] para registrar 25 en
+    `default_field`), y devuelve todo lo que imprimió la sesión
+    """
+
+    with connect(route, prompts=False) as client:
+        client.sendall("".join(line + "\n" for line in lines).encode())
+        client.shutdown(socket.SHUT_WR)
+
+        chunks = []
+
+        while chunk := client.recv(65536):
+            chunks.append(chunk)
+
+    return b"".join(chunks).decode()
+
+
+def interact(route: str):
+    """
+    Sesión interactiva con el demonio: reenvía la entrada estándar y muestra la salida a medida que llega.
+    Termina cuando el demonio cierra la sesión (comando `q`) o se acaba la entrada.
+    """
+
+    with connect(route, prompts=True) as client:
+
+        def forward_input():
+            try:
+                for line in sys.stdin:
+                    client.sendall(line.encode())
+
+                client.shutdown(socket.SHUT_WR)
+
+            except OSError:
+                pass
+
+        Thread(target=forward_input, daemon=True).start()
+
+        # Un carácter puede llegar partido entre dos bloques
+        decoder = getincrementaldecoder("utf-8")()
+
+        try:
+            while chunk := client.recv(65536):
+                sys.stdout.write(decoder.decode(chunk))
+                sys.stdout.flush()
+
+        except KeyboardInterrupt:
+            pass
+
+
+def main(route: str, args: list[str]) -> int:
+    """
+    Punto de entrada del cliente. Sin argumentos abre una sesión interactiva; con argumentos los envía
+    como respuestas y termina
+    """
+
+    try:
+        if args:
+            sys.stdout.write(send(route, args))
+
+        else:
+            interact(route)
+
+    except (ConnectionRefusedError, FileNotFoundError):
+        print("error: no hay ningún demonio escuchando en %s" % route, file=sys.stderr)
+        return 1
+
+    return 0
@@ -0,0 +1,237 @@
+"""
+Esquema compacto de la tabla `blockchain`.
+
+Las fuentes se guardan una sola vez en la tabla `fuentes` (con su grupo, el mapa `fields` de la
+configuración) y los movimientos en `blockchain_data`, que referencia la fuente por un id entero y guarda
+la cantidad en céntimos enteros. `blockchain` pasa a ser una vista con las mismas columnas de siempre y
+triggers `INSTEAD OF` para insertar, modificar y borrar a través de ella, así que las consultas y el SQL
+directo siguen funcionando igual.
+
+Para convertir una base de datos existente (se crea antes una copia de seguridad):
+
+    python -m lib.compact
+
+Las bases de datos nuevas se crean con este esquema si la configuración tiene `compact = true`.
+"""
+
+from __future__ import annotations
+
+from os import path
+import sqlite3
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .rg_controller import RGController
+
+
+def is_compact(connection: sqlite3.Connection) -> bool:
+    """
+    Comprueba si la base de datos usa el esquema compacto (`blockchain` es una vista)
+    """
+
+    row = connection.execute(
+        "SELECT type FROM sqlite_master WHERE name=?", (connection.main_name,)
+    ).fetchone()
+
+    return row is not None and row[0] == "view"
+
+
+def has_cent_fractions(ammount: float) -> bool:
+    """
+    Indica si <ammount> tiene fracciones de céntimo, que el esquema compacto no puede guardar. Es el mismo
+    criterio que aplica `convert` a los movimientos existentes
+    """
+
+    return abs(ammount * 100 - round(ammount * 100)) > 1e-6
+
+
+def names(connection: sqlite3.Connection) -> dict[str, str]:
+    """
+    Nombres de tablas y columnas usados en las sentencias del esquema compacto
+    """
+
+    return {
+        "table": connection.main_name,
+        "data": connection.main_data_name,
+        "fuentes": connection.fuentes_name,
+        "state": connection.state_name,
+        "field": connection.field_col_name,
+        "ammount": connection.ammount_col_name,
+        "datetime": connection.datetime_col_name,
+        "description": connection.description_col_name,
+        "epoch": connection.epoch_col_name,
+        "huella": connection.fingerprint_col_name,
+    }
+
+
+def sync_fuentes(connection: sqlite3.Connection, fields: dict[str, str]):
+    """
+    Añade a la tabla `fuentes` las fuentes de <fields> que falten y actualiza su grupo
+    """
+
+    connection.executemany(
+        "INSERT INTO %(fuentes)s (%(field)s, grupo) VALUES (?, ?) \
+        ON CONFLICT (%(field)s) DO UPDATE SET grupo=excluded.grupo WHERE grupo IS NOT excluded.grupo"
+        % names(connection),
+        [(field.upper(), group.upper()) for field, group in fields.items()],
+    )
+
+
+def create_schema(connection: sqlite3.Connection):
+    """
+    Crea la vista `blockchain` sobre `blockchain_data` con sus triggers e índices. Deben existir ya las
+    tablas `fuentes` y `blockchain_data`, y no la tabla `blockchain`.
+    """
+
+    n = names(connection)
+
+    connection.execute(
+        "CREATE VIEW %(table)s AS SELECT f.%(field)s AS %(field)s, d.centimos / 100.0 AS %(ammount)s, \
+        d.%(datetime)s AS %(datetime)s, d.id AS id, d.%(description)s AS %(description)s, d.%(epoch)s AS %(epoch)s, \
+        d.%(huella)s AS %(huella)s FROM %(data)s AS d JOIN %(fuentes)s AS f USING (fuente_id)"
+        % n
+    )
+
+    # (fuente_id, id, centimos) cubre las sumas por fuente y la paginación sin leer la tabla
+    for index in [
+        "CREATE INDEX IF NOT EXISTS %(data)s_fuente_id_id_centimos ON %(data)s (fuente_id, id, centimos)",
+        "CREATE INDEX IF NOT EXISTS %(data)s_fuente_id_%(epoch)s ON %(data)s (fuente_id, %(epoch)s)",
+        "CREATE INDEX IF NOT EXISTS %(data)s_%(epoch)s ON %(data)s (%(epoch)s)",
+    ]:
+        connection.execute(index % n)
+
+    for trigger in [
+        # Escritura a través de la vista. Una fuente desconocida se añade a `fuentes` sin grupo.
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_insert INSTEAD OF INSERT ON %(table)s BEGIN "
+        "INSERT OR IGNORE INTO %(fuentes)s (%(field)s) VALUES (NEW.%(field)s); "
+        "INSERT INTO %(data)s (id, fuente_id, centimos, %(datetime)s, %(description)s, %(epoch)s, %(huella)s) VALUES ("
+        "NEW.id, (SELECT fuente_id FROM %(fuentes)s WHERE %(field)s=NEW.%(field)s), "
+        "CAST(round(NEW.%(ammount)s * 100) AS INTEGER), NEW.%(datetime)s, IFNULL(NEW.%(description)s, ''), "
+        "IFNULL(NEW.%(epoch)s, CAST(strftime('%%s', NEW.%(datetime)s) AS INTEGER)), NEW.%(huella)s); END",
+        # Cada columna se actualiza solo si cambia, para no contar como reescritura un cambio de descripción.
+        # El id se cambia al final porque las sentencias anteriores buscan el registro por OLD.id.
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_update INSTEAD OF UPDATE ON %(table)s BEGIN "
+        "INSERT OR IGNORE INTO %(fuentes)s (%(field)s) VALUES (NEW.%(field)s); "
+        "UPDATE %(data)s SET fuente_id=(SELECT fuente_id FROM %(fuentes)s WHERE %(field)s=NEW.%(field)s) "
+        "WHERE id=OLD.id AND NEW.%(field)s IS NOT OLD.%(field)s; "
+        "UPDATE %(data)s SET centimos=CAST(round(NEW.%(ammount)s * 100) AS INTEGER) "
+        "WHERE id=OLD.id AND NEW.%(ammount)s IS NOT OLD.%(ammount)s; "
+        "UPDATE %(data)s SET %(datetime)s=NEW.%(datetime)s WHERE id=OLD.id AND NEW.%(datetime)s IS NOT OLD.%(datetime)s; "
+        "UPDATE %(data)s SET %(description)s=NEW.%(description)s "
+        "WHERE id=OLD.id AND NEW.%(description)s IS NOT OLD.%(description)s; "
+        "UPDATE %(data)s SET %(epoch)s=NEW.%(epoch)s WHERE id=OLD.id AND NEW.%(epoch)s IS NOT OLD.%(epoch)s; "
+        "UPDATE %(data)s SET %(huella)s=NEW.%(huella)s WHERE id=OLD.id AND NEW.%(huella)s IS NOT OLD.%(huella)s; "
+        "UPDATE %(data)s SET id=NEW.id WHERE id=OLD.id AND NEW.id IS NOT OLD.id; END",
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_delete INSTEAD OF DELETE ON %(table)s BEGIN "
+        "DELETE FROM %(data)s WHERE id=OLD.id; END",
+        # Los mismos triggers que mantienen `blockchain_state` y `epoch` en el esquema normal
+        "CREATE TRIGGER IF NOT EXISTS %(data)s_rewrite_update AFTER UPDATE OF fuente_id, centimos, %(datetime)s ON %(data)s "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS %(data)s_rewrite_id AFTER UPDATE OF id ON %(data)s "
+        "WHEN (SELECT shifting FROM %(state)s)=0 BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS %(data)s_rewrite_delete AFTER DELETE ON %(data)s "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS %(data)s_rewrite_insert AFTER INSERT ON %(data)s WHEN NEW.id < (SELECT MAX(id) FROM %(data)s) "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS %(data)s_%(epoch)s_insert AFTER INSERT ON %(data)s WHEN NEW.%(epoch)s IS NULL "
+        "BEGIN UPDATE %(data)s SET %(epoch)s=CAST(strftime('%%s', NEW.%(datetime)s) AS INTEGER) WHERE id=NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS %(data)s_%(epoch)s_update AFTER UPDATE OF %(datetime)s ON %(data)s "
+        "BEGIN UPDATE %(data)s SET %(epoch)s=CAST(strftime('%%s', NEW.%(datetime)s) AS INTEGER) WHERE id=NEW.id; END",
+    ]:
+        connection.execute(trigger % n)
+
+    from .fingerprint import create_index
+
+    create_index(connection)
+
+
+def convert(connection: RGController) -> int:
+    """
+    Convierte la base de datos al esquema compacto y devuelve el número de registros convertidos. Se debe
+    ejecutar dentro de una transacción (ver `RGController.compact_db`). Lanza `ValueError` si algún
+    movimiento tiene fracciones de céntimo, porque no se podría guardar sin perder precisión.
+    """
+
+    n = names(connection)
+
+    inexact = connection.execute(
+        "SELECT COUNT(*) FROM %(table)s WHERE abs(%(ammount)s * 100 - round(%(ammount)s * 100)) > 1e-6" % n
+    ).fetchone()[0]
+
+    if inexact:
+        raise ValueError(
+            "%d movimientos tienen fracciones de céntimo y no se pueden convertir" % inexact
+        )
+
+    connection.execute(
+        "CREATE TABLE %(fuentes)s ( fuente_id INTEGER PRIMARY KEY NOT NULL, %(field)s TEXT NOT NULL UNIQUE, grupo TEXT )"
+        % n
+    )
+
+    sync_fuentes(connection, connection.fields)
+
+    connection.execute(
+        "INSERT OR IGNORE INTO %(fuentes)s (%(field)s) SELECT DISTINCT %(field)s FROM %(table)s" % n
+    )
+
+    connection.execute(
+        "CREATE TABLE %(data)s ( id INTEGER PRIMARY KEY NOT NULL, fuente_id INTEGER NOT NULL REFERENCES %(fuentes)s (fuente_id), \
+        centimos INTEGER NOT NULL, %(datetime)s TEXT NOT NULL, %(description)s TEXT NOT NULL DEFAULT '', %(epoch)s INTEGER, %(huella)s TEXT )"
+        % n
+    )
+
+    rows = connection.execute(
+        "INSERT INTO %(data)s (id, fuente_id, centimos, %(datetime)s, %(description)s, %(epoch)s, %(huella)s) \
+        SELECT b.id, f.fuente_id, CAST(round(b.%(ammount)s * 100) AS INTEGER), b.%(datetime)s, b.%(description)s, b.%(epoch)s, \
+        b.%(huella)s \
+        FROM %(table)s AS b JOIN %(fuentes)s AS f USING (%(field)s) ORDER BY b.id"
+        % n
+    ).rowcount
+
+    connection.execute("DROP TABLE %(table)s" % n)
+
+    create_schema(connection)
+
+    # Invalida la última verificación de `adjust_total`, el resumen diario y el snapshot
+    connection.execute("UPDATE %(state)s SET rewrites = rewrites + 1" % n)
+    connection.execute("DELETE FROM %s" % connection.reconciliation_name)
+
+    return rows
+
+
+def main():
+    from .functions import load_config
+    from .rg_controller import RGController
+
+    config = load_config()
+
+    controller = RGController(config, autocommit=True)
+
+    if controller.compact:
+        print("La base de datos ya usa el esquema compacto")
+        controller.close()
+        return
+
+    route = path.expanduser(config["db_route"])
+    size = path.getsize(route)
+
+    controller.create_local_backup()
+
+    try:
+        rows = controller.compact_db()
+
+    except ValueError as e:
+        print("error: %s" % e)
+        return
+
+    finally:
+        controller.close()
+
+    print(
+        "%d registros convertidos. Tamaño: %.1f KiB -> %.1f KiB"
+        % (rows, size / 1024, path.getsize(route) / 1024)
+    )
+
+
+if __name__ == "__main__":
+    main()
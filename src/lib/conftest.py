@@ -0,0 +1,27 @@
+import pytest
+
+from .rg_controller import RGController
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        "db_route": str(tmp_path / "rgcap.db"),
+        "backups": str(tmp_path / "backups") + "/",
+        "default_field": "CASH",
+        "fields": {
+            "CASH": "EFECTIVO",
+            "BANK": "BANCO",
+            "CARD": "BANCO",
+        },
+    }
+
+
+@pytest.fixture
+def controller(config):
+    connection = RGController(config, autocommit=True)
+    connection.create_db()
+
+    yield connection
+
+    connection.close()
@@ -0,0 +1,140 @@
+from contextlib import redirect_stdout
+from os import path, remove
+import signal
+import socket
+import socketserver
+import traceback
+
+from .functions import get_socket_route
+from .mainloop import mainloop
+from .rg_controller import RGController
+
+
+class SessionHandler(socketserver.BaseRequestHandler):
+    """
+    Atiende una sesión de cliente: ejecuta `mainloop` leyendo cada respuesta de una línea del socket
+    y enviando por él todo lo que se imprime. La primera línea indica si se envían también los prompts
+    (`prompts=1`, sesión interactiva) o no (`prompts=0`, scripts).
+
+    La sesión termina con el comando `q` o cuando el cliente cierra su lado del socket.
+    """
+
+    def handle(self):
+        reader = self.request.makefile("r", encoding="utf-8", newline="\n")
+        writer = self.request.makefile("w", encoding="utf-8", newline="\n")
+
+        prompts = reader.readline().strip() == "prompts=1"
+
+        def input_fn(prompt: str = "") -> str:
+            if prompts:
+                writer.write(prompt)
+
+            writer.flush()
+
+            line = reader.readline()
+
+            if not line:
+                raise EOFError
+
+            return line.rstrip("\n")
+
+        try:
+            with redirect_stdout(writer):
+                mainloop(self.server.controller, input_fn)
+
+        except EOFError:
+            pass
+
+        except Exception:
+            # Un error en un comando no debe tumbar el demonio
+            writer.write(traceback.format_exc())
+
+        finally:
+            try:
+                writer.flush()
+
+            except OSError:
+                pass
+
+            reader.close()
+            writer.close()
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """
+    Demonio de rgcap: mantiene abierto un `RGController` (con su caché y los módulos ya importados) y
+    atiende en un socket Unix los mismos comandos que `mainloop`, una sesión detrás de otra.
+
+        python main.py daemon             # arrancar el demonio
+        python main.py client 25 comida   # registrar 25 en `default_field` con la descripción "comida"
+    """
+
+    def __init__(self, config: dict):
+        """
+        config:    configuración de rgcap (ver `load_config`)
+        """
+
+        self.config = config
+        self.route = get_socket_route(config)
+
+        self.__remove_stale_socket()
+
+        # Las sesiones se atienden de una en una, pero no necesariamente en el hilo que abrió la conexión
+        self.controller = RGController(config, autocommit=True, check_same_thread=False)
+        self.controller.create_db()
+
+        super().__init__(self.route, SessionHandler)
+
+    def __remove_stale_socket(self):
+        """
+        Borra el socket de un demonio anterior que terminó sin borrarlo. Lanza `RuntimeError` si el
+        demonio sigue en marcha
+        """
+
+        if not path.exists(self.route):
+            return
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(self.route)
+
+            except (ConnectionRefusedError, FileNotFoundError):
+                remove(self.route)
+                return
+
+        raise RuntimeError("Ya hay un demonio escuchando en %s" % self.route)
+
+    def server_close(self):
+        super().server_close()
+
+        self.controller.close()
+
+        if path.exists(self.route):
+            remove(self.route)
+
+
+def serve(config: dict):
+    """
+    Arranca el demonio y atiende sesiones hasta que se interrumpe (Ctrl+C o SIGTERM)
+    """
+
+    # Los informes y gráficas ya no pagan la importación en cada sesión
+    try:
+        import pandas  # noqa: F401
+
+    except ModuleNotFoundError:
+        pass
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+    with Daemon(config) as daemon:
+        print("Escuchando en %s" % daemon.route)
+
+        try:
+            daemon.serve_forever()
+
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,177 @@
+"""
+Huella de los movimientos de la tabla `blockchain`.
+
+La columna `huella` guarda un hash de la fuente, la cantidad en céntimos, la hora, la descripción y el
+identificador externo del movimiento (p. ej. la referencia del banco), y tiene un índice único: SQLite
+rechaza un movimiento repetido al insertarlo, así que volver a importar un extracto o reenviar un lote no
+lo duplica.
+
+Solo tienen huella al insertarse los movimientos que se pueden reconocer si llegan otra vez: los que
+traen un identificador externo y los lotes insertados con `update_db_many(..., dedup=True)`, como los
+extractos de `import_statement`. Los movimientos escritos a mano no la tienen, porque dos movimientos
+iguales en el mismo segundo pueden ser legítimos.
+
+Tampoco tienen huella los registros insertados con SQL directo ni aquellos cuya fuente, cantidad, hora o
+descripción se modifica. Para calcularla (sin identificador externo) y buscar los duplicados que ya
+existan en la base de datos:
+
+    python -m lib.fingerprint [--delete]
+"""
+
+from __future__ import annotations
+
+from hashlib import sha256
+import sqlite3
+import sys
+
+from .compact import is_compact
+
+
+# Número de caracteres hexadecimales que se guardan del sha256 (128 bits)
+LENGTH = 32
+
+
+def fingerprint(
+    fuente: str, ammount: float, hora: str, description: str = "", external_id: str = ""
+) -> str:
+    """
+    Devuelve la huella de un movimiento. La cantidad se redondea a céntimos para que 10, 10.0 y la
+    misma cantidad leída del esquema compacto den la misma huella
+    """
+
+    content = "\x1f".join(
+        [
+            fuente.upper(),
+            str(int(round(ammount * 100))),
+            hora,
+            description or "",
+            external_id or "",
+        ]
+    )
+
+    return sha256(content.encode()).hexdigest()[:LENGTH]
+
+
+def register(connection: sqlite3.Connection):
+    """
+    Registra `fingerprint` en <connection> como la función SQL `huella(fuente, cantidad, hora, descripción,
+    id externo)`
+    """
+
+    connection.create_function("huella", 5, fingerprint, deterministic=True)
+
+
+def names(connection: sqlite3.Connection) -> dict[str, str]:
+    """
+    Nombres de tablas y columnas usados en las sentencias de este módulo
+    """
+
+    return {
+        "table": connection.main_name,
+        "data": connection.main_data_name,
+        "fuentes": connection.fuentes_name,
+        "field": connection.field_col_name,
+        "ammount": connection.ammount_col_name,
+        "datetime": connection.datetime_col_name,
+        "description": connection.description_col_name,
+        "huella": connection.fingerprint_col_name,
+    }
+
+
+def create_index(connection: sqlite3.Connection):
+    """
+    Crea el índice único de la columna `huella` y el trigger que la borra cuando cambia el contenido del
+    movimiento. En el esquema compacto, sobre la tabla `blockchain_data`
+    """
+
+    n = names(connection)
+
+    if is_compact(connection):
+        statements = [
+            "CREATE UNIQUE INDEX IF NOT EXISTS %(data)s_%(huella)s ON %(data)s (%(huella)s)",
+            "CREATE TRIGGER IF NOT EXISTS %(data)s_%(huella)s_update "
+            "AFTER UPDATE OF fuente_id, centimos, %(datetime)s, %(description)s ON %(data)s WHEN NEW.%(huella)s IS NOT NULL "
+            "BEGIN UPDATE %(data)s SET %(huella)s=NULL WHERE id=NEW.id; END",
+        ]
+
+    else:
+        statements = [
+            "CREATE UNIQUE INDEX IF NOT EXISTS %(table)s_%(huella)s ON %(table)s (%(huella)s)",
+            "CREATE TRIGGER IF NOT EXISTS %(table)s_%(huella)s_update "
+            "AFTER UPDATE OF %(field)s, %(ammount)s, %(datetime)s, %(description)s ON %(table)s WHEN NEW.%(huella)s IS NOT NULL "
+            "BEGIN UPDATE %(table)s SET %(huella)s=NULL WHERE id=NEW.id; END",
+        ]
+
+    for statement in statements:
+        connection.execute(statement % n)
+
+
+def backfill(connection: sqlite3.Connection) -> int:
+    """
+    Calcula la huella (sin identificador externo) de los registros que no la tienen, en orden de id.
+    Los que repiten la huella de otro registro se quedan sin ella: son los duplicados que devuelve
+    `find_duplicates`. Devuelve el número de registros a los que se les asignó huella.
+    """
+
+    n = names(connection)
+
+    # `OR IGNORE` salta los registros que chocarían con el índice único
+    if is_compact(connection):
+        statement = (
+            "UPDATE OR IGNORE %(data)s SET %(huella)s=huella("
+            "(SELECT %(field)s FROM %(fuentes)s AS f WHERE f.fuente_id=%(data)s.fuente_id), "
+            "centimos / 100.0, %(datetime)s, %(description)s, '') WHERE %(huella)s IS NULL"
+        )
+
+    else:
+        statement = (
+            "UPDATE OR IGNORE %(table)s SET %(huella)s=huella("
+            "%(field)s, %(ammount)s, %(datetime)s, %(description)s, '') WHERE %(huella)s IS NULL"
+        )
+
+    return connection.execute(statement % n).rowcount
+
+
+def find_duplicates(connection: sqlite3.Connection) -> dict[int, int]:
+    """
+    Devuelve los registros sin huella que repiten el contenido de otro registro, como
+    {id del duplicado: id del registro original}. Se debe llamar después de `backfill`
+    """
+
+    rows = connection.execute(
+        "SELECT d.id, o.id FROM %(table)s AS d JOIN %(table)s AS o "
+        "ON o.%(huella)s=huella(d.%(field)s, d.%(ammount)s, d.%(datetime)s, d.%(description)s, '') "
+        "WHERE d.%(huella)s IS NULL ORDER BY d.id" % names(connection)
+    ).fetchall()
+
+    return dict(rows)
+
+
+def main():
+    from .functions import load_config
+    from .rg_controller import RGController
+
+    delete = sys.argv[1:] == ["--delete"]
+
+    controller = RGController(load_config(), autocommit=True)
+
+    try:
+        if delete:
+            controller.create_local_backup()
+
+        duplicates = controller.dedup(delete=delete)
+
+    finally:
+        controller.close()
+
+    for duplicate, original in duplicates.items():
+        print("%d duplica a %d" % (duplicate, original))
+
+    print(
+        "%d duplicados %s"
+        % (len(duplicates), "borrados" if delete else "encontrados (--delete para borrarlos)")
+    )
+
+
+if __name__ == "__main__":
+    main()
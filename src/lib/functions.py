@@ -1,7 +1,7 @@
+from collections.abc import Callable
 from datetime import datetime
-from os import system as os_system
-from platform import system as platform_system
-from re import fullmatch
+from os import path, system as os_system
+from re import compile as re_compile
 from pathlib import Path
 
 import tomllib
@@ -29,6 +29,8 @@ def clear_screen():
     """
     Intenta limpiar la terminal. (Solo para sistemas Windows y Linux)
     """
+    from platform import system as platform_system
+
     system = platform_system()
 
     if system == "Windows":
@@ -47,6 +49,11 @@ def get_time_now(format: str = "%Y-%m-%d %H:%M:%S") -> str:
     return datetime.now().strftime(format)
 
 
+# Cantidades aceptadas por `float_from_str`: signo opcional y punto o coma decimal ("4", "-3,5", ",5", "4.")
+AMOUNT_PATTERN = "[+-]?(\\d+[\\.\\,]?|[\\.\\,]?\\d+|\\d+[\\.\\,]?\\d+)"
+AMOUNT_REGEX = re_compile(AMOUNT_PATTERN)
+
+
 def float_from_str(string: str) -> float:
     """
     Intenta convertir un dato de tipo `str` a un dato de tipo `float`
@@ -54,29 +61,26 @@ def float_from_str(string: str) -> float:
     Si no se puede, devuelve None
     """
 
-    sign = "[+-]?"
-    number = "\\d+"
-    dot_or_comma = "[\\.\\,]?"
-
-    matches = fullmatch(
-        "%(sign)s(%(number)s%(dot_or_comma)s|%(dot_or_comma)s%(number)s|%(number)s%(dot_or_comma)s%(number)s)"
-        % {
-            "sign": sign,
-            "number": number,
-            "dot_or_comma": dot_or_comma,
-        },
-        string,
-    )
-
-    if matches:
+    if AMOUNT_REGEX.fullmatch(string):
         try:
-            matches = string[matches.start() : matches.end()].replace(",", ".")
-            return float(matches)
+            return float(string.replace(",", "."))
         except ValueError:
             pass
 
     return None
 
 
-def clinput(s: str = "") -> str:
-    return input(s).strip(" /:")
+def clinput(s: str = "", input_fn: Callable[[str], str] = input) -> str:
+    return input_fn(s).strip(" /:")
+
+
+def get_socket_route(config: dict) -> str:
+    """
+    Devuelve la ruta del socket Unix del demonio de rgcap: la opción `socket` de la configuración o,
+    por defecto, la ruta de la base de datos con la extensión `.sock`
+    """
+
+    if "socket" in config:
+        return path.expanduser(config["socket"])
+
+    return path.splitext(path.expanduser(config["db_route"]))[0] + ".sock"
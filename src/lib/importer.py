@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from .functions import AMOUNT_PATTERN, get_time_now
+
+if TYPE_CHECKING:
+    from pandas import DataFrame, Series
+
+    from .rg_controller import RGController
+
+
+# Opciones de la sección [import] del archivo de configuración y sus valores por defecto
+DEFAULT_OPTIONS = {
+    # Columna del archivo de la que sale cada dato del movimiento. Sin columna `field` todos los
+    # movimientos van a la fuente indicada al importar (o `default_field`); sin `datetime`, a la hora actual.
+    # `external_id` (opcional) es la referencia del banco, que forma parte de la huella (ver `lib.fingerprint`)
+    "columns": {
+        "ammount": "cantidad",
+        "datetime": "fecha",
+        "description": "concepto",
+    },
+    # Valores de la columna `field` y la fuente a la que corresponden. Los valores que ya son una fuente
+    # de la configuración no hace falta incluirlos
+    "accounts": {},
+    "delimiter": ",",
+    "encoding": "utf-8",
+    # Formato de las fechas (p. ej. "%d/%m/%Y"). Por defecto, el que deduzca pandas
+    "date_format": None,
+    "dayfirst": False,
+}
+
+
+def get_options(config: dict, options: dict | None = None) -> dict:
+    """
+    Devuelve las opciones de importación: las de <options>, si no las de la sección [import] de la
+    configuración y si no las de `DEFAULT_OPTIONS`
+    """
+
+    result = {**DEFAULT_OPTIONS, **config.get("import", {}), **(options or {})}
+
+    unknown = set(result) - set(DEFAULT_OPTIONS)
+
+    if unknown:
+        raise ValueError("Opción de importación desconocida: %s" % ", ".join(sorted(unknown)))
+
+    unknown = set(result["columns"]) - {"field", "ammount", "datetime", "description", "external_id"}
+
+    if unknown:
+        raise ValueError("Columna de importación desconocida: %s" % ", ".join(sorted(unknown)))
+
+    if "ammount" not in result["columns"]:
+        raise ValueError("Falta la columna `ammount` en las opciones de importación")
+
+    return result
+
+
+def parse_amounts(values: Series) -> Series:
+    """
+    Convierte a la vez toda una columna de texto en cantidades, con las mismas reglas que `float_from_str`
+    (coma o punto decimal). Los valores que no son una cantidad quedan como NaN
+    """
+
+    from pandas import to_numeric
+
+    values = values.str.strip()
+
+    return to_numeric(
+        values.where(values.str.fullmatch(AMOUNT_PATTERN)).str.replace(",", ".", regex=False)
+    )
+
+
+def parse_datetimes(values: Series, date_format: str | None = None, dayfirst: bool = False) -> Series:
+    """
+    Convierte a la vez toda una columna de fechas al formato de la columna `hora` (YYYY-mm-dd HH:MM:SS).
+    Las que no se pueden leer quedan como NaN
+    """
+
+    from pandas import to_datetime
+
+    return to_datetime(
+        values.str.strip(), format=date_format, dayfirst=dayfirst, errors="coerce"
+    ).dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def read_statement(
+    route: str, fields: dict, field: str, options: dict
+) -> tuple[DataFrame, dict[int, str]]:
+    """
+    Lee el extracto <route> y devuelve un DataFrame con las columnas `field`, `ammount`, `description`,
+    `datetime` y `external_id`, ordenado por fecha, y los errores de las líneas que no se pudieron leer ({línea: motivo})
+
+    fields:     fuentes de la configuración
+    field:      fuente de los movimientos si el archivo no tiene columna `field`
+    options:    opciones de importación (ver `get_options`)
+    """
+
+    from pandas import Series, read_csv
+
+    columns = options["columns"]
+
+    df = read_csv(
+        route,
+        sep=options["delimiter"],
+        encoding=options["encoding"],
+        usecols=list(columns.values()),
+        dtype=str,
+        keep_default_na=False,
+    )
+
+    # Línea del archivo de cada fila, contando la cabecera
+    df.index += 2
+
+    statement = df.rename(columns={name: key for key, name in columns.items()})
+
+    if "field" in columns:
+        accounts = {
+            **{key.upper(): key.upper() for key in fields},
+            **{str(key).upper(): value.upper() for key, value in options["accounts"].items()},
+        }
+
+        statement["field"] = statement["field"].str.strip().str.upper().map(accounts)
+
+    else:
+        statement["field"] = field.upper()
+
+    statement["ammount"] = parse_amounts(statement["ammount"])
+
+    if "datetime" in columns:
+        statement["datetime"] = parse_datetimes(
+            statement["datetime"], options["date_format"], options["dayfirst"]
+        )
+
+    else:
+        statement["datetime"] = get_time_now()
+
+    if "description" not in columns:
+        statement["description"] = ""
+
+    if "external_id" in columns:
+        # Sin referencia, la huella depende solo del contenido
+        external_id = statement["external_id"].str.strip()
+        statement["external_id"] = external_id.astype(object).where(external_id != "", None)
+
+    else:
+        statement["external_id"] = None
+
+    invalid = Series("", index=statement.index)
+    invalid = invalid.mask(statement["datetime"].isna(), "fecha no válida")
+    invalid = invalid.mask(statement["ammount"].isna(), "cantidad no válida")
+    invalid = invalid.mask(statement["field"].isna(), "fuente no válida")
+
+    errors = {
+        int(line): "%s: %s" % (reason, dict(df.loc[line]))
+        for line, reason in invalid[invalid != ""].items()
+    }
+
+    statement = statement[invalid == ""].sort_values("datetime", kind="stable")
+
+    return statement[["field", "ammount", "description", "datetime", "external_id"]], errors
+
+
+def import_statement(
+    controller: RGController,
+    route: str,
+    field: str | None = None,
+    options: dict | None = None,
+    update_total: bool = True,
+) -> dict[str, int | dict[int, str]]:
+    """
+    Importa los movimientos del extracto bancario en CSV <route> con `update_db_many`, en una sola
+    transacción. Devuelve el número de movimientos insertados y los errores por línea del archivo.
+    Los movimientos que ya se importaron antes se rechazan como duplicados, así que se puede importar
+    varias veces el mismo extracto o extractos que se solapan.
+
+    field:      fuente de los movimientos si el archivo no tiene columna `field`. Por defecto `default_field`
+    options:    opciones de importación. Por defecto, las de la sección [import] de la configuración
+    """
+
+    options = get_options(controller.config, options)
+    field = (field or controller.default_field).upper()
+
+    if "field" not in options["columns"] and field not in controller.fields:
+        raise ValueError("Fuente no válida: %s" % field)
+
+    statement, errors = read_statement(route, controller.fields, field, options)
+
+    lines = statement.index.tolist()
+
+    result = controller.update_db_many(
+        zip(
+            statement["field"].tolist(),
+            statement["ammount"].tolist(),
+            statement["description"].tolist(),
+            statement["datetime"].tolist(),
+            statement["external_id"].tolist(),
+        ),
+        update_total=update_total,
+        dedup=True,
+    )
+
+    # `update_db_many` indica la posición dentro del lote: se traduce a la línea del archivo
+    errors.update({lines[index]: reason for index, reason in result["errors"].items()})
+
+    return {
+        "inserted": result["inserted"],
+        "errors": dict(sorted(errors.items())),
+    }
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+from functools import wraps
+import json
+from re import compile as re_compile
+import sqlite3
+from threading import RLock
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from .functions import get_time_now
+
+if TYPE_CHECKING:
+    from .rg_controller import RGController
+
+
+# Literales de las sentencias: con `set_trace_callback` llegan con los parámetros ya sustituidos
+LITERALS = re_compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SPACES = re_compile(r"\s+")
+
+# Llamada en curso cuando la sentencia no viene de ningún método de `RGController` (p. ej. el comando `sql`)
+NO_METHOD = "-"
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Sustituye los literales de <statement> por `?` para agrupar las ejecuciones de una misma sentencia
+    """
+
+    return SPACES.sub(" ", LITERALS.sub("?", statement)).strip()
+
+
+class Instrumentation:
+    """
+    Mide dónde se va el tiempo dentro de un `RGController`. Es opcional (`instrument = true` en la
+    configuración, `RGController.instrument` o el comando `perf`) y no cuesta nada mientras no se activa.
+
+    - Cada método público del controlador se sustituye en la instancia por uno que cuenta llamadas, tiempo,
+      sentencias SQL y filas leídas de SQLite.
+    - `set_trace_callback` registra cada sentencia ejecutada, incluidas las de los triggers, agrupada por
+      el método que la lanzó y por su texto sin literales. SQLite solo avisa de cuándo empieza cada
+      sentencia: su tiempo es el que pasa hasta la siguiente o hasta que vuelve el método (incluye leer
+      las filas en Python), así que es una aproximación.
+    - El `row_factory` de la conexión cuenta cada fila que leen sus cursores (los del controlador y los de
+      pandas). La fila se suma a la última sentencia empezada y a los métodos en curso.
+    - `record_command` guarda el tiempo de cada comando de `mainloop`.
+
+        instrumentation = controller.instrument()
+        controller.get_sums()
+        print(instrumentation.report())
+        instrumentation.export_json("perf.json")
+
+    `set_trace_callback` admite una sola función por conexión: no se puede usar a la vez que otra
+    (p. ej. la de `benchmarks.replay`).
+    """
+
+    def __init__(self, controller: RGController):
+        """
+        controller:    conexión a medir. Hay que llamar a `attach` para empezar
+        """
+
+        self.controller = controller
+        self.attached = False
+        self.started = get_time_now()
+
+        self.statements = {}
+        self.methods = {}
+        self.commands = {}
+
+        self.__stack = []
+        self.__pending = None
+        self.__row_factory = None
+        self.__lock = RLock()
+
+    def attach(self):
+        """
+        Empieza a medir: sustituye los métodos públicos de la instancia e instala el trace callback
+        """
+
+        if self.attached:
+            return
+
+        for name in self.__public_methods():
+            setattr(self.controller, name, self.__wrap(name, getattr(self.controller, name)))
+
+        self.controller.set_trace_callback(self.__trace)
+
+        self.__row_factory = self.controller.row_factory
+        self.controller.row_factory = self.__count_row
+
+        self.attached = True
+
+    def detach(self):
+        """
+        Deja de medir y devuelve al controlador sus métodos originales. Los datos se conservan
+        """
+
+        if not self.attached:
+            return
+
+        self.controller.set_trace_callback(None)
+        self.controller.row_factory = self.__row_factory
+
+        for name in self.__public_methods():
+            self.controller.__dict__.pop(name, None)
+
+        with self.__lock:
+            self.__close_pending(perf_counter())
+
+        self.attached = False
+
+    def reset(self):
+        """
+        Descarta todo lo medido hasta ahora
+        """
+
+        with self.__lock:
+            self.statements = {}
+            self.methods = {}
+            self.commands = {}
+            self.__pending = None
+            self.started = get_time_now()
+
+    def __public_methods(self) -> list[str]:
+        """
+        Nombres de los métodos públicos definidos por `RGController` y sus subclases (no los de
+        `sqlite3.Connection`, que usan internamente los propios métodos y pandas)
+        """
+
+        names = set()
+
+        for cls in type(self.controller).__mro__:
+            if cls is sqlite3.Connection or cls is object:
+                break
+
+            names.update(
+                name
+                for name, value in vars(cls).items()
+                if not name.startswith("_") and callable(value)
+            )
+
+        return sorted(names)
+
+    def __wrap(self, name: str, method):
+        """
+        Devuelve <method> midiendo cada llamada en `methods[name]`
+        """
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.__lock:
+                self.__stack.append([name, 0, 0])
+
+            start = perf_counter()
+
+            try:
+                return method(*args, **kwargs)
+
+            finally:
+                end = perf_counter()
+
+                with self.__lock:
+                    self.__close_pending(end)
+
+                    _, statements, rows = self.__stack.pop()
+
+                    entry = self.methods.setdefault(
+                        name, {"calls": 0, "seconds": 0.0, "statements": 0, "rows": 0}
+                    )
+                    entry["calls"] += 1
+                    entry["seconds"] += end - start
+                    entry["statements"] += statements
+                    entry["rows"] += rows
+
+        return wrapper
+
+    def __trace(self, statement: str):
+        """
+        Trace callback de SQLite: cierra la sentencia anterior y empieza a medir <statement>
+        """
+
+        now = perf_counter()
+
+        with self.__lock:
+            self.__close_pending(now)
+
+            site = NO_METHOD
+
+            if self.__stack:
+                site = self.__stack[-1][0]
+
+                # Las sentencias cuentan en todos los métodos en curso
+                for call in self.__stack:
+                    call[1] += 1
+
+            self.__pending = [site, normalize_statement(statement), now, 0]
+
+    def __count_row(self, cursor: sqlite3.Cursor, row: tuple):
+        """
+        `row_factory` de la conexión: cuenta la fila leída y la devuelve sin cambios (o con el `row_factory`
+        que tuviera la conexión antes)
+        """
+
+        with self.__lock:
+            if self.__pending is not None:
+                self.__pending[3] += 1
+
+            for call in self.__stack:
+                call[2] += 1
+
+        return row if self.__row_factory is None else self.__row_factory(cursor, row)
+
+    def __close_pending(self, now: float):
+        """
+        Suma a su sentencia el tiempo de la última sentencia empezada, si la hay
+        """
+
+        if self.__pending is None:
+            return
+
+        site, statement, start, rows = self.__pending
+        self.__pending = None
+
+        entry = self.statements.setdefault(
+            (site, statement), {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0}
+        )
+        entry["count"] += 1
+        entry["rows"] += rows
+        entry["seconds"] += now - start
+        entry["max_seconds"] = max(entry["max_seconds"], now - start)
+
+    def record_command(self, command: str, seconds: float):
+        """
+        Guarda el tiempo de una ejecución del comando <command> de `mainloop`
+        """
+
+        with self.__lock:
+            self.__close_pending(perf_counter())
+
+            entry = self.commands.setdefault(
+                command, {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def top_statements(self, limit: int = 10) -> list[dict]:
+        """
+        Devuelve las <limit> sentencias con más tiempo acumulado
+        """
+
+        with self.__lock:
+            rows = [
+                {"site": site, "statement": statement, **entry}
+                for (site, statement), entry in self.statements.items()
+            ]
+
+        return sorted(rows, key=lambda row: row["seconds"], reverse=True)[:limit]
+
+    def to_dict(self) -> dict:
+        """
+        Todo lo medido, en un diccionario serializable a JSON
+        """
+
+        with self.__lock:
+            return {
+                "started": self.started,
+                "date": get_time_now(),
+                "db": self.controller.db_name,
+                "commands": {name: dict(entry) for name, entry in self.commands.items()},
+                "methods": {name: dict(entry) for name, entry in self.methods.items()},
+                "statements": self.top_statements(len(self.statements)),
+            }
+
+    def export_json(self, route: str) -> str:
+        """
+        Guarda `to_dict` en el archivo JSON <route> y devuelve su ruta
+        """
+
+        with open(route, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+        return route
+
+    def report(self, limit: int = 10) -> str:
+        """
+        Resumen en texto para el comando `perf`: tiempo por comando, por método y las <limit> sentencias
+        con más tiempo acumulado
+        """
+
+        lines = ["{:<14} {:>7} {:>10} {:>10}".format("comando", "veces", "total ms", "max ms")]
+
+        for name, entry in sorted(
+            self.commands.items(), key=lambda item: item[1]["seconds"], reverse=True
+        ):
+            lines.append(
+                "{:<14} {:>7} {:>10.1f} {:>10.1f}".format(
+                    name, entry["count"], entry["seconds"] * 1000, entry["max_seconds"] * 1000
+                )
+            )
+
+        lines += [
+            "",
+            "{:<24} {:>7} {:>10} {:>8} {:>8}".format("método", "veces", "total ms", "sql", "filas"),
+        ]
+
+        for name, entry in sorted(
+            self.methods.items(), key=lambda item: item[1]["seconds"], reverse=True
+        ):
+            lines.append(
+                "{:<24} {:>7} {:>10.1f} {:>8} {:>8}".format(
+                    name,
+                    entry["calls"],
+                    entry["seconds"] * 1000,
+                    entry["statements"],
+                    entry["rows"],
+                )
+            )
+
+        lines += [
+            "",
+            "{:>10} {:>7} {:>8}  {:<24} {}".format("total ms", "veces", "filas", "método", "sentencia"),
+        ]
+
+        for row in self.top_statements(limit):
+            statement = row["statement"]
+
+            if len(statement) > 80:
+                statement = statement[:77] + "..."
+
+            lines.append(
+                "{:>10.1f} {:>7} {:>8}  {:<24} {}".format(
+                    row["seconds"] * 1000, row["count"], row["rows"], row["site"], statement
+                )
+            )
+
+        return "\n".join(lines)
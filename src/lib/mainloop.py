@@ -1,284 +1,649 @@
-from pandas import read_sql
+from collections.abc import Callable
+from os import path
+import sqlite3
+from time import perf_counter
 
 from .functions import clear_screen, clinput, float_from_str
 from .rg_controller import RGController
 
 
-def mainloop(controller: RGController) -> None:
+def build_report(controller: RGController) -> str:
+    """
+    Construye el informe de los comandos `txt`/`savetxt`: la tabla `total` seguida del total de cada grupo de fuentes
+    """
+
+    content = controller.get_df_total().to_string(index=False) + "\n\n"
+
+    for active_type, total in controller.get_sums()["groups"].items():
+        content += "Total {}: {:.2f}\n".format(active_type, total)
+
+    return content
+
+
+def view_blockchain(
+    controller: RGController,
+    fuente: str,
+    limit: int = 20,
+    input_fn: Callable[[str], str] = input,
+) -> None:
+    """
+    Muestra la tabla `blockchain` por páginas de <limit> registros, empezando por los más recientes
+    """
+
+    page = controller.page_blockchain(fuente, limit=limit)
+
+    if page.empty:
+        print("No hay registros.")
+        return
+
     while True:
-        cmd = clinput(
-            "Ingresa una opción (número, %s): "
-            % ", ".join(
-                [
-                    "'%s'" % field.lower()
-                    for field in list(
-                        filter(
-                            lambda key: key if key != controller.fields else "",
-                            controller.fields.keys(),
-                        )
-                    )
-                ]
+        print(page.to_string(index=False))
+
+        answer = clinput("\n[s] siguiente, [a] anterior, [q] salir -> ", input_fn).lower()
+
+        if answer in ["", "s"]:
+            new_page = controller.page_blockchain(
+                fuente, after_id=int(page["id"].iloc[-1]), limit=limit
             )
-        ).lower()
 
-        if cmd == "q":
-            # Salir del programa.
+        elif answer == "a":
+            new_page = controller.page_blockchain(
+                fuente, before_id=int(page["id"].iloc[0]), limit=limit
+            )
+
+        elif answer == "q":
+            break
+
+        else:
+            print("Dato incorrecto.")
+            continue
+
+        if new_page.empty:
+            print("No hay más registros.")
+
+        else:
+            page = new_page
+
+        print()
+
+
+def print_rows(cursor, max_rows: int, batch_size: int = 100) -> int:
+    """
+    Muestra como tabla las filas de la consulta ya ejecutada en <cursor>, leyéndolas por bloques con
+    `fetchmany`, hasta un máximo de <max_rows>. Devuelve el número de filas mostradas
+    """
+
+    headers = [column[0] for column in cursor.description]
+    widths = None
+    shown = 0
 
+    while shown < max_rows:
+        rows = cursor.fetchmany(min(batch_size, max_rows - shown))
+
+        if not rows:
             break
 
-        elif cmd in ["cls", "clear"]:
-            # Limpiar la pantalla.
+        rows = [["NULL" if value is None else str(value) for value in row] for row in rows]
+
+        if widths is None:
+            # El ancho de las columnas se calcula con el primer bloque
+            widths = [
+                max(len(header), *(len(row[i]) for row in rows))
+                for i, header in enumerate(headers)
+            ]
+
+            print("  ".join(header.rjust(width) for header, width in zip(headers, widths)))
+
+        for row in rows:
+            print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+        shown += len(rows)
+
+    if widths is None:
+        print("  ".join(headers))
+
+    elif shown == max_rows and cursor.fetchone() is not None:
+        print("... (límite de {} filas alcanzado)".format(max_rows))
+
+    return shown
+
+
+def print_query_plan(controller: RGController, query: str) -> None:
+    """
+    Muestra `EXPLAIN QUERY PLAN` de <query> como un árbol
+    """
+
+    depths = {0: -1}
+
+    print("QUERY PLAN")
+
+    for id, parent, _, detail in controller.execute("EXPLAIN QUERY PLAN " + query):
+        depths[id] = depths.get(parent, -1) + 1
+
+        print("{}--{}".format("   " * depths[id], detail))
+
 
-            clear_screen()
+def sql_shell(
+    controller: RGController,
+    max_rows: int | None = None,
+    input_fn: Callable[[str], str] = input,
+) -> None:
+    """
+    Consola SQL sobre la base de datos. Las consultas muestran como mucho <max_rows> filas (por defecto,
+    la opción `sql_max_rows` de la configuración o 100) sin cargar el resto, y todas las sentencias
+    muestran su tiempo y las filas afectadas. `explain <consulta>` muestra su plan de ejecución.
+    """
 
+    if max_rows is None:
+        max_rows = controller.config.get("sql_max_rows", 100)
+
+    while True:
+        e = input_fn("-> ")
+
+        if e == "q":
+            break
+
+        statement = e.strip()
+        lowered = statement.lower()
+
+        if lowered == "":
             continue
 
-        cmd_list = cmd.split()
-        cmd_len = len(cmd_list)
+        cursor = controller.cursor()
+
+        try:
+            if lowered.startswith("explain") and not lowered.startswith("explain query plan"):
+                print_query_plan(controller, statement[len("explain") :])
+                continue
+
+            if lowered.startswith("delete") or lowered.startswith("update"):
+                controller.create_local_backup()
+
+            start = perf_counter()
+
+            cursor.execute(statement)
+
+            if cursor.description is not None:
+                rows = print_rows(cursor, max_rows)
+
+                print("\n{} filas en {:.1f} ms".format(rows, (perf_counter() - start) * 1000))
+
+            else:
+                elapsed = (perf_counter() - start) * 1000
+
+                # `total_changes` no cuenta los cambios de esquema (DROP, ALTER, ...)
+                controller.invalidate_cache()
+
+                if cursor.rowcount >= 0:
+                    print("{} filas afectadas en {:.1f} ms".format(cursor.rowcount, elapsed))
+
+                else:
+                    print("OK en {:.1f} ms".format(elapsed))
+
+        except sqlite3.Error as error:
+            print(error)
+
+        finally:
+            cursor.close()
+
+
+MAIN_PROMPT = "Ingresa una opción (número, %s): "
+
+# Tipo de cada comando con nombre fijo (ver `command_type`)
+COMMANDS = {
+    "q": "quit",
+    "cls": "clear",
+    "clear": "clear",
+    "t": "total",
+    "txt": "report",
+    "savetxt": "report",
+    **dict.fromkeys(
+        ["txt_t", "txt_b", "txt-t", "txt-b", "print_all", "printall", "print_b", "printb"],
+        "view",
+    ),
+    **dict.fromkeys(["stat", "statistics", "estadisticas", "estadísticas"], "stat"),
+    **dict.fromkeys(
+        ["sql", "sql_query", "sqlquery", "sqlite", "sqlite_query", "sqlitequery", "query"],
+        "sql",
+    ),
+    **dict.fromkeys(["savebackup", "save_backup", "createbackup", "create_backup"], "backup"),
+    **dict.fromkeys(["recoverbackup", "recover_backup", "restorebackup", "restore_backup"], "restore"),
+    "adjust": "adjust",
+    "rectify": "adjust",
+    "dedup": "dedup",
+}
+
+EXPORT_COMMANDS = ["savecsv", "save_csv", "csv", "savejsonl", "save_jsonl", "jsonl"]
+
+
+def command_type(controller: RGController, cmd: str) -> str:
+    """
+    Devuelve el tipo del comando <cmd> (ya en minúsculas): "amount", "field", "export", "stat", "move",
+    "move_undo", "import", "perf", "unknown" o uno de los valores de `COMMANDS`
+    """
+
+    cmd_list = cmd.split()
+
+    # Mismo orden que ha tenido siempre la cadena de comandos: una fuente puede tapar un comando
+    if cmd in ["q", "cls", "clear"]:
+        return COMMANDS[cmd]
+
+    elif float_from_str(cmd):
+        return "amount"
+
+    elif cmd.upper() in controller.fields:
+        return "field"
+
+    elif cmd in COMMANDS:
+        return COMMANDS[cmd]
+
+    elif cmd_list and cmd_list[0] in EXPORT_COMMANDS:
+        return "export"
+
+    elif len(cmd_list) == 2 and cmd_list[0] in COMMANDS and COMMANDS[cmd_list[0]] == "stat":
+        return "stat"
+
+    elif cmd_list == ["move", "undo"]:
+        return "move_undo"
+
+    elif len(cmd_list) >= 2 and cmd_list[0] == "move" and cmd_list[1].isdigit():
+        return "move"
+
+    elif cmd_list and cmd_list[0] == "import" and len(cmd_list) <= 2:
+        return "import"
+
+    elif cmd_list and cmd_list[0] == "perf":
+        return "perf"
+
+    return "unknown"
+
+
+def read_command(controller: RGController, input_fn: Callable[[str], str] = input) -> str:
+    """
+    Muestra el prompt principal y devuelve el comando introducido, en minúsculas
+    """
+
+    return clinput(
+        MAIN_PROMPT
+        % ", ".join(
+            [
+                "'%s'" % field.lower()
+                for field in list(
+                    filter(
+                        lambda key: key if key != controller.fields else "",
+                        controller.fields.keys(),
+                    )
+                )
+            ]
+        ),
+        input_fn,
+    ).lower()
+
+
+def run_command(
+    controller: RGController, cmd: str, input_fn: Callable[[str], str] = input
+) -> bool:
+    """
+    Ejecuta el comando <cmd> leyendo con <input_fn> las respuestas que necesite. Devuelve False si el
+    comando es salir del programa
+    """
+
+    kind = command_type(controller, cmd)
+
+    cmd_list = cmd.split()
+
+    if kind == "quit":
+        # Salir del programa.
+
+        return False
+
+    elif kind == "clear":
+        # Limpiar la pantalla.
+
+        clear_screen()
+
+        return True
+
+    elif kind == "amount":
+        # Ingresar una cantidad de efectivo en la base de datos en el campo `default_field`.
 
         number = float_from_str(cmd)
 
+        description = input_fn("Descripción? ")
+
+        try:
+            res = controller.update_db(controller.default_field, number, description)
+
+        except ValueError as e:
+            # Fracciones de céntimo en el esquema compacto
+            print("{}\n".format(e))
+            return True
+
+        if res == 0:
+            print("OK")
+        elif res == 1:
+            print("ERROR")
+
+    elif kind == "field":
+        # Ingresar una cantidad de efectivo en la base de datos en el campo especificado.
+
+        e = clinput("-> ", input_fn)
+
+        if e == "q":
+            return True
+
+        number = float_from_str(e)
+
         if number:
-            # Ingresar una cantidad de efectivo en la base de datos en el campo `default_field`.
+            description = input_fn("Descripción? ")
 
-            description = input("Descripción? ")
+            try:
+                res = controller.update_db(cmd, number, description)
 
-            res = controller.update_db(controller.default_field, number, description)
+            except ValueError as e:
+                print("{}\n".format(e))
+                return True
 
             if res == 0:
                 print("OK")
             elif res == 1:
                 print("ERROR")
+        else:
+            print("ERROR")
 
-        elif cmd.upper() in controller.fields:
-            # Ingresar una cantidad de efectivo en la base de datos en el campo especificado.
+    elif kind == "total":
+        # Obtener el total de algo.
 
-            e = clinput("-> ")
+        cmd = clinput("-> ", input_fn).upper()
 
-            if e == "q":
-                continue
+        if cmd == "q":
+            return True
 
-            number = float_from_str(e)
+        try:
+            result = controller.get_sum_of(cmd)
 
-            if number:
-                description = input("Descripción? ")
+            print("{}: {:.2f}".format(cmd, result))
 
-                res = controller.update_db(cmd, number, description)
+        except AssertionError:
+            print("Dato incorrecto.")
 
-                if res == 0:
-                    print("OK")
-                elif res == 1:
-                    print("ERROR")
-            else:
-                print("ERROR")
+    elif kind == "report":
+        # Obtener toda la base de datos "total".
 
-        elif cmd == "t":
-            # Obtener el total de algo.
+        content_to_write = build_report(controller)
 
-            cmd = clinput("-> ").upper()
+        print(content_to_write.strip())
 
-            if cmd == "q":
-                continue
+        if cmd == "savetxt":
+            ruta = "{}/{}.txt".format(controller.base_folder, controller.db_name)
 
-            try:
-                result = controller.get_sum_of(cmd)
+            with open(ruta, "w") as file:
+                file.write(content_to_write)
 
-                print("{}: {:.2f}".format(cmd, result))
+            print("Guardado en {}".format(ruta))
 
-            except AssertionError:
-                print("Dato incorrecto.")
+    elif kind == "view":
+        # Recorrer la base de datos "blockchain" por páginas, de los registros más recientes a los más antiguos.
 
-        elif cmd in ["txt", "savetxt"]:
-            # Obtener toda la base de datos "total".
+        cmd = clinput("-> ", input_fn).upper()
 
-            content_to_write = controller.get_df_total().to_string(index=False) + "\n\n"
+        if cmd == "Q":
+            return True
 
-            for active_type in controller.fields_.keys():
-                content_to_write += "Total {}: {:.2f}\n".format(
-                    active_type, controller.get_sum_of(active_type)
-                )
+        try:
+            view_blockchain(controller, cmd, input_fn=input_fn)
+        except AssertionError:
+            print("Dato incorrecto.")
 
-            print(content_to_write.strip())
+    elif kind == "export":
+        # Exportar la tabla especificada en formato .csv o .jsonl. Por defecto "blockchain"
+        # Uso: csv [fuente] [desde] [hasta]
 
-            if cmd == "savetxt":
-                ruta = "{}/{}.txt".format(controller.base_folder, controller.db_name)
+        tables = {
+            "1": "blockchain",
+            "2": "total",
+        }
 
-                with open(ruta, "w") as file:
-                    file.write(content_to_write)
+        format = "jsonl" if cmd_list[0].endswith("jsonl") else "csv"
 
-                print("Guardado en {}".format(ruta))
+        fuente = ""
+        bounds = cmd_list[1:]
 
-        elif cmd in [
-            "txt_t",
-            "txt_b",
-            "txt-t",
-            "txt-b",
-            "print_all",
-            "printall",
-            "print_b",
-            "printb",
-        ]:
-            # Obtener toda la base de datos "blockchain".
+        if bounds and bounds[0].upper() in {
+            *controller.fields.keys(),
+            *controller.fields_.keys(),
+        }:
+            fuente = bounds.pop(0).upper()
 
-            cmd = clinput("-> ").upper()
+        if len(bounds) > 2:
+            print("Dato incorrecto.\n")
+            return True
 
-            if cmd == "q":
-                continue
+        since, until = (bounds + [None, None])[:2]
 
-            try:
-                print(controller.get_df_blockchain(cmd).to_string())
-            except AssertionError:
-                print("Dato incorrecto.")
+        answer = "1" if fuente else clinput("[1] -> blockchain\n[2] -> total\n->", input_fn)
 
-        elif cmd in ["savecsv", "save_csv", "csv"]:
-            # Obtener la tabla especificada en formato .csv. Por defecto "blockchain"
+        if answer in tables.keys():
+            table = tables[answer]
 
-            tables = {
-                "1": "blockchain",
-                "2": "total",
-            }
+        elif answer in tables.values():
+            table = answer
 
-            cmd = cmd_list
+        elif answer == "":
+            table = "blockchain"
 
-            answer = clinput("[1] -> blockchain\n[2] -> total\n->")
+        else:
+            print("Dato incorrecto.\n")
+            return True
 
-            if answer in tables.keys():
-                table = tables[answer]
+        ruta = "{}/{}.{}".format(controller.base_folder, table, format)
 
-            elif answer in tables.values():
-                table = answer
+        try:
+            exported = controller.export_table(
+                ruta, table, format, fuente=fuente, since=since, until=until
+            )
 
-            elif answer == "":
-                table = "blockchain"
+        except ValueError:
+            print("Fecha incorrecta (YYYY-mm-dd [HH:MM:SS]).\n")
+            return True
 
-            else:
-                print("Dato incorrecto.\n")
-                continue
+        print("{} registros guardados en {}".format(exported, ruta))
+
+    elif kind == "stat":
+        # Obtener una gráfica con estadísticas sobre un activo determinado.
 
-            if table in ["1", "blockchain"]:
-                df = controller.get_df_blockchain()
+        if len(cmd_list) == 2:
+            activo = cmd_list[1]
+        else:
+            activo = clinput("-> ", input_fn)
+
+        if activo == "":
+            activo = controller.default_field
+
+        try:
+            controller.get_capital_variation(activo)
+
+        except ModuleNotFoundError as e:
+            print("error: herramienta `%s` no instalada" % e.name)
+
+    elif kind == "sql":
+        # Poder interactuar directamente con la base de datos a través del lenguaje SQL.
+
+        sql_shell(controller, input_fn=input_fn)
 
-            elif table in ["2", "total"]:
-                df = controller.get_df_total()
+    elif kind == "backup":
+        # Crear una copia de seguridad local de la base de datos entera.
 
-            df.to_csv("{}/{}.csv".format(controller.base_folder, table), index=False)
+        controller.create_local_backup()
 
-            print(df.to_string())
+    elif kind == "restore":
+        # Restablecer base de datos local con una copia de seguridad local.
 
-            print("Archivo `.csv` guardado con éxito.")
+        controller.restore_local_backup(delete_used_backup=True)
 
-        elif cmd in ["stat", "statistics", "estadisticas", "estadísticas"] or (
-            cmd_len == 2
-            and cmd_list[0] in ["stat", "statistics", "estadisticas", "estadísticas"]
-        ):
-            # Obtener una gráfica con estadísticas sobre un activo determinado.
+    elif kind == "adjust":
+        # Rectificar tabla total.
+
+        results = controller.adjust_total()
+
+        for fuente in results:
+            if results[fuente] == "OK":
+                print("OK {}".format(fuente))
 
-            if cmd_len == 2:
-                activo = cmd_list[1]
             else:
-                activo = clinput("-> ")
+                print(
+                    "ACTUALIZED {fuente}   ( {old} -> {new} )".format(
+                        fuente=fuente,
+                        old=results[fuente]["old"],
+                        new=results[fuente]["new"],
+                    )
+                )
 
-            if activo == "":
-                activo = controller.default_field
+    elif kind == "dedup":
+        # Buscar movimientos duplicados (ver `lib.fingerprint`) y borrarlos si se confirma.
 
-            try:
-                controller.get_capital_variation(activo)
+        duplicates = list(controller.dedup().items())
 
-            except ModuleNotFoundError as e:
-                print("error: herramienta `%s` no instalada" % e.name)
+        if not duplicates:
+            print("No hay duplicados.\n")
+            return True
 
-        elif cmd in [
-            "sql",
-            "sql_query",
-            "sqlquery",
-            "sqlite",
-            "sqlite_query",
-            "sqlitequery",
-            "query",
-        ]:
-            # Poder interactuar directamente con la base de datos a través del lenguaje SQL.
+        for duplicate, original in duplicates[:20]:
+            print("{} duplica a {}".format(duplicate, original))
 
-            while True:
-                e = input("-> ")
+        if len(duplicates) > 20:
+            print("... y {} más".format(len(duplicates) - 20))
 
-                if e == "q":
-                    break
+        answer = clinput("¿Borrar {} duplicados? [s/N] -> ".format(len(duplicates)), input_fn)
 
-                elif e.startswith("select"):
-                    try:
-                        print(e)
+        if answer.lower() == "s":
+            controller.create_local_backup()
+            controller.dedup(delete=True)
 
-                        df = read_sql(e, controller).to_string()
+            print("OK")
 
-                        print(df)
+    elif kind == "move_undo":
+        # Deshacer el último desplazamiento de ids.
 
-                    except BaseException as e:
-                        print(e)
+        if controller.undo_move_data():
+            print("OK")
 
-                else:
-                    cursor = controller.cursor()
+    elif kind == "move":
+        a = 1
+        try:
+            a = int(cmd_list[2])
+        except IndexError:
+            pass
+        except ValueError:
+            pass
+        controller.move_data(int(cmd_list[1]), ammount_to_move=a)
 
-                    try:
-                        if e.startswith("delete") or e.startswith("update"):
-                            controller.create_local_backup()
+    elif kind == "import":
+        # Importar los movimientos de un extracto bancario en CSV (ver la sección [import] de la configuración).
+        # Uso: import [fuente]
 
-                        cursor.execute(e)
+        fuente = cmd_list[1].upper() if len(cmd_list) == 2 else None
 
-                    except BaseException as e:
-                        print(e)
+        if fuente is not None and fuente not in controller.fields:
+            print("Dato incorrecto.\n")
+            return True
 
-                    finally:
-                        cursor.close()
+        # La ruta se lee aparte porque el comando se pasa a minúsculas
+        ruta = input_fn("Archivo? ").strip()
 
-        elif cmd.lower() in [
-            "savebackup",
-            "save_backup",
-            "createbackup",
-            "create_backup",
-        ]:
-            # Crear una copia de seguridad local de la base de datos entera.
+        if ruta in ["", "q"]:
+            return True
 
-            controller.create_local_backup()
+        start = perf_counter()
 
-        elif cmd in [
-            "recoverbackup",
-            "recover_backup",
-            "restorebackup",
-            "restore_backup",
-        ]:
-            # Restablecer base de datos local con una copia de seguridad local.
+        try:
+            result = controller.import_statement(path.expanduser(ruta), fuente)
 
-            controller.restore_local_backup(delete_used_backup=True)
+        except (OSError, ValueError) as e:
+            print("error: %s\n" % e)
+            return True
 
-        elif cmd in ["adjust", "rectify"]:
-            # Rectificar tabla total.
+        errors = list(result["errors"].items())
 
-            results = controller.adjust_total()
+        for line, reason in errors[:20]:
+            print("Línea {}: {}".format(line, reason))
 
-            for fuente in results:
-                if results[fuente] == "OK":
-                    print("OK {}".format(fuente))
+        if len(errors) > 20:
+            print("... y {} más".format(len(errors) - 20))
 
-                else:
-                    print(
-                        "ACTUALIZED {fuente}   ( {old} -> {new} )".format(
-                            fuente=fuente,
-                            old=results[fuente]["old"],
-                            new=results[fuente]["new"],
-                        )
-                    )
+        print(
+            "{} movimientos importados, {} errores ({:.2f} s)".format(
+                result["inserted"], len(result["errors"]), perf_counter() - start
+            )
+        )
 
-        elif cmd_len >= 2 and cmd_list[0] == "move" and cmd_list[1].isdigit():
-            a = 1
-            try:
-                a = int(cmd_list[2])
-            except IndexError:
-                pass
-            except ValueError:
-                pass
-            controller.move_data(int(cmd_list[1]), ammount_to_move=a)
+    elif kind == "perf":
+        # Instrumentación: tiempos por comando y por método y las sentencias SQL más costosas.
+        # Uso: perf | perf json [ruta] | perf reset | perf off
+
+        instrumentation = controller.instrumentation
+
+        if instrumentation is None or not instrumentation.attached:
+            controller.instrument()
+            print("Instrumentación activada. `perf` muestra los resultados.")
+
+        elif cmd_list[1:] == []:
+            print(instrumentation.report())
+
+        elif cmd_list[1] == "json" and len(cmd_list) <= 3:
+            ruta = (
+                cmd_list[2]
+                if len(cmd_list) == 3
+                else "{}/{}.perf.json".format(controller.base_folder, controller.db_name)
+            )
+
+            print("Guardado en {}".format(instrumentation.export_json(ruta)))
+
+        elif cmd_list[1:] == ["reset"]:
+            instrumentation.reset()
+            print("OK")
+
+        elif cmd_list[1:] == ["off"]:
+            instrumentation.detach()
+            print("Instrumentación desactivada.")
 
         else:
             print("Dato incorrecto.")
 
-        print()
+    else:
+        print("Dato incorrecto.")
+
+    print()
+
+    return True
+
+
+def mainloop(controller: RGController, input_fn: Callable[[str], str] = input) -> None:
+    """
+    Bucle interactivo de rgcap. <input_fn> lee cada respuesta mostrando el prompt que recibe (por defecto
+    `input`); el demonio la sustituye para leer los comandos de un socket.
+
+    Con la instrumentación activada (ver `RGController.instrument`) muestra y guarda el tiempo de cada
+    comando.
+    """
+
+    while True:
+        cmd = read_command(controller, input_fn)
+
+        start = perf_counter()
+
+        keep_going = run_command(controller, cmd, input_fn)
+
+        instrumentation = controller.instrumentation
+
+        if instrumentation is not None and instrumentation.attached:
+            kind = command_type(controller, cmd)
+            seconds = perf_counter() - start
+
+            instrumentation.record_command(kind, seconds)
+
+            if keep_going:
+                print("[{}: {:.1f} ms]\n".format(kind, seconds * 1000))
+
+        if not keep_going:
+            break
@@ -0,0 +1,267 @@
+from collections.abc import Callable
+import sqlite3
+
+from .compact import create_schema, is_compact
+from .fingerprint import backfill, create_index
+
+
+def index_blockchain_fuente_hora(connection: sqlite3.Connection):
+    """
+    Índice para las consultas que filtran la tabla `blockchain` por fuente y hora
+    """
+
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS %(table)s_%(field)s_%(datetime)s ON %(table)s (%(field)s, %(datetime)s)"
+        % {
+            "table": connection.main_name,
+            "field": connection.field_col_name,
+            "datetime": connection.datetime_col_name,
+        }
+    )
+
+
+def unique_index_total_fuente(connection: sqlite3.Connection):
+    """
+    Índice único sobre la fuente de la tabla `total`. Si existen fuentes repetidas se conserva la primera.
+    """
+
+    connection.execute(
+        "DELETE FROM %(table)s WHERE rowid NOT IN (SELECT MIN(rowid) FROM %(table)s GROUP BY %(field)s)"
+        % {
+            "table": connection.total_name,
+            "field": connection.field_col_name,
+        }
+    )
+
+    connection.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS %(table)s_%(field)s ON %(table)s (%(field)s)"
+        % {
+            "table": connection.total_name,
+            "field": connection.field_col_name,
+        }
+    )
+
+
+def reconciliation_state(connection: sqlite3.Connection):
+    """
+    Tablas para la verificación incremental de la tabla `total`:
+
+    - `blockchain_state`: contador de modificaciones de `blockchain` que no son inserciones al final,
+      mantenido por triggers (actualizaciones, borrados e inserciones con un id menor al último).
+    - `reconciliation`: último id verificado y, por fuente, la suma y el número de registros hasta él.
+    """
+
+    names = {
+        "table": connection.main_name,
+        "state": connection.state_name,
+        "reconciliation": connection.reconciliation_name,
+        "field": connection.field_col_name,
+        "ammount": connection.ammount_col_name,
+        "datetime": connection.datetime_col_name,
+    }
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS %(state)s ( rewrites INTEGER NOT NULL )" % names
+    )
+    connection.execute("INSERT INTO %(state)s (rewrites) VALUES (0)" % names)
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS %(reconciliation)s ( %(field)s TEXT PRIMARY KEY NOT NULL, %(ammount)s REAL NOT NULL, filas INTEGER NOT NULL, last_id INTEGER NOT NULL, rewrites INTEGER NOT NULL )"
+        % names
+    )
+
+    for trigger in [
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_rewrite_update AFTER UPDATE OF id, %(field)s, %(ammount)s, %(datetime)s ON %(table)s "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_rewrite_delete AFTER DELETE ON %(table)s "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_rewrite_insert AFTER INSERT ON %(table)s WHEN NEW.id < (SELECT MAX(id) FROM %(table)s) "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END",
+    ]:
+        connection.execute(trigger % names)
+
+
+def daily_balance(connection: sqlite3.Connection):
+    """
+    Tabla `daily_balance` con la variación y el capital al final de cada día por fuente. Solo se mantiene
+    si la opción `daily_balance` está activada; `daily_balance_state` guarda hasta qué id de `blockchain`
+    está incluido. El estado inicial obliga a reconstruirla la primera vez que se use.
+    """
+
+    names = {
+        "daily_balance": connection.daily_balance_name,
+        "state": connection.daily_balance_state_name,
+        "field": connection.field_col_name,
+    }
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS %(daily_balance)s ( %(field)s TEXT NOT NULL, day TEXT NOT NULL, delta REAL NOT NULL, running_total REAL NOT NULL, PRIMARY KEY (%(field)s, day) )"
+        % names
+    )
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS %(state)s ( last_id INTEGER NOT NULL, rewrites INTEGER NOT NULL )"
+        % names
+    )
+    connection.execute("INSERT INTO %(state)s (last_id, rewrites) VALUES (0, -1)" % names)
+
+
+def move_log(connection: sqlite3.Connection):
+    """
+    Tabla `move_log` con los desplazamientos de ids hechos por `move_data`, para poder deshacerlos
+    """
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS %(table)s ( id INTEGER PRIMARY KEY NOT NULL, first_id INTEGER NOT NULL, ammount INTEGER NOT NULL, hora TEXT NOT NULL )"
+        % {"table": connection.move_log_name}
+    )
+
+
+def index_blockchain_fuente_id(connection: sqlite3.Connection):
+    """
+    Índice para recorrer por páginas la tabla `blockchain` de una fuente en orden de id (`page_blockchain`)
+    """
+
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS %(table)s_%(field)s_id ON %(table)s (%(field)s, id)"
+        % {
+            "table": connection.main_name,
+            "field": connection.field_col_name,
+        }
+    )
+
+
+def blockchain_epoch(connection: sqlite3.Connection):
+    """
+    Columna `epoch` de la tabla `blockchain`: la hora en segundos desde 1970, indexada para que las consultas
+    por rango de fechas no tengan que leer y convertir la columna de texto `hora`. `RGController` la rellena
+    en cada inserción; los triggers la mantienen si se inserta o modifica la hora con SQL directo.
+    """
+
+    names = {
+        "table": connection.main_name,
+        "field": connection.field_col_name,
+        "datetime": connection.datetime_col_name,
+        "epoch": connection.epoch_col_name,
+    }
+
+    connection.execute("ALTER TABLE %(table)s ADD COLUMN %(epoch)s INTEGER" % names)
+    connection.execute(
+        "UPDATE %(table)s SET %(epoch)s=CAST(strftime('%%s', %(datetime)s) AS INTEGER)" % names
+    )
+
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS %(table)s_%(field)s_%(epoch)s ON %(table)s (%(field)s, %(epoch)s)"
+        % names
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS %(table)s_%(epoch)s ON %(table)s (%(epoch)s)" % names
+    )
+
+    for trigger in [
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_%(epoch)s_insert AFTER INSERT ON %(table)s WHEN NEW.%(epoch)s IS NULL "
+        "BEGIN UPDATE %(table)s SET %(epoch)s=CAST(strftime('%%s', NEW.%(datetime)s) AS INTEGER) WHERE id=NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_%(epoch)s_update AFTER UPDATE OF %(datetime)s ON %(table)s "
+        "BEGIN UPDATE %(table)s SET %(epoch)s=CAST(strftime('%%s', NEW.%(datetime)s) AS INTEGER) WHERE id=NEW.id; END",
+    ]:
+        connection.execute(trigger % names)
+
+
+def blockchain_fingerprint(connection: sqlite3.Connection):
+    """
+    Columna `huella` de la tabla `blockchain` con índice único, para rechazar movimientos duplicados al
+    insertarlos (ver `lib.fingerprint`). Se calcula para los registros existentes; si alguno repite otro
+    anterior se queda sin huella hasta que se borre con `dedup`.
+    """
+
+    names = {
+        "table": connection.main_name,
+        "data": connection.main_data_name,
+        "huella": connection.fingerprint_col_name,
+    }
+
+    if is_compact(connection):
+        # La vista `blockchain` lista sus columnas: se vuelve a crear (con sus triggers) para añadir la nueva
+        connection.execute("ALTER TABLE %(data)s ADD COLUMN %(huella)s TEXT" % names)
+        connection.execute("DROP VIEW %(table)s" % names)
+
+        create_schema(connection)
+
+    else:
+        connection.execute("ALTER TABLE %(table)s ADD COLUMN %(huella)s TEXT" % names)
+
+        create_index(connection)
+
+    backfill(connection)
+
+
+def rewrite_update_without_id(connection: sqlite3.Connection):
+    """
+    Quita el id de las columnas del trigger `rewrite_update`: `move_data` desplaza los ids de miles de registros
+    y el trigger se ejecutaba una vez por registro. Ahora `move_data` y `undo_move_data` cuentan la
+    reescritura una sola vez (los cambios de id con SQL directo los cuenta `rewrite_id`).
+    """
+
+    names = {
+        "table": connection.main_name,
+        "data": connection.main_data_name,
+        "state": connection.state_name,
+        "field": connection.field_col_name,
+        "ammount": connection.ammount_col_name,
+        "datetime": connection.datetime_col_name,
+    }
+
+    if is_compact(connection):
+        trigger = (
+            "CREATE TRIGGER %(data)s_rewrite_update AFTER UPDATE OF fuente_id, centimos, %(datetime)s ON %(data)s "
+            "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END"
+        )
+        connection.execute("DROP TRIGGER IF EXISTS %(data)s_rewrite_update" % names)
+
+    else:
+        trigger = (
+            "CREATE TRIGGER %(table)s_rewrite_update AFTER UPDATE OF %(field)s, %(ammount)s, %(datetime)s ON %(table)s "
+            "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END"
+        )
+        connection.execute("DROP TRIGGER IF EXISTS %(table)s_rewrite_update" % names)
+
+    connection.execute(trigger % names)
+
+
+def rewrite_id(connection: sqlite3.Connection):
+    """
+    Trigger `rewrite_id`: un cambio de id con SQL directo vuelve a contar como reescritura. No se ejecuta
+    mientras `blockchain_state.shifting` vale 1, que es lo que hace `move_data` al desplazar los ids (y
+    cuenta el desplazamiento una sola vez).
+    """
+
+    names = {
+        "table": connection.main_data_name if is_compact(connection) else connection.main_name,
+        "state": connection.state_name,
+    }
+
+    connection.execute(
+        "ALTER TABLE %(state)s ADD COLUMN shifting INTEGER NOT NULL DEFAULT 0" % names
+    )
+
+    connection.execute(
+        "CREATE TRIGGER IF NOT EXISTS %(table)s_rewrite_id AFTER UPDATE OF id ON %(table)s "
+        "WHEN (SELECT shifting FROM %(state)s)=0 "
+        "BEGIN UPDATE %(state)s SET rewrites = rewrites + 1; END" % names
+    )
+
+
+# Cada migración lleva la base de datos de la versión `i` a la versión `i + 1` (`PRAGMA user_version`).
+# Nunca se deben modificar ni reordenar las migraciones existentes, solo añadir nuevas al final.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    index_blockchain_fuente_hora,
+    unique_index_total_fuente,
+    reconciliation_state,
+    daily_balance,
+    move_log,
+    index_blockchain_fuente_id,
+    blockchain_epoch,
+    blockchain_fingerprint,
+    rewrite_update_without_id,
+    rewrite_id,
+]
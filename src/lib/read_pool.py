@@ -0,0 +1,93 @@
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, local
+
+from .rg_controller import RGController
+
+
+class ReadPool:
+    """
+    Conexiones de solo lectura (`mode=ro`) para ejecutar varias consultas de informes a la vez desde
+    un pool de hilos, sin ocupar la conexión de escritura. Cada hilo abre su propia conexión la primera
+    vez que la necesita. Con `journal_mode = "wal"` las lecturas no bloquean las inserciones.
+
+        with controller.read_pool() as pool:
+            sums = pool.submit(RGController.get_sums)
+            df = pool.submit(RGController.get_df_blockchain, "CASH")
+    """
+
+    def __init__(self, config: dict, size: int = 4):
+        """
+        config:    configuración de rgcap (ver `load_config`)
+        size:      número de hilos y conexiones
+        """
+
+        assert isinstance(size, int) and size > 0
+
+        self.config = config
+        self.size = size
+
+        self.__local = local()
+        self.__connections = []
+        self.__lock = Lock()
+
+        self.__executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="rgcap-read"
+        )
+
+    def __get_connection(self) -> RGController:
+        """
+        Devuelve la conexión de solo lectura del hilo actual, abriéndola si no existe
+        """
+
+        connection = getattr(self.__local, "connection", None)
+
+        if connection is None:
+            connection = RGController(
+                self.config, readonly=True, check_same_thread=False
+            )
+
+            self.__local.connection = connection
+
+            with self.__lock:
+                self.__connections.append(connection)
+
+        return connection
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Ejecuta `fn(conexión, *args, **kwargs)` en el pool y devuelve un `Future` con el resultado.
+        <fn> suele ser un método de `RGController`, p. ej. `RGController.get_sum_of`.
+        """
+
+        return self.__executor.submit(
+            lambda: fn(self.__get_connection(), *args, **kwargs)
+        )
+
+    def run_all(self, tasks: dict[str, tuple]) -> dict:
+        """
+        Ejecuta a la vez todas las tareas de <tasks> (nombre -> (fn, *args)) y devuelve sus resultados por nombre
+        """
+
+        futures = {name: self.submit(*task) for name, task in tasks.items()}
+
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self):
+        """
+        Espera a que terminen las consultas pendientes y cierra todas las conexiones
+        """
+
+        self.__executor.shutdown(wait=True)
+
+        with self.__lock:
+            for connection in self.__connections:
+                connection.close()
+
+            self.__connections.clear()
+
+    def __enter__(self) -> "ReadPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
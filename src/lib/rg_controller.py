@@ -1,11 +1,29 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable
+from contextlib import contextmanager
+import csv
+from calendar import timegm
+from datetime import date, datetime
+import json
+from math import isfinite
 from os import listdir, makedirs, remove, rmdir, path
 import sqlite3
+from typing import TYPE_CHECKING
+from urllib.request import pathname2url
 
-from matplotlib import pyplot
-from pandas import read_sql, DataFrame
-from seaborn import lineplot
-
+from .compact import convert, has_cent_fractions, is_compact, sync_fuentes
+from .fingerprint import backfill, find_duplicates, fingerprint, register
 from .functions import get_time_now
+from .migrations import MIGRATIONS
+
+if TYPE_CHECKING:
+    # pandas, matplotlib y seaborn se importan solo dentro de los métodos que los usan
+    from pandas import DataFrame, Series
+
+    from .instrumentation import Instrumentation
+    from .read_pool import ReadPool
+    from .snapshot import Snapshot
 
 
 class RGController(sqlite3.Connection):
@@ -16,12 +34,23 @@ class RGController(sqlite3.Connection):
             "field": "fuente",
             "ammount": "cantidad",
             "datetime": "hora",
+            "epoch": "epoch",
+            "fingerprint": "huella",
             "description": {
                 "column_name": "description",
                 "default_value": "",
             },
         },
     }
+    # Opciones de la sección [sqlite] del archivo de configuración y los valores que aceptan (None: cualquier entero)
+    __SQLITE_PRAGMAS = {
+        "busy_timeout": None,
+        "journal_mode": ["delete", "truncate", "persist", "memory", "wal", "off"],
+        "synchronous": ["off", "normal", "full", "extra", 0, 1, 2, 3],
+        "cache_size": None,
+        "mmap_size": None,
+        "temp_store": ["default", "file", "memory", 0, 1, 2],
+    }
     __TOTAL_TABLE = {
         "name": "total",
         "prefix": "Total_",
@@ -33,20 +62,37 @@ class RGController(sqlite3.Connection):
     }
 
     main_name = "blockchain"
+    main_data_name = "blockchain_data"
+    fuentes_name = "fuentes"
     total_name = "total"
     field_col_name = "fuente"
     ammount_col_name = "cantidad"
     datetime_col_name = "hora"
+    epoch_col_name = "epoch"
+    fingerprint_col_name = "huella"
     description_col_name = "description"
     description_col_default_value = ""
     total_field_prefix = "Total_"
+    state_name = "blockchain_state"
+    reconciliation_name = "reconciliation"
+    daily_balance_name = "daily_balance"
+    daily_balance_state_name = "daily_balance_state"
+    move_log_name = "move_log"
 
     def __init__(
         self,
         config: dict,
         *args,
+        readonly: bool = False,
         **kwargs,
     ):
+        """
+        config:      configuración de rgcap (ver `load_config`)
+        readonly:    abrir la base de datos en modo de solo lectura (`mode=ro`). No se aplican migraciones.
+        """
+
+        self.config = config
+        self.readonly = readonly
 
         db_route = path.expanduser(config["db_route"])
         self.backups_folder = path.expanduser(config["backups"])
@@ -59,7 +105,190 @@ class RGController(sqlite3.Connection):
         self.fields = config["fields"]
         self.fields_ = self.__invert_fields(self.fields)
 
-        super().__init__(db_route, *args, **kwargs)
+        self.daily_balance = config.get("daily_balance", False)
+        self.sqlite_options = config.get("sqlite", {})
+        self.snapshot = config.get("snapshot", False)
+        self.__snapshot = None
+        # Si la base de datos usa el esquema compacto (ver `lib.compact`). Se comprueba al abrirla
+        self.compact = False
+
+        self.__cache = {}
+        self.__writes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Medición de tiempos y sentencias SQL (ver `instrument`). Desactivada por defecto
+        self.instrumentation = None
+
+        if readonly:
+            super().__init__(
+                "file:%s?mode=ro" % pathname2url(path.abspath(db_route)),
+                *args,
+                uri=True,
+                **kwargs,
+            )
+
+        else:
+            super().__init__(db_route, *args, **kwargs)
+
+        self.__apply_pragmas()
+
+        # Función SQL `huella` (ver `lib.fingerprint`)
+        register(self)
+
+        if not readonly and self.__table_exists(self.__MAIN_TABLE["name"]):
+            self.migrate()
+
+        self.__detect_schema()
+
+        if config.get("instrument", False):
+            self.instrument()
+
+    def __detect_schema(self):
+        """
+        Comprueba si la base de datos usa el esquema compacto y, si es así, sincroniza la tabla `fuentes`
+        con las fuentes de la configuración
+        """
+
+        self.compact = is_compact(self)
+
+        if self.compact and not self.readonly:
+            with self.__transaction():
+                sync_fuentes(self, self.fields)
+
+    def __apply_pragmas(self):
+        """
+        Aplica sobre la conexión las opciones de la sección [sqlite] de la configuración
+        """
+
+        for option, value in self.sqlite_options.items():
+            if option not in self.__SQLITE_PRAGMAS:
+                raise ValueError("Opción de sqlite desconocida: %s" % option)
+
+            valid_values = self.__SQLITE_PRAGMAS[option]
+
+            if isinstance(value, str):
+                value = value.lower()
+
+            if (
+                isinstance(value, bool)
+                or (valid_values is None and not isinstance(value, int))
+                or (valid_values is not None and value not in valid_values)
+            ):
+                raise ValueError(
+                    "Valor no válido para la opción de sqlite `%s`: %r" % (option, value)
+                )
+
+        # `busy_timeout` primero para que el resto de opciones esperen a otras conexiones.
+        # El modo del journal se guarda en la base de datos y no se puede cambiar en modo de solo lectura
+        for option in self.__SQLITE_PRAGMAS:
+            if option in self.sqlite_options and not (
+                self.readonly and option == "journal_mode"
+            ):
+                value = self.sqlite_options[option]
+
+                self.execute(
+                    "PRAGMA %s = %s"
+                    % (option, value.lower() if isinstance(value, str) else value)
+                ).fetchall()
+
+    def __cache_token(self) -> tuple[int, int, int]:
+        """
+        Devuelve un valor que cambia cada vez que cambia la base de datos: `PRAGMA data_version` (cambios
+        hechos por otras conexiones), `total_changes` (cambios hechos por esta conexión, incluido el SQL
+        directo) y el contador interno de escrituras (restauraciones de backups e `invalidate_cache`)
+        """
+
+        return (
+            self.execute("PRAGMA data_version").fetchone()[0],
+            self.total_changes,
+            self.__writes,
+        )
+
+    def __cached(self, key: tuple, compute: Callable):
+        """
+        Devuelve el resultado guardado para <key> si la base de datos no ha cambiado desde que se calculó,
+        o lo calcula con <compute> y lo guarda
+        """
+
+        token = self.__cache_token()
+        entry = self.__cache.get(key)
+
+        if entry is not None and entry[0] == token:
+            self.cache_hits += 1
+            return entry[1]
+
+        self.cache_misses += 1
+
+        result = compute()
+
+        self.__cache[key] = (token, result)
+
+        return result
+
+    def invalidate_cache(self):
+        """
+        Descarta todos los resultados guardados en la caché de totales. Solo hace falta si la base de datos
+        se modifica sin pasar por esta conexión ni por otra conexión a SQLite (p. ej. reemplazando el archivo)
+        """
+
+        self.__writes += 1
+        self.__cache.clear()
+
+    def cache_info(self) -> dict[str, int]:
+        """
+        Devuelve los aciertos, fallos y número de entradas de la caché de totales
+        """
+
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self.__cache),
+        }
+
+    def instrument(self) -> Instrumentation:
+        """
+        Activa la instrumentación de esta conexión (ver `Instrumentation`) y la devuelve. Si ya estaba
+        activada devuelve la misma, con lo medido hasta ahora
+        """
+
+        from .instrumentation import Instrumentation
+
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation(self)
+
+        self.instrumentation.attach()
+
+        return self.instrumentation
+
+    def get_snapshot(self) -> Snapshot:
+        """
+        Devuelve el snapshot por columnas de la tabla `blockchain` de esta base de datos (ver `Snapshot`)
+        """
+
+        from .snapshot import Snapshot
+
+        if self.__snapshot is None:
+            self.__snapshot = Snapshot(self)
+
+        return self.__snapshot
+
+    def __use_snapshot(self) -> bool:
+        """
+        Indica si los análisis deben leer del snapshot por columnas. Las conexiones de solo lectura no lo
+        usan para no actualizar sus archivos desde varios hilos a la vez.
+        """
+
+        return self.snapshot and not self.readonly
+
+    def read_pool(self, size: int = 4) -> ReadPool:
+        """
+        Devuelve un `ReadPool` con <size> conexiones de solo lectura a esta misma base de datos
+        """
+
+        from .read_pool import ReadPool
+
+        return ReadPool(self.config, size)
 
     def create_db(self) -> int:
         """
@@ -69,10 +298,76 @@ class RGController(sqlite3.Connection):
             # Crear ambas tablas
             self.__create_main()
             self.__create_total()
+            self.migrate()
+
+            if self.config.get("compact", False):
+                self.compact_db(vacuum=False)
+
             return 0
         except sqlite3.OperationalError:
             return 1
 
+    def compact_db(self, vacuum: bool = True) -> int:
+        """
+        Convierte la base de datos al esquema compacto (ver `lib.compact`) y devuelve el número de registros
+        convertidos. No hace nada si ya lo usa.
+
+        vacuum:    reconstruir después el archivo para liberar el espacio de la tabla antigua
+        """
+
+        if self.compact:
+            return 0
+
+        with self.__transaction():
+            rows = convert(self)
+
+        self.compact = True
+
+        if vacuum:
+            self.execute("VACUUM")
+
+        return rows
+
+    def __table_exists(self, table_name: str) -> bool:
+        """
+        Comprueba si existe la tabla <table_name> en la base de datos
+        """
+
+        cursor = self.cursor()
+
+        try:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name=?",
+                (table_name,),
+            )
+
+            return cursor.fetchone() is not None
+
+        finally:
+            cursor.close()
+
+    def get_schema_version(self) -> int:
+        """
+        Devuelve la versión del esquema de la base de datos (`PRAGMA user_version`)
+        """
+
+        return self.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> int:
+        """
+        Aplica sobre la base de datos las migraciones pendientes, cada una en su propia transacción.
+        Devuelve el número de migraciones aplicadas.
+        """
+
+        version = self.get_schema_version()
+
+        for new_version, migration in enumerate(MIGRATIONS[version:], version + 1):
+            with self.__transaction():
+                migration(self)
+                self.execute("PRAGMA user_version = %d" % new_version)
+
+        return max(len(MIGRATIONS) - version, 0)
+
     def __create_main(self):
         cursor = self.cursor()
 
@@ -133,81 +428,127 @@ class RGController(sqlite3.Connection):
 
         cursor.close()
 
-    def __insert_into_main(self, field: str, ammount: float, description: str):
+    @contextmanager
+    def __transaction(self):
+        """
+        Agrupa todas las sentencias ejecutadas dentro del bloque en una sola transacción.
+        Si ocurre algún error se deshacen todos los cambios.
+        """
+
+        if self.in_transaction:
+            yield
+            return
+
+        self.execute("BEGIN")
+
+        try:
+            yield
+
+        except BaseException:
+            self.execute("ROLLBACK")
+            raise
+
+        self.execute("COMMIT")
+
+    def __insert_into_main(self, rows: list[tuple[str, float, str, str, str | None]]):
+        """
+        Inserta en la tabla `blockchain` todos los registros <rows> con la forma (fuente, cantidad, hora, descripción,
+        huella). Lanza `sqlite3.IntegrityError` si alguna huella ya existe
+        """
 
         cursor = self.cursor()
 
-        cursor.execute(
-            "INSERT INTO %(table)s (%(field_col_name)s, %(ammount_col_name)s, %(datetime_col_name)s, %(description_col_name)s) \
-            VALUES ('%(field)s', %(ammount)s, '%(datetime)s', '%(description)s')"
+        if self.compact:
+            # Como el trigger de la vista: una fuente que aún no está en `fuentes` se añade sin grupo
+            cursor.executemany(
+                "INSERT OR IGNORE INTO %(fuentes)s (%(field_col_name)s) VALUES (?)"
+                % {
+                    "fuentes": self.fuentes_name,
+                    "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                },
+                {(row[0],) for row in rows},
+            )
+
+            # Directamente sobre `blockchain_data`, sin pasar por el trigger de la vista
+            cursor.executemany(
+                "INSERT INTO %(data)s (fuente_id, centimos, %(datetime_col_name)s, %(description_col_name)s, %(epoch_col_name)s, %(fingerprint_col_name)s) \
+                VALUES ((SELECT fuente_id FROM %(fuentes)s WHERE %(field_col_name)s=?1), CAST(round(?2 * 100) AS INTEGER), \
+                ?3, ?4, CAST(strftime('%%s', ?3) AS INTEGER), ?5)"
+                % {
+                    "data": self.main_data_name,
+                    "fuentes": self.fuentes_name,
+                    "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                    "datetime_col_name": self.__MAIN_TABLE["columns"]["datetime"],
+                    "epoch_col_name": self.__MAIN_TABLE["columns"]["epoch"],
+                    "fingerprint_col_name": self.__MAIN_TABLE["columns"]["fingerprint"],
+                    "description_col_name": self.__MAIN_TABLE["columns"]["description"][
+                        "column_name"
+                    ],
+                },
+                rows,
+            )
+
+            cursor.close()
+            return
+
+        cursor.executemany(
+            "INSERT INTO %(table)s (%(field_col_name)s, %(ammount_col_name)s, %(datetime_col_name)s, %(description_col_name)s, %(epoch_col_name)s, %(fingerprint_col_name)s) \
+            VALUES (?1, ?2, ?3, ?4, CAST(strftime('%%s', ?3) AS INTEGER), ?5)"
             % {
                 "table": self.__MAIN_TABLE["name"],
                 "field_col_name": self.__MAIN_TABLE["columns"]["field"],
                 "ammount_col_name": self.__MAIN_TABLE["columns"]["ammount"],
                 "datetime_col_name": self.__MAIN_TABLE["columns"]["datetime"],
+                "epoch_col_name": self.__MAIN_TABLE["columns"]["epoch"],
+                "fingerprint_col_name": self.__MAIN_TABLE["columns"]["fingerprint"],
                 "description_col_name": self.__MAIN_TABLE["columns"]["description"][
                     "column_name"
                 ],
-                "field": field,
-                "ammount": ammount,
-                "datetime": get_time_now(),
-                "description": description,
-            }
+            },
+            rows,
         )
 
         cursor.close()
 
-    def __update_total(self, field: str, ammount: float):
+    def __update_total(self, deltas: dict[str, float]):
+        """
+        Suma a la tabla `total` la variación acumulada de cada fuente en <deltas>
+        """
 
         cursor = self.cursor()
 
-        field = self.__TOTAL_TABLE["prefix"] + field
-
-        cursor.execute(
-            "SELECT %(ammount_col_name)s FROM %(table)s WHERE %(field_col_name)s='%(field)s'"
-            % {
-                "table": self.__TOTAL_TABLE["name"],
-                "ammount_col_name": self.__TOTAL_TABLE["columns"]["ammount"],
-                "field_col_name": self.__TOTAL_TABLE["columns"]["field"],
-                "field": field,
-            }
-        )
-
-        result = cursor.fetchall()
-
-        total_table = self.__TOTAL_TABLE["name"]
         datetime_now = get_time_now()
+        new_fields = False
 
-        if result:
-            new_ammount = result[0][0] + ammount
+        for field, ammount in deltas.items():
+            field = self.__TOTAL_TABLE["prefix"] + field
 
             cursor.execute(
-                "UPDATE %(table)s SET %(ammount_col_name)s=%(ammount)s, %(datetime_col_name)s='%(datetime)s' WHERE %(field_col_name)s='%(field)s'"
+                "UPDATE %(table)s SET %(ammount_col_name)s=%(ammount_col_name)s + ?, %(datetime_col_name)s=? WHERE %(field_col_name)s=?"
                 % {
-                    "table": total_table,
-                    "ammount": new_ammount,
-                    "datetime": datetime_now,
+                    "table": self.__TOTAL_TABLE["name"],
                     "ammount_col_name": self.__TOTAL_TABLE["columns"]["ammount"],
                     "datetime_col_name": self.__TOTAL_TABLE["columns"]["datetime"],
                     "field_col_name": self.__TOTAL_TABLE["columns"]["field"],
-                    "field": field,
-                }
+                },
+                (ammount, datetime_now, field),
             )
 
-        else:
-            cursor.execute(
-                "INSERT INTO %(table)s (%(field_col_name)s, %(ammount_col_name)s, %(datetime_col_name)s) VALUES ('%(field)s', %(ammount)s, '%(datetime)s')"
-                % {
-                    "table": self.__TOTAL_TABLE["name"],
-                    "field_col_name": self.__TOTAL_TABLE["columns"]["field"],
-                    "ammount_col_name": self.__TOTAL_TABLE["columns"]["ammount"],
-                    "datetime_col_name": self.__TOTAL_TABLE["columns"]["datetime"],
-                    "field": field,
-                    "ammount": ammount,
-                    "datetime": get_time_now(),
-                }
-            )
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    "INSERT INTO %(table)s (%(field_col_name)s, %(ammount_col_name)s, %(datetime_col_name)s) VALUES (?, ?, ?)"
+                    % {
+                        "table": self.__TOTAL_TABLE["name"],
+                        "field_col_name": self.__TOTAL_TABLE["columns"]["field"],
+                        "ammount_col_name": self.__TOTAL_TABLE["columns"]["ammount"],
+                        "datetime_col_name": self.__TOTAL_TABLE["columns"]["datetime"],
+                    },
+                    (field, ammount, datetime_now),
+                )
+
+                new_fields = True
 
+        if new_fields:
             self.__sort_total()
 
         cursor.close()
@@ -223,185 +564,948 @@ class RGController(sqlite3.Connection):
         ammount: float,
         description: str = "",
         update_total: bool = True,
+        external_id: str | None = None,
     ) -> int:
         """
-        Actualiza la base de datos con los datos proporcionados.
+        Actualiza la base de datos con los datos proporcionados. Devuelve 0, o 1 si ya existe un movimiento
+        con el mismo identificador externo y contenido (misma huella, ver `lib.fingerprint`).
 
         field:           el campo. debe ser una clave de la configuración
         ammount:         la cantidad ingresada o sustraída del campo
         description:     descripción de la operación
         update_total:    actualizar la tabla total automáticamente
+        external_id:     identificador externo del movimiento (p. ej. la referencia del banco). Sin él, el
+                         movimiento no tiene huella: dos movimientos iguales en el mismo segundo son válidos
+
+        Lanza `ValueError` si la base de datos usa el esquema compacto y <ammount> tiene fracciones de céntimo.
         """
 
         assert isinstance(field, str)
-        assert isinstance(ammount, (int, float)) and ammount not in [0, 0.0]
+        assert isinstance(ammount, (int, float)) and ammount not in [0, 0.0] and isfinite(ammount)
         assert isinstance(description, str)
+        assert external_id is None or isinstance(external_id, str)
+
+        if self.compact and has_cent_fractions(ammount):
+            raise ValueError("Cantidad con fracciones de céntimo: %r" % (ammount,))
+
         #
         # if ammount in [0, 0.0]:
         #     return 1
 
         field = field.upper()
+        row_datetime = get_time_now()
 
         try:
-            self.__insert_into_main(field, ammount, description)
+            with self.__transaction():
+                self.__insert_into_main(
+                    [
+                        (
+                            field,
+                            ammount,
+                            row_datetime,
+                            description,
+                            (
+                                None
+                                if external_id is None
+                                else fingerprint(field, ammount, row_datetime, description, external_id)
+                            ),
+                        )
+                    ]
+                )
+
+                if update_total:
+                    self.__update_total({field: ammount})
 
-            if update_total:
-                self.__update_total(field, ammount)
+                if self.daily_balance:
+                    self.__refresh_daily_balance()
+
+        except sqlite3.IntegrityError as e:
+            # Solo la huella repetida es un movimiento duplicado: cualquier otra restricción es un error
+            if str(e) != "UNIQUE constraint failed: %s.%s" % (
+                self.main_data_name if self.compact else self.main_name,
+                self.fingerprint_col_name,
+            ):
+                raise e
+
+            return 1
 
         except sqlite3.OperationalError as e:
             raise e
 
         return 0
 
-    def adjust_total(self) -> dict[str, str | dict]:
+    def __validate_row(
+        self, row: tuple | list | dict
+    ) -> tuple[str, float, str, str, str | None] | str:
         """
-        Comprueba que los datos de la tabla `total` está al día con los datos de la tabla `blockchain`.
+        Comprueba un registro para `update_db_many`. Devuelve el registro normalizado como
+        (fuente, cantidad, hora, descripción, huella) o un mensaje con el motivo por el que no es válido.
+        La huella es None si el registro no tiene identificador externo.
         """
 
-        total = self.get_df_total()
-
-        cursor = self.cursor()
+        if isinstance(row, dict):
+            field = row.get("field")
+            ammount = row.get("ammount")
+            description = row.get("description", "")
+            row_datetime = row.get("datetime")
+            external_id = row.get("external_id")
 
-        try:
-            results = {}
+        elif isinstance(row, (tuple, list)) and 2 <= len(row) <= 5:
+            field, ammount = row[0], row[1]
+            description = row[2] if len(row) > 2 else ""
+            row_datetime = row[3] if len(row) > 3 else None
+            external_id = row[4] if len(row) > 4 else None
 
-            for fuente in self.fields.keys():
+        else:
+            return "formato de registro no válido"
 
-                row = total[
-                    total["fuente"] == (self.__TOTAL_TABLE["prefix"] + fuente)
-                ].iloc[0]
+        if not isinstance(field, str) or field.upper() not in self.fields:
+            return "fuente no válida: %r" % (field,)
 
-                present_ammount = row["cantidad"]
-                real_ammount = self.get_sum_of(fuente)
+        if (
+            isinstance(ammount, bool)
+            or not isinstance(ammount, (int, float))
+            or ammount in [0, 0.0]
+            or not isfinite(ammount)
+        ):
+            return "cantidad no válida: %r" % (ammount,)
 
-                if present_ammount == real_ammount:
-                    results[fuente] = "OK"
+        # El esquema compacto guarda céntimos enteros: no se redondea en silencio
+        if self.compact and has_cent_fractions(ammount):
+            return "cantidad con fracciones de céntimo: %r" % (ammount,)
 
-                else:
-                    cursor.execute(
-                        "UPDATE {table} SET cantidad={cantidad} WHERE id={id}".format(
-                            table=self.__TOTAL_TABLE["name"],
-                            cantidad=real_ammount,
-                            id=row["id"],
-                        )
-                    )
+        if not isinstance(description, str):
+            return "descripción no válida: %r" % (description,)
 
-                    results[fuente] = {
-                        "old": present_ammount,
-                        "new": real_ammount,
-                    }
+        if row_datetime is None:
+            row_datetime = get_time_now()
 
-        except sqlite3.OperationalError as e:
-            raise e
+        else:
+            # Mismo formato que `get_time_now`: si no, `epoch` queda a NULL y los filtros por fecha no lo ven
+            try:
+                datetime.strptime(row_datetime, "%Y-%m-%d %H:%M:%S")
 
-        finally:
-            cursor.close()
+            except (TypeError, ValueError):
+                return "hora no válida: %r" % (row_datetime,)
 
-        return results
+        if external_id is not None and not isinstance(external_id, str):
+            return "identificador externo no válido: %r" % (external_id,)
 
-    def __is_valid(self, fuente: str, accept_t: bool = True) -> bool:
-        """
-        Comprueba si la fuente <fuente> es válida (es decir, se encuentra en la configuración)
+        field = field.upper()
 
-        accept_t:    Devolver True si <fuente> está dentro de los valores: ["*", "t", ""]
-        """
         return (
-            fuente in self.fields.keys()
-            or fuente in self.fields_.keys()
-            or (fuente in ["*", "t", ""] if accept_t else False)
+            field,
+            ammount,
+            row_datetime,
+            description,
+            (
+                None
+                if external_id is None
+                else fingerprint(field, ammount, row_datetime, description, external_id)
+            ),
         )
 
-    def get_sum_of(self, fuente: str, ndigits: int = 2) -> float:
+    def __existing_fingerprints(
+        self, fingerprints: list[str], chunk_size: int = 500
+    ) -> set[str]:
         """
-        Devuelve la suma del capital de todos los registros que coincidan con la fuente <fuente>
-
-        fuente:    la fuente por la cual filtrar
-        ndigits:   número de digitos después de la coma a mostrar
+        Devuelve las huellas de <fingerprints> que ya están en la tabla `blockchain`. Cada una se busca
+        en el índice único de la columna `huella`
         """
-        assert self.__is_valid(fuente, accept_t=False)
-        assert isinstance(ndigits, int)
 
-        matching = self.get_df_blockchain(fuente)["cantidad"]
-
-        return round(matching.sum(), ndigits)
+        cursor = self.cursor()
+        existing = set()
 
-    def __get_df(self, table_name: str, fuente: str = "") -> DataFrame:
-        """
-        Devuelve un DataFrame con la tabla <table_name>, y filtra por el criterio <fuente>
+        try:
+            for start in range(0, len(fingerprints), chunk_size):
+                chunk = fingerprints[start : start + chunk_size]
 
-        table_name:    nombre de la tabla que retornar
-        fuente:        filtrar por la fuente <fuente>
-        """
-        assert isinstance(table_name, str)
-        assert self.__is_valid(fuente)
+                cursor.execute(
+                    "SELECT %(fingerprint)s FROM %(table)s WHERE %(fingerprint)s IN (%(params)s)"
+                    % {
+                        "table": self.__MAIN_TABLE["name"],
+                        "fingerprint": self.__MAIN_TABLE["columns"]["fingerprint"],
+                        "params": ", ".join("?" * len(chunk)),
+                    },
+                    chunk,
+                )
 
-        query = "SELECT * FROM %s" % table_name
+                existing.update(row[0] for row in cursor.fetchall())
 
-        if fuente in self.fields.keys():
-            query += " WHERE fuente='%s'" % fuente.upper()
+        finally:
+            cursor.close()
 
-        elif fuente in self.fields_.keys():
-            query += " WHERE fuente IN %s" % str(self.fields_[fuente]).replace(
-                "{", "("
-            ).replace("}", ")")
+        return existing
 
-        result = read_sql(query, self)
+    def update_db_many(
+        self,
+        rows: Iterable[tuple | list | dict],
+        update_total: bool = True,
+        dedup: bool = False,
+    ) -> dict[str, int | dict[int, str]]:
+        """
+        Inserta un lote de registros en una sola transacción y aplica a la tabla `total` una
+        única variación acumulada por fuente.
 
-        return result
+        rows:            registros con la forma (fuente, cantidad[, descripción[, hora[, id externo]]]) o
+                         diccionarios con las claves `field`, `ammount`, `description`, `datetime` y `external_id`
+        update_total:    actualizar la tabla total automáticamente
+        dedup:           dar huella también a los registros sin identificador externo, para que volver a
+                         insertar el mismo lote (p. ej. un extracto ya importado) no duplique nada. Los
+                         registros iguales dentro del lote se numeran y no cuentan como duplicados
 
-    def get_df_blockchain(self, fuente: str = "") -> DataFrame:
+        Los registros no válidos y los que ya existen (misma huella en la base de datos o antes en el mismo
+        lote, ver `lib.fingerprint`) no se insertan ni interrumpen el lote; se devuelven en `errors` junto
+        con su posición dentro de <rows>.
         """
-        Devuelve un DataFrame con la tabla `blockchain`
 
-        fuente:    filtrar por la fuente <fuente>
-        """
-        return self.__get_df(self.__MAIN_TABLE["name"], fuente)
+        candidates = {}
+        errors = {}
+        occurrences = {}
 
-    def get_df_total(self, fuente: str = "") -> DataFrame:
-        """
-        Devuelve un DataFrame con la tabla `total`
+        for index, row in enumerate(rows):
+            result = self.__validate_row(row)
 
-        fuente:    filtrar por la fuente <fuente>
-        """
-        return self.__get_df(self.__TOTAL_TABLE["name"], fuente)
+            if isinstance(result, str):
+                errors[index] = result
+                continue
 
-    def create_local_backup(self, verbose: bool = True) -> str:
-        """
-        Crea una copia de seguridad de la base de datos y devuelve la ruta.
+            if dedup and result[4] is None:
+                # La primera aparición tiene la misma huella que calcula `dedup` para los registros antiguos
+                content = fingerprint(*result[:4])
+                occurrence = occurrences.get(content, 0)
+                occurrences[content] = occurrence + 1
 
-        verbose:    modo verboso
-        """
+                result = (
+                    *result[:4],
+                    content if occurrence == 0 else fingerprint(*result[:4], "#%d" % occurrence),
+                )
 
-        backup_folder = "%(backups_folder)sbackup %(datetime)s/" % {
-            "backups_folder": self.backups_folder,
-            "datetime": "".join(
-                list(map(lambda char: "" if char in "- :" else char, get_time_now()))
-            ),
-        }
+            candidates[index] = result
 
-        makedirs(backup_folder, exist_ok=True)
+        valid_rows = []
+        deltas = {}
 
-        backup_route = backup_folder + (
-            self.db_name + ".db" if not self.db_name.endswith(".db") else ""
-        )
+        with self.__transaction():
+            seen = self.__existing_fingerprints(
+                [row[4] for row in candidates.values() if row[4] is not None]
+            )
 
-        backup = sqlite3.Connection(backup_route)
+            for index, row in candidates.items():
+                if row[4] is not None:
+                    if row[4] in seen:
+                        errors[index] = "movimiento duplicado"
+                        continue
 
-        self.backup(backup)
+                    seen.add(row[4])
 
-        backup.close()
+                valid_rows.append(row)
+                deltas[row[0]] = deltas.get(row[0], 0) + row[1]
 
-        if verbose:
-            print("Backup creado en:  %s" % (backup_route))
+            if valid_rows:
+                try:
+                    self.__insert_into_main(valid_rows)
 
-        return backup_route
+                    if update_total:
+                        self.__update_total(deltas)
 
-    def get_latest_local_backup(self, delete_old_backups: bool = False) -> str:
-        """
-        Devuelve la ruta de la base de datos local más reciente.
+                    if self.daily_balance:
+                        self.__refresh_daily_balance()
 
-        delete_old_backups:    eliminar todas las copias de seguridad anteriores a la última
-        """
+                except sqlite3.OperationalError as e:
+                    raise e
+
+        return {
+            "inserted": len(valid_rows),
+            "errors": dict(sorted(errors.items())),
+        }
+
+    def __get_rewrites(self, cursor: sqlite3.Cursor) -> int:
+        """
+        Devuelve el contador de modificaciones de la tabla `blockchain` que no son inserciones al final
+        (actualizaciones, borrados o inserciones con un id menor al último), mantenido por triggers
+        """
+
+        cursor.execute("SELECT rewrites FROM %s" % self.state_name)
+
+        return cursor.fetchone()[0]
+
+    def __get_reconciliation(self, cursor: sqlite3.Cursor) -> tuple[int, dict[str, list]]:
+        """
+        Devuelve el último id verificado de la tabla `blockchain` y, por fuente, la suma y el número de
+        registros verificados hasta ese id. Si la tabla `blockchain` se ha modificado desde la última
+        verificación, devuelve (0, {}) para forzar una reconstrucción completa.
+        """
+
+        cursor.execute(
+            "SELECT %(field_col_name)s, %(ammount_col_name)s, filas, last_id, rewrites FROM %(table)s"
+            % {
+                "table": self.reconciliation_name,
+                "field_col_name": self.field_col_name,
+                "ammount_col_name": self.ammount_col_name,
+            }
+        )
+
+        rows = cursor.fetchall()
+
+        rewrites = self.__get_rewrites(cursor)
+
+        if not rows or any(row[3] != rows[0][3] or row[4] != rewrites for row in rows):
+            return 0, {}
+
+        return rows[0][3], {row[0]: [row[1], row[2]] for row in rows}
+
+    def adjust_total(self, full: bool = False) -> dict[str, str | dict]:
+        """
+        Comprueba que los datos de la tabla `total` está al día con los datos de la tabla `blockchain`.
+
+        Solo se suman los registros añadidos desde la última verificación. Se recalcula todo desde cero
+        si <full> es True o si la tabla `blockchain` se modificó de otra forma (`move_data`, SQL directo).
+
+        full:    reconstruir todos los totales sin usar la última verificación
+        """
+
+        cursor = self.cursor()
+
+        try:
+            with self.__transaction():
+                last_id, verified = (0, {}) if full else self.__get_reconciliation(cursor)
+
+                # Las sumas se comparan en céntimos. En el esquema compacto son enteros exactos
+                for checksum in verified.values():
+                    checksum[0] = checksum[0] * 100
+
+                    if self.compact:
+                        checksum[0] = round(checksum[0])
+
+                table, total = self.__sum_expression(cents=True)
+
+                cursor.execute(
+                    "SELECT %(field_col_name)s, %(total)s, COUNT(*), MAX(id) FROM %(table)s WHERE id > ? GROUP BY %(field_col_name)s"
+                    % {
+                        "table": table,
+                        "total": total,
+                        "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                    },
+                    (last_id,),
+                )
+
+                new_last_id = last_id
+
+                for fuente, ammount, rows, max_id in cursor.fetchall():
+                    checksum = verified.setdefault(fuente, [0, 0])
+                    checksum[0] += round(ammount) if self.compact else ammount
+                    checksum[1] += rows
+                    new_last_id = max(new_last_id, max_id)
+
+                cursor.execute(
+                    "SELECT %(field_col_name)s, %(ammount_col_name)s FROM %(table)s"
+                    % {
+                        "table": self.__TOTAL_TABLE["name"],
+                        "field_col_name": self.__TOTAL_TABLE["columns"]["field"],
+                        "ammount_col_name": self.__TOTAL_TABLE["columns"]["ammount"],
+                    }
+                )
+
+                total = dict(cursor.fetchall())
+
+                results = {}
+                updates = []
+
+                for fuente in self.fields.keys():
+                    present_ammount = total.get(self.__TOTAL_TABLE["prefix"] + fuente)
+                    real_cents = round(verified.get(fuente, [0])[0])
+                    real_ammount = real_cents / 100
+
+                    # Comparar céntimos enteros evita que los errores de redondeo de los float de la tabla
+                    # `total` se detecten como diferencias
+                    if present_ammount is not None and round(present_ammount * 100) == real_cents:
+                        results[fuente] = "OK"
+
+                    else:
+                        updates.append(
+                            (
+                                self.__TOTAL_TABLE["prefix"] + fuente,
+                                real_ammount,
+                                get_time_now(),
+                            )
+                        )
+
+                        results[fuente] = {
+                            "old": present_ammount,
+                            "new": real_ammount,
+                        }
+
+                cursor.executemany(
+                    "INSERT INTO %(table)s (%(field_col_name)s, %(ammount_col_name)s, %(datetime_col_name)s) VALUES (?, ?, ?) \
+                    ON CONFLICT (%(field_col_name)s) DO UPDATE SET %(ammount_col_name)s=excluded.%(ammount_col_name)s"
+                    % {
+                        "table": self.__TOTAL_TABLE["name"],
+                        "field_col_name": self.__TOTAL_TABLE["columns"]["field"],
+                        "ammount_col_name": self.__TOTAL_TABLE["columns"]["ammount"],
+                        "datetime_col_name": self.__TOTAL_TABLE["columns"]["datetime"],
+                    },
+                    updates,
+                )
+
+                # Guardar el punto hasta el que se ha verificado la tabla `blockchain`
+
+                rewrites = self.__get_rewrites(cursor)
+
+                cursor.execute("DELETE FROM %s" % self.reconciliation_name)
+
+                cursor.executemany(
+                    "INSERT INTO %(table)s (%(field_col_name)s, %(ammount_col_name)s, filas, last_id, rewrites) VALUES (?, ?, ?, ?, ?)"
+                    % {
+                        "table": self.reconciliation_name,
+                        "field_col_name": self.field_col_name,
+                        "ammount_col_name": self.ammount_col_name,
+                    },
+                    [
+                        (fuente, cents / 100, rows, new_last_id, rewrites)
+                        for fuente, (cents, rows) in verified.items()
+                    ],
+                )
+
+        except sqlite3.OperationalError as e:
+            raise e
+
+        finally:
+            cursor.close()
+
+        return results
+
+    def __sum_expression(self, cents: bool = False) -> tuple[str, str]:
+        """
+        Devuelve la tabla de la que sumar las cantidades de `blockchain` y la expresión que las suma (en
+        céntimos si <cents> es True). En el esquema compacto se suman los céntimos enteros de `blockchain_data`,
+        así que la suma es exacta.
+        """
+
+        if self.compact:
+            return (
+                "%s JOIN %s USING (fuente_id)" % (self.main_data_name, self.fuentes_name),
+                "TOTAL(centimos)" if cents else "TOTAL(centimos) / 100.0",
+            )
+
+        return (
+            self.__MAIN_TABLE["name"],
+            "TOTAL(%s)%s" % (self.__MAIN_TABLE["columns"]["ammount"], " * 100" if cents else ""),
+        )
+
+    def __is_valid(self, fuente: str, accept_t: bool = True) -> bool:
+        """
+        Comprueba si la fuente <fuente> es válida (es decir, se encuentra en la configuración)
+
+        accept_t:    Devolver True si <fuente> está dentro de los valores: ["*", "t", ""]
+        """
+        return (
+            fuente in self.fields.keys()
+            or fuente in self.fields_.keys()
+            or (fuente in ["*", "t", ""] if accept_t else False)
+        )
+
+    def __fuentes(self, fuente: str) -> list[str]:
+        """
+        Devuelve las fuentes a las que se refiere <fuente>: ella misma, las de su grupo, o ninguna
+        si <fuente> no filtra (["*", "t", ""])
+        """
+
+        if fuente in self.fields.keys():
+            return [fuente.upper()]
+
+        elif fuente in self.fields_.keys():
+            return sorted(self.fields_[fuente])
+
+        return []
+
+    def __fuente_filter(self, fuente: str) -> tuple[str, list[str]]:
+        """
+        Devuelve la cláusula WHERE (y sus parámetros) que filtra por la fuente <fuente>.
+        Si <fuente> es un grupo se filtra por todas las fuentes que pertenecen a él.
+        """
+
+        fuentes = self.__fuentes(fuente)
+
+        if not fuentes:
+            return "", []
+
+        return (
+            " WHERE %(field_col_name)s IN (%(placeholders)s)"
+            % {
+                "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                "placeholders": ", ".join("?" * len(fuentes)),
+            },
+            fuentes,
+        )
+
+    def get_sum_of(
+        self,
+        fuente: str,
+        ndigits: int = 2,
+        since: str | date | None = None,
+        until: str | date | None = None,
+    ) -> float:
+        """
+        Devuelve la suma del capital de todos los registros que coincidan con la fuente <fuente>
+
+        fuente:    la fuente por la cual filtrar
+        ndigits:   número de digitos después de la coma a mostrar
+        since:     sumar solo los registros con hora igual o posterior
+        until:     sumar solo los registros con hora anterior
+        """
+        assert self.__is_valid(fuente, accept_t=False)
+        assert isinstance(ndigits, int)
+
+        return self.__cached(
+            ("get_sum_of", fuente, ndigits, since, until),
+            lambda: round(self.__get_sum_of(fuente, since, until), ndigits),
+        )
+
+    def __get_sum_of(
+        self,
+        fuente: str,
+        since: str | date | None = None,
+        until: str | date | None = None,
+    ) -> float:
+        where, params = self.__where(fuente, since, until)
+        table, total = self.__sum_expression()
+
+        cursor = self.cursor()
+
+        try:
+            cursor.execute(
+                "SELECT %(total)s FROM %(table)s%(where)s"
+                % {
+                    "table": table,
+                    "total": total,
+                    "where": where,
+                },
+                params,
+            )
+
+            return cursor.fetchone()[0]
+
+        finally:
+            cursor.close()
+
+    def get_sums(self, ndigits: int = 2) -> dict[str, dict[str, float]]:
+        """
+        Devuelve la suma del capital de cada fuente (`fields`) y de cada grupo de fuentes (`groups`)
+        calculadas con una sola consulta agrupada.
+
+        ndigits:   número de digitos después de la coma a mostrar
+        """
+        assert isinstance(ndigits, int)
+
+        sums = self.__cached(("get_sums", ndigits), lambda: self.__get_sums(ndigits))
+
+        return {key: dict(values) for key, values in sums.items()}
+
+    def __get_sums(self, ndigits: int) -> dict[str, dict[str, float]]:
+        if self.__use_snapshot():
+            sums = self.get_snapshot().get_sums()
+
+        else:
+            table, total = self.__sum_expression()
+
+            cursor = self.cursor()
+
+            try:
+                cursor.execute(
+                    "SELECT %(field_col_name)s, %(total)s FROM %(table)s GROUP BY %(field_col_name)s"
+                    % {
+                        "table": table,
+                        "total": total,
+                        "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                    }
+                )
+
+                sums = dict(cursor.fetchall())
+
+            finally:
+                cursor.close()
+
+        fields = {field: sums.get(field, 0.0) for field in self.fields}
+        groups = {
+            group: sum(fields[field] for field in sorted(self.fields_[group]))
+            for group in self.fields_
+        }
+
+        return {
+            "fields": {field: round(value, ndigits) for field, value in fields.items()},
+            "groups": {group: round(value, ndigits) for group, value in groups.items()},
+        }
+
+    def __columns(self, table_name: str) -> str:
+        """
+        Devuelve las columnas de <table_name> que se muestran y exportan. Las columnas internas de
+        `blockchain` (`epoch` y `huella`) no salen de la base de datos
+        """
+
+        if table_name != self.__MAIN_TABLE["name"]:
+            return "*"
+
+        columns = self.__MAIN_TABLE["columns"]
+
+        return ", ".join(
+            [
+                columns["field"],
+                columns["ammount"],
+                columns["datetime"],
+                "id",
+                columns["description"]["column_name"],
+            ]
+        )
+
+    def __get_df(
+        self,
+        table_name: str,
+        fuente: str = "",
+        since: str | date | None = None,
+        until: str | date | None = None,
+    ) -> DataFrame:
+        """
+        Devuelve un DataFrame con la tabla <table_name>, y filtra por el criterio <fuente> y por hora
+
+        table_name:    nombre de la tabla que retornar
+        fuente:        filtrar por la fuente <fuente>
+        since:         devolver solo los registros con hora igual o posterior
+        until:         devolver solo los registros con hora anterior
+        """
+        assert isinstance(table_name, str)
+        assert self.__is_valid(fuente)
+
+        from pandas import read_sql
+
+        where, params = self.__where(fuente, since, until, table_name)
+
+        result = read_sql(
+            "SELECT %s FROM %s%s" % (self.__columns(table_name), table_name, where),
+            self,
+            params=params,
+        )
+
+        return result
+
+    def get_df_blockchain(
+        self,
+        fuente: str = "",
+        since: str | date | None = None,
+        until: str | date | None = None,
+    ) -> DataFrame:
+        """
+        Devuelve un DataFrame con la tabla `blockchain`
+
+        fuente:    filtrar por la fuente <fuente>
+        since:     devolver solo los registros con hora igual o posterior
+        until:     devolver solo los registros con hora anterior
+        """
+        return self.__get_df(self.__MAIN_TABLE["name"], fuente, since, until)
+
+    def page_blockchain(
+        self,
+        fuente: str = "",
+        after_id: int | None = None,
+        limit: int = 20,
+        before_id: int | None = None,
+    ) -> DataFrame:
+        """
+        Devuelve una página de la tabla `blockchain` ordenada de más reciente a más antiguo (id descendente).
+        Cada página se busca directamente por id en el índice, así que cuesta lo mismo sea cual sea.
+
+        fuente:       filtrar por la fuente <fuente>
+        after_id:     devolver los <limit> registros siguientes (más antiguos) al id <after_id>.
+                      Si no se indica ni <after_id> ni <before_id>, la primera página
+        limit:        número de registros por página
+        before_id:    devolver los <limit> registros anteriores (más recientes) al id <before_id>
+        """
+        assert self.__is_valid(fuente)
+        assert isinstance(limit, int) and limit > 0
+
+        from pandas import read_sql
+
+        fuentes = self.__fuentes(fuente) or [None]
+
+        if before_id is not None:
+            condition, order, bound = "id > ?", "ASC", before_id
+
+        else:
+            condition, order, bound = "id < ?", "DESC", after_id
+
+        conditions = [] if bound is None else [condition]
+
+        # Una subconsulta por fuente, cada una resuelta con el índice (fuente, id) y limitada a <limit> filas
+        subqueries = []
+        params = []
+
+        for field in fuentes:
+            where = conditions if field is None else ["%s=?" % self.field_col_name, *conditions]
+
+            subqueries.append(
+                "SELECT * FROM (SELECT * FROM %(table)s%(where)s ORDER BY id %(order)s LIMIT ?)"
+                % {
+                    "table": self.__MAIN_TABLE["name"],
+                    "where": " WHERE " + " AND ".join(where) if where else "",
+                    "order": order,
+                }
+            )
+            params += [
+                *([] if field is None else [field]),
+                *([] if bound is None else [bound]),
+                limit,
+            ]
+
+        query = "SELECT %s FROM (%s ORDER BY id %s LIMIT ?) ORDER BY id DESC" % (
+            self.__columns(self.__MAIN_TABLE["name"]),
+            " UNION ALL ".join(subqueries),
+            order,
+        )
+
+        return read_sql(query, self, params=params + [limit])
+
+    def get_df_total(
+        self,
+        fuente: str = "",
+        since: str | date | None = None,
+        until: str | date | None = None,
+    ) -> DataFrame:
+        """
+        Devuelve un DataFrame con la tabla `total`, o con la suma de los movimientos de cada fuente entre
+        <since> y <until> (calculada desde `blockchain`, con las mismas columnas) si se indica alguno de los dos
+
+        fuente:    filtrar por la fuente <fuente>
+        since:     sumar solo los registros con hora igual o posterior
+        until:     sumar solo los registros con hora anterior
+        """
+        return self.__cached(
+            ("get_df_total", fuente, since, until),
+            lambda: (
+                self.__get_df(self.__TOTAL_TABLE["name"], fuente)
+                if since is None and until is None
+                else self.__get_df_total_between(fuente, since, until)
+            ),
+        ).copy()
+
+    def __get_df_total_between(
+        self,
+        fuente: str,
+        since: str | date | None,
+        until: str | date | None,
+    ) -> DataFrame:
+        assert self.__is_valid(fuente)
+
+        from pandas import read_sql
+
+        where, params = self.__where(fuente, since, until)
+
+        return read_sql(
+            "SELECT ? || %(field)s AS %(total_field)s, TOTAL(%(ammount)s) AS %(total_ammount)s, MAX(%(datetime)s) AS %(total_datetime)s \
+            FROM %(table)s%(where)s GROUP BY %(field)s ORDER BY %(field)s"
+            % {
+                "table": self.__MAIN_TABLE["name"],
+                "field": self.__MAIN_TABLE["columns"]["field"],
+                "ammount": self.__MAIN_TABLE["columns"]["ammount"],
+                "datetime": self.__MAIN_TABLE["columns"]["datetime"],
+                "total_field": self.__TOTAL_TABLE["columns"]["field"],
+                "total_ammount": self.__TOTAL_TABLE["columns"]["ammount"],
+                "total_datetime": self.__TOTAL_TABLE["columns"]["datetime"],
+                "where": where,
+            },
+            self,
+            params=[self.__TOTAL_TABLE["prefix"], *params],
+        )
+
+    @staticmethod
+    def __to_epoch(bound: str | date) -> int:
+        """
+        Convierte una fecha (`date`, `datetime` o texto `YYYY-mm-dd[ HH:MM:SS]`) a segundos desde 1970,
+        igual que hace SQLite con `strftime('%s', hora)` para la columna `epoch`
+        """
+
+        if isinstance(bound, str):
+            bound = datetime.fromisoformat(bound)
+
+        return timegm(bound.timetuple())
+
+    def __datetime_filter(
+        self,
+        since: str | date | None = None,
+        until: str | date | None = None,
+        table_name: str | None = None,
+    ) -> tuple[str, list[int]]:
+        """
+        Devuelve las condiciones (y sus parámetros) que limitan la hora de los registros a [<since>, <until>).
+        En la tabla `blockchain` se compara la columna indexada `epoch`.
+        """
+
+        if table_name in [None, self.__MAIN_TABLE["name"]]:
+            column = self.__MAIN_TABLE["columns"]["epoch"]
+
+        else:
+            column = "CAST(strftime('%%s', %s) AS INTEGER)" % self.__TOTAL_TABLE["columns"]["datetime"]
+
+        conditions = []
+        params = []
+
+        for bound, operator in [(since, ">="), (until, "<")]:
+            if bound is None:
+                continue
+
+            conditions.append("%s%s?" % (column, operator))
+            params.append(self.__to_epoch(bound))
+
+        return " AND ".join(conditions), params
+
+    def __where(
+        self,
+        fuente: str,
+        since: str | date | None = None,
+        until: str | date | None = None,
+        table_name: str | None = None,
+    ) -> tuple[str, list]:
+        """
+        Devuelve la cláusula WHERE (y sus parámetros) que filtra por la fuente <fuente> y por hora
+        """
+
+        where, params = self.__fuente_filter(fuente)
+        datetime_where, datetime_params = self.__datetime_filter(since, until, table_name)
+
+        if datetime_where:
+            where += (" AND " if where else " WHERE ") + datetime_where
+            params += datetime_params
+
+        return where, params
+
+    def export_table(
+        self,
+        route: str,
+        table: str = "blockchain",
+        format: str = "csv",
+        fuente: str = "",
+        since: str | date | None = None,
+        until: str | date | None = None,
+        chunk_size: int = 1000,
+    ) -> int:
+        """
+        Exporta la tabla <table> al archivo <route> leyendo y escribiendo por bloques, sin cargarla entera
+        en memoria. Devuelve el número de registros exportados.
+
+        route:         ruta del archivo
+        table:         `blockchain` o `total`
+        format:        `csv` o `jsonl` (un objeto JSON por línea)
+        fuente:        filtrar por la fuente <fuente> (solo en la tabla `blockchain`)
+        since:         exportar solo los registros con hora igual o posterior
+        until:         exportar solo los registros con hora anterior
+        chunk_size:    número de registros leídos en cada bloque
+        """
+        assert table in [self.__MAIN_TABLE["name"], self.__TOTAL_TABLE["name"]]
+        assert format in ["csv", "jsonl"]
+        assert fuente == "" or table == self.__MAIN_TABLE["name"]
+        assert self.__is_valid(fuente)
+
+        where, params = self.__where(fuente, since, until, table)
+
+        cursor = self.cursor()
+        exported = 0
+
+        try:
+            cursor.execute(
+                "SELECT %s FROM %s%s" % (self.__columns(table), table, where), params
+            )
+
+            columns = [column[0] for column in cursor.description]
+
+            with open(route, "w", newline="") as file:
+                if format == "csv":
+                    writer = csv.writer(file)
+                    writer.writerow(columns)
+
+                while rows := cursor.fetchmany(chunk_size):
+                    if format == "csv":
+                        writer.writerows(rows)
+
+                    else:
+                        file.writelines(
+                            json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+                            for row in rows
+                        )
+
+                    exported += len(rows)
+
+        finally:
+            cursor.close()
+
+        return exported
+
+    def import_statement(
+        self,
+        route: str,
+        field: str | None = None,
+        options: dict | None = None,
+        update_total: bool = True,
+    ) -> dict[str, int | dict[int, str]]:
+        """
+        Importa un extracto bancario en CSV en una sola transacción (ver `lib.importer.import_statement`).
+        Devuelve el número de movimientos insertados y los errores por línea del archivo.
+
+        route:           ruta del archivo
+        field:           fuente de los movimientos si el archivo no indica la suya
+        options:         columnas, formato de fechas, etc. Por defecto, la sección [import] de la configuración
+        update_total:    actualizar la tabla total automáticamente
+        """
+
+        from .importer import import_statement
+
+        return import_statement(self, route, field, options, update_total)
+
+    def create_local_backup(self, verbose: bool = True) -> str:
+        """
+        Crea una copia de seguridad de la base de datos y devuelve la ruta.
+
+        verbose:    modo verboso
+        """
+
+        backup_folder = "%(backups_folder)sbackup %(datetime)s/" % {
+            "backups_folder": self.backups_folder,
+            "datetime": "".join(
+                list(map(lambda char: "" if char in "- :" else char, get_time_now()))
+            ),
+        }
+
+        makedirs(backup_folder, exist_ok=True)
+
+        backup_route = backup_folder + (
+            self.db_name + ".db" if not self.db_name.endswith(".db") else ""
+        )
+
+        # En modo WAL se vuelcan antes los cambios pendientes al archivo principal, y la copia se deja
+        # en modo `delete` para que sea un único archivo autocontenido
+        wal = self.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        if wal:
+            self.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+        backup = sqlite3.Connection(backup_route)
+
+        self.backup(backup)
+
+        if wal:
+            backup.execute("PRAGMA journal_mode = delete").fetchall()
+
+        backup.close()
+
+        if verbose:
+            print("Backup creado en:  %s" % (backup_route))
+
+        return backup_route
+
+    def get_latest_local_backup(self, delete_old_backups: bool = False) -> str:
+        """
+        Devuelve la ruta de la base de datos local más reciente.
+
+        delete_old_backups:    eliminar todas las copias de seguridad anteriores a la última
+        """
 
         carpetas = [
             folder
@@ -471,6 +1575,16 @@ class RGController(sqlite3.Connection):
 
         backup.close()
 
+        # La copia no pasa por `total_changes`, así que la caché no se entera sola del cambio
+        self.invalidate_cache()
+
+        self.__apply_pragmas()
+        self.migrate()
+        self.__detect_schema()
+
+        if self.daily_balance:
+            self.rebuild_daily_balance()
+
         if verbose:
             print("Backup restaurado: %s" % latest_backup_route)
 
@@ -480,11 +1594,156 @@ class RGController(sqlite3.Connection):
 
         return 0
 
-    def get_capital_variation(self, activo: str):
+    def rebuild_daily_balance(self):
+        """
+        Reconstruye desde cero la tabla `daily_balance` (variación y capital al final de cada día por fuente)
+        a partir de la tabla `blockchain`. Los registros con una hora que SQLite no entiende no tienen día
+        y se quedan fuera, igual que en `get_balance_at`.
         """
-        Devuelve un DataFrame con la fecha y el capital al final del día en esa fecha.
 
-        activo:         Activo a analizar. Debe estar dentro de los valores del diccionario self.fields
+        cursor = self.cursor()
+
+        try:
+            with self.__transaction():
+                cursor.execute("DELETE FROM %s" % self.daily_balance_name)
+
+                cursor.execute(
+                    "INSERT INTO %(daily_balance)s (%(field_col_name)s, day, delta, running_total) \
+                    SELECT %(field_col_name)s, date(%(datetime_col_name)s), TOTAL(%(ammount_col_name)s), \
+                    SUM(TOTAL(%(ammount_col_name)s)) OVER (PARTITION BY %(field_col_name)s ORDER BY date(%(datetime_col_name)s)) \
+                    FROM %(table)s WHERE date(%(datetime_col_name)s) IS NOT NULL GROUP BY %(field_col_name)s, date(%(datetime_col_name)s)"
+                    % {
+                        "daily_balance": self.daily_balance_name,
+                        "table": self.__MAIN_TABLE["name"],
+                        "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                        "ammount_col_name": self.__MAIN_TABLE["columns"]["ammount"],
+                        "datetime_col_name": self.__MAIN_TABLE["columns"]["datetime"],
+                    }
+                )
+
+                cursor.execute(
+                    "UPDATE %(state)s SET last_id=(SELECT IFNULL(MAX(id), 0) FROM %(table)s), rewrites=(SELECT rewrites FROM %(blockchain_state)s)"
+                    % {
+                        "state": self.daily_balance_state_name,
+                        "table": self.__MAIN_TABLE["name"],
+                        "blockchain_state": self.state_name,
+                    }
+                )
+
+        except sqlite3.OperationalError as e:
+            raise e
+
+        finally:
+            cursor.close()
+
+    def __refresh_daily_balance(self):
+        """
+        Añade a la tabla `daily_balance` los registros de `blockchain` posteriores al último incluido.
+        Si la tabla `blockchain` se modificó de otra forma (`move_data`, SQL directo) se reconstruye entera.
+        """
+
+        cursor = self.cursor()
+
+        try:
+            with self.__transaction():
+                cursor.execute(
+                    "SELECT last_id, rewrites FROM %s" % self.daily_balance_state_name
+                )
+
+                last_id, rewrites = cursor.fetchone()
+
+                if rewrites != self.__get_rewrites(cursor):
+                    self.rebuild_daily_balance()
+                    return
+
+                cursor.execute(
+                    "SELECT %(field_col_name)s, date(%(datetime_col_name)s), TOTAL(%(ammount_col_name)s), MAX(id) FROM %(table)s \
+                    WHERE id > ? AND date(%(datetime_col_name)s) IS NOT NULL GROUP BY %(field_col_name)s, date(%(datetime_col_name)s)"
+                    % {
+                        "table": self.__MAIN_TABLE["name"],
+                        "field_col_name": self.__MAIN_TABLE["columns"]["field"],
+                        "ammount_col_name": self.__MAIN_TABLE["columns"]["ammount"],
+                        "datetime_col_name": self.__MAIN_TABLE["columns"]["datetime"],
+                    },
+                    (last_id,),
+                )
+
+                names = {
+                    "daily_balance": self.daily_balance_name,
+                    "field_col_name": self.field_col_name,
+                }
+
+                for fuente, day, delta, max_id in cursor.fetchall():
+                    # El capital inicial de un día nuevo es el del último día anterior
+                    self.execute(
+                        "INSERT OR IGNORE INTO %(daily_balance)s (%(field_col_name)s, day, delta, running_total) \
+                        VALUES (?, ?, 0, IFNULL((SELECT running_total FROM %(daily_balance)s WHERE %(field_col_name)s=? AND day<? ORDER BY day DESC LIMIT 1), 0))"
+                        % names,
+                        (fuente, day, fuente, day),
+                    )
+
+                    self.execute(
+                        "UPDATE %(daily_balance)s SET delta=delta + ? WHERE %(field_col_name)s=? AND day=?"
+                        % names,
+                        (delta, fuente, day),
+                    )
+
+                    self.execute(
+                        "UPDATE %(daily_balance)s SET running_total=running_total + ? WHERE %(field_col_name)s=? AND day>=?"
+                        % names,
+                        (delta, fuente, day),
+                    )
+
+                    last_id = max(last_id, max_id)
+
+                cursor.execute(
+                    "UPDATE %s SET last_id=?" % self.daily_balance_state_name,
+                    (last_id,),
+                )
+
+        except sqlite3.OperationalError as e:
+            raise e
+
+        finally:
+            cursor.close()
+
+    def __use_daily_balance(self) -> bool:
+        """
+        Indica si las consultas de capital por día pueden leer de la tabla `daily_balance`, poniéndola
+        al día antes si hace falta. Una conexión de solo lectura solo la usa si ya está al día.
+        """
+
+        if not self.daily_balance:
+            return False
+
+        if not self.readonly:
+            self.__refresh_daily_balance()
+            return True
+
+        cursor = self.cursor()
+
+        try:
+            cursor.execute(
+                "SELECT last_id=(SELECT IFNULL(MAX(id), 0) FROM %(table)s) AND rewrites=(SELECT rewrites FROM %(blockchain_state)s) FROM %(state)s"
+                % {
+                    "state": self.daily_balance_state_name,
+                    "table": self.__MAIN_TABLE["name"],
+                    "blockchain_state": self.state_name,
+                }
+            )
+
+            return bool(cursor.fetchone()[0])
+
+        finally:
+            cursor.close()
+
+    def get_balance_at(self, activo: str, day: str | date, ndigits: int = 2) -> float | None:
+        """
+        Devuelve el capital al final del día <day>.
+
+        activo:         Activo a analizar. Debe estar dentro de las claves o los valores del diccionario self.fields
+        day:            fecha con el formato YYYY-mm-dd
+        ndigits:        número de digitos después de la coma a mostrar
         """
 
         activo = activo.upper()
@@ -492,34 +1751,115 @@ class RGController(sqlite3.Connection):
         if not (activo in self.fields.keys() or activo in self.fields.values()):
             return None
 
-        df = self.get_df_blockchain()
+        if isinstance(day, date):
+            day = day.strftime("%Y-%m-%d")
 
-        df = df[
-            df.apply(
-                lambda x: (
-                    (x["fuente"] in self.fields_[activo])
-                    if activo in self.fields_.keys()
-                    else (x["fuente"] == activo)
-                ),
-                1,
+        where, params = self.__fuente_filter(activo)
+
+        use_daily_balance = self.__use_daily_balance()
+
+        if use_daily_balance:
+            query = (
+                "SELECT TOTAL((SELECT running_total FROM %(daily_balance)s AS d WHERE d.%(field_col_name)s=f.%(field_col_name)s AND d.day<=? ORDER BY d.day DESC LIMIT 1)) \
+                FROM (SELECT DISTINCT %(field_col_name)s FROM %(daily_balance)s%(where)s) AS f"
+                % {
+                    "daily_balance": self.daily_balance_name,
+                    "field_col_name": self.field_col_name,
+                    "where": where,
+                }
             )
-        ]
 
-        def get_date(iso_datetime):
-            return iso_datetime.split()[0]
+        else:
+            query = (
+                "SELECT TOTAL(%(ammount_col_name)s) FROM %(table)s%(where)s AND date(%(datetime_col_name)s)<=?"
+                % {
+                    "table": self.__MAIN_TABLE["name"],
+                    "ammount_col_name": self.__MAIN_TABLE["columns"]["ammount"],
+                    "datetime_col_name": self.__MAIN_TABLE["columns"]["datetime"],
+                    "where": where,
+                }
+            )
+
+        cursor = self.cursor()
+
+        try:
+            cursor.execute(
+                query,
+                [day, *params] if use_daily_balance else [*params, day],
+            )
+
+            return round(cursor.fetchone()[0], ndigits)
+
+        finally:
+            cursor.close()
+
+    def get_daily_balance(self, activo: str) -> Series | None:
+        """
+        Devuelve una serie con el capital al final de cada día en que hubo movimientos, indexada por fecha.
+
+        activo:         Activo a analizar. Debe estar dentro de las claves o los valores del diccionario self.fields
+        """
+
+        activo = activo.upper()
+
+        if not (activo in self.fields.keys() or activo in self.fields.values()):
+            return None
+
+        from pandas import read_sql
+
+        where, params = self.__fuente_filter(activo)
+
+        if self.__use_daily_balance():
+            df = read_sql(
+                "SELECT day AS dia, SUM(SUM(delta)) OVER (ORDER BY day) AS %(ammount_col_name)s \
+                FROM %(daily_balance)s%(where)s GROUP BY day ORDER BY day"
+                % {
+                    "daily_balance": self.daily_balance_name,
+                    "ammount_col_name": self.__MAIN_TABLE["columns"]["ammount"],
+                    "where": where,
+                },
+                self,
+                params=params,
+                index_col="dia",
+                parse_dates=["dia"],
+            )
+
+            return df[self.__MAIN_TABLE["columns"]["ammount"]].astype("float64").rename(activo)
+
+        if self.__use_snapshot():
+            return self.get_snapshot().get_daily_balance(activo)
+
+        df = read_sql(
+            "SELECT date(%(datetime_col_name)s) AS dia, SUM(SUM(%(ammount_col_name)s)) OVER (ORDER BY date(%(datetime_col_name)s)) AS %(ammount_col_name)s \
+            FROM %(table)s%(where)s AND dia IS NOT NULL GROUP BY dia ORDER BY dia"
+            % {
+                "table": self.__MAIN_TABLE["name"],
+                "ammount_col_name": self.__MAIN_TABLE["columns"]["ammount"],
+                "datetime_col_name": self.__MAIN_TABLE["columns"]["datetime"],
+                "where": where,
+            },
+            self,
+            params=params,
+            index_col="dia",
+            parse_dates=["dia"],
+        )
 
-        days = dict.fromkeys([get_date(datetime) for datetime in df["hora"].values], 0)
+        return df[self.__MAIN_TABLE["columns"]["ammount"]].astype("float64").rename(activo)
+
+    def get_capital_variation(self, activo: str):
+        """
+        Muestra una gráfica con el capital al final de cada día.
 
-        def fn(row):
-            days[get_date(row["hora"])] += row["cantidad"]
+        activo:         Activo a analizar. Debe estar dentro de los valores del diccionario self.fields
+        """
 
-        df.apply(fn, 1)
+        from matplotlib import pyplot
+        from seaborn import lineplot
 
-        total = 0
+        days = self.get_daily_balance(activo)
 
-        for day in days:
-            total += days[day]
-            days[day] = total
+        if days is None:
+            return None
 
         figure = lineplot(days)
         figure.minorticks_on()
@@ -529,17 +1869,46 @@ class RGController(sqlite3.Connection):
 
         pyplot.show()
 
+    def __shift_ids(self, cursor: sqlite3.Cursor, first_id: int, ammount_to_move: int):
+        """
+        Suma <ammount_to_move> al id de todos los registros de la tabla `blockchain` con id mayor o igual a <first_id>.
+
+        Primero se cambia el signo de los ids afectados para que el desplazamiento no choque con ellos mismos;
+        si choca con otro registro se lanza `sqlite3.IntegrityError`.
+
+        El trigger `rewrite_id` contaría una reescritura por registro: se desactiva con `shifting` durante
+        el desplazamiento, que se cuenta aquí una sola vez. Se debe llamar dentro de una transacción.
+        """
+
+        # En el esquema compacto se actualiza la tabla directamente: a través de la vista sería registro a registro
+        table = self.main_data_name if self.compact else self.__MAIN_TABLE["name"]
+
+        cursor.execute("UPDATE %s SET shifting=1" % self.state_name)
+
+        cursor.execute(
+            "UPDATE %(table)s SET id=-id WHERE id>=?" % {"table": table},
+            (first_id,),
+        )
+
+        cursor.execute(
+            "UPDATE %(table)s SET id=?-id WHERE id<=?" % {"table": table},
+            (ammount_to_move, -first_id),
+        )
+
+        cursor.execute("UPDATE %s SET shifting=0, rewrites = rewrites + 1" % self.state_name)
+
     def move_data(
         self,
         initial_id: int,
         include_initial_id: bool = True,
         ammount_to_move: int = 1,
-        create_backup: bool = True,
+        create_backup: bool = False,
     ):
         """
         Mueve el registro identificado con el argumento <initial_id> tantas veces como diga el argumento <amount_to_move>
         Si se especifica el argumento <include_initial_id> como True, el registro con el id <initial_id> será incluido en el desplazamiento, si no, comenzará una posición adelante.
 
+        El desplazamiento se hace en una sola transacción y se guarda en la tabla `move_log` para poder deshacerlo con `undo_move_data`.
         """
 
         assert ammount_to_move != 0
@@ -547,50 +1916,142 @@ class RGController(sqlite3.Connection):
         if create_backup:
             self.create_local_backup()
 
-        df = self.get_df_blockchain()
+        first_id = initial_id if include_initial_id else initial_id + 1
+
+        cursor = self.cursor()
+
+        try:
+            with self.__transaction():
+                cursor.execute(
+                    "SELECT 1 FROM %(table)s WHERE id=?" % {"table": self.__MAIN_TABLE["name"]},
+                    (initial_id,),
+                )
+
+                if cursor.fetchone() is None:
+                    print(
+                        "Id %(initial_id)s no encontrado en la tabla %(table)s"
+                        % {"initial_id": initial_id, "table": self.__MAIN_TABLE["name"]}
+                    )
+                    return False
+
+                self.__shift_ids(cursor, first_id, ammount_to_move)
+
+                cursor.execute(
+                    "INSERT INTO %(table)s (first_id, ammount, hora) VALUES (?, ?, ?)"
+                    % {"table": self.move_log_name},
+                    (first_id, ammount_to_move, get_time_now()),
+                )
 
-        if initial_id not in df["id"].values:
+        except sqlite3.IntegrityError:
             print(
-                "Id %(initial_id)s no encontrado en la tabla %(table)s"
-                % {"initial_id": initial_id, "table": self.__MAIN_TABLE["name"]}
+                "Error al tratar de mover los registros desde el id %(first_id)s. Algún id no puede existir más de una vez!"
+                % {"first_id": first_id},
             )
             return False
 
+        except sqlite3.OperationalError as e:
+            raise e
+
+        finally:
+            cursor.close()
+
+        return True
+
+    def undo_move_data(self) -> bool:
+        """
+        Deshace el último desplazamiento hecho con `move_data`
+        """
+
         cursor = self.cursor()
 
         try:
-            for i in (
-                range(len(df) - 1, -1, -1) if ammount_to_move > 0 else range(len(df))
-            ):
-                row = df.iloc[i]
-                old_id = row["id"]
+            with self.__transaction():
+                cursor.execute(
+                    "SELECT id, first_id, ammount FROM %(table)s ORDER BY id DESC LIMIT 1"
+                    % {"table": self.move_log_name}
+                )
+
+                last_move = cursor.fetchone()
+
+                if last_move is None:
+                    print("No hay ningún desplazamiento que deshacer.")
+                    return False
 
-                if old_id >= initial_id if include_initial_id else old_id > initial_id:
-                    new_id = row["id"] + ammount_to_move
+                move_id, first_id, ammount_to_move = last_move
+
+                self.__shift_ids(cursor, first_id + ammount_to_move, -ammount_to_move)
+
+                cursor.execute(
+                    "DELETE FROM %(table)s WHERE id=?" % {"table": self.move_log_name},
+                    (move_id,),
+                )
+
+        except sqlite3.IntegrityError:
+            print("Error al deshacer el desplazamiento. Algún id no puede existir más de una vez!")
+            return False
+
+        except sqlite3.OperationalError as e:
+            raise e
+
+        finally:
+            cursor.close()
+
+        return True
+
+    def dedup(self, delete: bool = False) -> dict[int, int]:
+        """
+        Calcula la huella de los registros que no la tienen (insertados con SQL directo, modificados o que ya
+        estaban duplicados al crear la columna) y devuelve los que repiten otro registro, como
+        {id del duplicado: id del original}. Ver `lib.fingerprint`.
+
+        delete:    borrar los duplicados y descontar sus cantidades de la tabla `total`
+        """
+
+        cursor = self.cursor()
+
+        try:
+            with self.__transaction():
+                backfill(self)
+
+                duplicates = find_duplicates(self)
+
+                if delete and duplicates:
+                    ids = list(duplicates)
+                    deltas = {}
+
+                    for start in range(0, len(ids), 500):
+                        chunk = ids[start : start + 500]
+                        params = ", ".join("?" * len(chunk))
 
-                    try:
                         cursor.execute(
-                            "UPDATE %(table)s SET id=%(new_id)s WHERE id=%(old_id)s"
+                            "SELECT %(field)s, TOTAL(%(ammount)s) FROM %(table)s WHERE id IN (%(params)s) GROUP BY %(field)s"
                             % {
                                 "table": self.__MAIN_TABLE["name"],
-                                "new_id": new_id,
-                                "old_id": old_id,
-                            }
+                                "field": self.__MAIN_TABLE["columns"]["field"],
+                                "ammount": self.__MAIN_TABLE["columns"]["ammount"],
+                                "params": params,
+                            },
+                            chunk,
                         )
-                    except sqlite3.IntegrityError:
-                        print(
-                            "Error al tratar de cambiar el id %(old_id)s al id %(new_id)s. El id %(old_id)s no puede existir más de una vez!"
-                            % {"new_id": new_id, "old_id": old_id},
+
+                        for field, ammount in cursor.fetchall():
+                            if field in self.fields:
+                                deltas[field] = deltas.get(field, 0) - ammount
+
+                        cursor.execute(
+                            "DELETE FROM %s WHERE id IN (%s)" % (self.__MAIN_TABLE["name"], params),
+                            chunk,
                         )
-                        return False
 
-        except sqlite3.OperationalError as e:
-            raise e
+                    self.__update_total(deltas)
+
+                    if self.daily_balance:
+                        self.__refresh_daily_balance()
 
         finally:
             cursor.close()
 
-        return True
+        return duplicates
 
     def __invert_fields(self, fields: dict) -> dict:
         """
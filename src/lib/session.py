@@ -0,0 +1,58 @@
+from collections.abc import Callable, Iterable
+
+
+class SessionRecorder:
+    """
+    `input_fn` para `mainloop` que guarda cada respuesta en un archivo, una por línea, a medida que se
+    escribe. El archivo se puede reproducir con `replay_input` (p. ej. con `python -m benchmarks.replay`)
+    o pasar directamente como entrada estándar de `main.py`.
+
+        with SessionRecorder("sesion.txt") as recorder:
+            mainloop(controller, recorder)
+    """
+
+    def __init__(self, route: str, input_fn: Callable[[str], str] = input):
+        """
+        route:       archivo en el que guardar la sesión. Si existe se añade al final
+        input_fn:    función que lee realmente cada respuesta
+        """
+
+        self.route = route
+        self.input_fn = input_fn
+
+        self.__file = open(route, "a", encoding="utf-8")
+
+    def __call__(self, prompt: str = "") -> str:
+        answer = self.input_fn(prompt)
+
+        self.__file.write(answer + "\n")
+        self.__file.flush()
+
+        return answer
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def replay_input(answers: Iterable[str]) -> Callable[[str], str]:
+    """
+    Devuelve un `input_fn` que responde a cada prompt con la siguiente de <answers> y lanza `EOFError`
+    cuando se acaban, como `input` al final de la entrada estándar
+    """
+
+    answers = iter(answers)
+
+    def input_fn(prompt: str = "") -> str:
+        try:
+            return next(answers).rstrip("\n")
+
+        except StopIteration:
+            raise EOFError from None
+
+    return input_fn
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import json
+from os import makedirs, path, replace
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+    from pandas import Series
+
+    from .rg_controller import RGController
+
+
+class Snapshot:
+    """
+    Copia por columnas de la tabla `blockchain` guardada junto a la base de datos como archivos `.npy`:
+    ids, cantidades, hora en segundos (epoch) y fuente codificada como entero (`fuentes` en `meta.json`).
+
+    Los análisis abren los archivos con `mmap_mode`, así que cargarlos no cuesta casi nada. `refresh`
+    añade solo los registros con un id mayor al último copiado, y vuelve a copiar todo si la tabla
+    `blockchain` se modificó de otra forma (`move_data`, SQL directo, restaurar un backup).
+    """
+
+    COLUMNS = {
+        "id": "int64",
+        "cantidad": "float64",
+        "epoch": "int64",
+        "fuente": "int32",
+    }
+
+    # `epoch` de los registros cuya hora no se puede leer (NULL en la tabla): cuentan en las sumas pero no
+    # tienen día, igual que en las consultas SQL
+    NO_EPOCH = -(2**63)
+
+    # Formato de los archivos: un snapshot con otro formato se vuelve a copiar entero
+    VERSION = 2
+
+    def __init__(self, controller: RGController, folder: str | None = None):
+        """
+        controller:    conexión de la que leer la tabla `blockchain`
+        folder:        carpeta del snapshot. Por defecto `<base_folder>/<db_name>.snapshot/`
+        """
+
+        self.controller = controller
+        self.folder = folder or "%s%s.snapshot/" % (
+            controller.base_folder,
+            controller.db_name,
+        )
+
+        self.__arrays = None
+        self.__meta = None
+
+    def __route(self, name: str) -> str:
+        return path.join(self.folder, name)
+
+    def __empty_meta(self) -> dict:
+        return {
+            "version": self.VERSION,
+            "rows": 0,
+            "capacity": 0,
+            "last_id": 0,
+            "last_row": None,
+            "rewrites": None,
+            "fuentes": [],
+        }
+
+    def __load_meta(self) -> dict:
+        try:
+            with open(self.__route("meta.json")) as file:
+                return json.load(file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            return self.__empty_meta()
+
+    def __save_meta(self, meta: dict):
+        # Se escribe al final y de forma atómica: los datos solo cuentan cuando `meta.json` los incluye
+        with open(self.__route("meta.json.tmp"), "w") as file:
+            json.dump(meta, file)
+
+        replace(self.__route("meta.json.tmp"), self.__route("meta.json"))
+
+    def __is_valid(self, meta: dict) -> bool:
+        """
+        Comprueba que el snapshot sigue siendo un prefijo de la tabla `blockchain`
+        """
+
+        if meta.get("version") != self.VERSION:
+            return False
+
+        cursor = self.controller.cursor()
+
+        try:
+            cursor.execute("SELECT rewrites FROM %s" % self.controller.state_name)
+
+            if cursor.fetchone()[0] != meta["rewrites"]:
+                return False
+
+            if meta["rows"] == 0:
+                return True
+
+            cursor.execute(
+                "SELECT %(field)s, %(ammount)s, %(datetime)s FROM %(table)s WHERE id=?"
+                % {
+                    "table": self.controller.main_name,
+                    "field": self.controller.field_col_name,
+                    "ammount": self.controller.ammount_col_name,
+                    "datetime": self.controller.datetime_col_name,
+                },
+                (meta["last_id"],),
+            )
+
+            return list(cursor.fetchone() or []) == meta["last_row"]
+
+        finally:
+            cursor.close()
+
+    def __grow(self, meta: dict, capacity: int):
+        """
+        Amplía la capacidad de los archivos a <capacity> registros copiando los ya guardados
+        """
+
+        from numpy import load
+        from numpy.lib.format import open_memmap
+
+        for name, dtype in self.COLUMNS.items():
+            route = self.__route("%s.npy" % name)
+            new = open_memmap(route + ".tmp", "w+", dtype, (capacity,))
+
+            if meta["rows"]:
+                new[: meta["rows"]] = load(route, mmap_mode="r")[: meta["rows"]]
+
+            new.flush()
+            del new
+
+            replace(route + ".tmp", route)
+
+        meta["capacity"] = capacity
+
+    def refresh(self, chunk_size: int = 100_000) -> int:
+        """
+        Pone el snapshot al día con la tabla `blockchain` y devuelve el número de registros añadidos
+        """
+
+        from numpy import array
+        from numpy.lib.format import open_memmap
+
+        makedirs(self.folder, exist_ok=True)
+
+        meta = self.__load_meta()
+        changed = not self.__is_valid(meta)
+
+        if changed:
+            meta = self.__empty_meta()
+
+        cursor = self.controller.cursor()
+        added = 0
+
+        try:
+            cursor.execute("SELECT rewrites FROM %s" % self.controller.state_name)
+            meta["rewrites"] = cursor.fetchone()[0]
+
+            cursor.execute(
+                "SELECT id, %(ammount)s, IFNULL(%(epoch)s, %(no_epoch)d), %(field)s, %(datetime)s \
+                FROM %(table)s WHERE id > ? ORDER BY id"
+                % {
+                    "no_epoch": self.NO_EPOCH,
+                    "table": self.controller.main_name,
+                    "field": self.controller.field_col_name,
+                    "ammount": self.controller.ammount_col_name,
+                    "datetime": self.controller.datetime_col_name,
+                    "epoch": self.controller.epoch_col_name,
+                },
+                (meta["last_id"],),
+            )
+
+            codes = {fuente: code for code, fuente in enumerate(meta["fuentes"])}
+
+            while rows := cursor.fetchmany(chunk_size):
+                new_rows = meta["rows"] + len(rows)
+
+                if new_rows > meta["capacity"]:
+                    self.__grow(meta, max(new_rows, 2 * meta["capacity"], 1024))
+
+                columns = list(zip(*rows))
+                columns[3] = [
+                    codes.setdefault(fuente, len(codes)) for fuente in columns[3]
+                ]
+
+                for (name, dtype), values in zip(self.COLUMNS.items(), columns):
+                    column = open_memmap(self.__route("%s.npy" % name), "r+")
+                    column[meta["rows"] : new_rows] = array(values, dtype=dtype)
+                    column.flush()
+                    del column
+
+                meta["rows"] = new_rows
+                meta["last_id"] = rows[-1][0]
+                meta["last_row"] = [rows[-1][3], rows[-1][1], rows[-1][4]]
+                meta["fuentes"] = list(codes)
+
+                added += len(rows)
+
+        finally:
+            cursor.close()
+
+        if changed or added or self.__meta is None:
+            self.__save_meta(meta)
+
+            self.__meta = meta
+            self.__arrays = None
+
+        return added
+
+    def arrays(self) -> dict[str, ndarray]:
+        """
+        Pone el snapshot al día y devuelve sus columnas como arrays de solo lectura mapeados en memoria
+        """
+
+        from numpy import empty, load
+
+        self.refresh()
+
+        if self.__arrays is None:
+            rows = self.__meta["rows"]
+
+            self.__arrays = {
+                name: (
+                    load(self.__route("%s.npy" % name), mmap_mode="r")[:rows]
+                    if rows
+                    else empty(0, dtype)
+                )
+                for name, dtype in self.COLUMNS.items()
+            }
+
+        return self.__arrays
+
+    def __codes(self, activo: str) -> list[int]:
+        """
+        Devuelve los códigos de las fuentes que forman <activo> (una fuente o un grupo)
+        """
+
+        activo = activo.upper()
+
+        fuentes = (
+            self.controller.fields_[activo]
+            if activo in self.controller.fields_
+            else {activo}
+        )
+
+        return [
+            code
+            for code, fuente in enumerate(self.__meta["fuentes"])
+            if fuente in fuentes
+        ]
+
+    def get_sums(self) -> dict[str, float]:
+        """
+        Devuelve la suma del capital de cada fuente, sin redondear
+        """
+
+        from numpy import bincount
+
+        arrays = self.arrays()
+
+        sums = bincount(
+            arrays["fuente"],
+            weights=arrays["cantidad"],
+            minlength=len(self.__meta["fuentes"]),
+        )
+
+        return {
+            fuente: float(total)
+            for fuente, total in zip(self.__meta["fuentes"], sums)
+        }
+
+    def get_daily_balance(self, activo: str) -> Series:
+        """
+        Devuelve una serie con el capital al final de cada día en que hubo movimientos, indexada por fecha
+        """
+
+        from numpy import arange, bincount, cumsum, isin
+        from pandas import Series, to_datetime
+
+        arrays = self.arrays()
+
+        mask = isin(arrays["fuente"], self.__codes(activo)) & (arrays["epoch"] != self.NO_EPOCH)
+        days = arrays["epoch"][mask] // 86400
+
+        # Un contador por día entre el primero y el último, sin ordenar los registros
+        first_day = days.min() if len(days) else 0
+        offsets = days - first_day
+
+        movements = bincount(offsets)
+        deltas = bincount(offsets, weights=arrays["cantidad"][mask])[movements > 0]
+        days = (arange(len(movements)) + first_day)[movements > 0]
+
+        return Series(
+            cumsum(deltas),
+            index=to_datetime(days, unit="D").rename("dia"),
+            dtype="float64",
+            name=activo.upper(),
+        )
@@ -0,0 +1,65 @@
+import asyncio
+
+from .async_controller import AsyncRGController
+
+
+def test_async_controller(config):
+
+    config["sqlite"] = {"journal_mode": "wal"}
+
+    async def producer(controller, field, count):
+        for _ in range(count):
+            await controller.update_db(field, 1)
+
+    async def run():
+        async with AsyncRGController(config, readers=2) as controller:
+            await asyncio.gather(
+                producer(controller, "CASH", 20),
+                producer(controller, "BANK", 10),
+                producer(controller, "CARD", 5),
+            )
+
+            sums = await controller.get_sums()
+
+            # Cancelar la espera no descarta la escritura
+            task = asyncio.ensure_future(controller.update_db("CASH", 100))
+            await asyncio.sleep(0)
+            task.cancel()
+
+        return sums
+
+    sums = asyncio.run(run())
+
+    assert sums["fields"] == {"CASH": 20, "BANK": 10, "CARD": 5}
+
+    async def check():
+        async with AsyncRGController(config) as controller:
+            return await controller.get_sum_of("CASH"), await controller.adjust_total()
+
+    cash, adjusted = asyncio.run(check())
+
+    assert cash == 120
+    assert set(adjusted.values()) == {"OK"}
+
+
+def test_async_controller_duplicates(config):
+
+    async def run():
+        async with AsyncRGController(config, readers=1) as controller:
+            results = [
+                await controller.update_db("CASH", 10, "café", external_id="ref-1"),
+                await controller.update_db("CASH", 10, "café", external_id="ref-1"),
+            ]
+
+            batch = [("BANK", 5, "luz", "2024-01-01 00:00:00")]
+
+            await controller.update_db_many(batch, dedup=True)
+            result = await controller.update_db_many(batch, dedup=True)
+
+            return results, result, await controller.get_sums()
+
+    results, result, sums = asyncio.run(run())
+
+    assert results == [0, 1]
+    assert result == {"inserted": 0, "errors": {0: "movimiento duplicado"}}
+    assert sums["fields"] == {"CASH": 10, "BANK": 5, "CARD": 0}
@@ -0,0 +1,120 @@
+import sqlite3
+
+import pytest
+
+from .compact import is_compact
+from .rg_controller import RGController
+
+
+def test_compact_db(controller):
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "uno", "2024-01-01 09:00:00"),
+            ("BANK", 5.25, "dos", "2024-01-15 10:00:00"),
+            ("CARD", -1.5, "", "2024-02-01 12:00:00"),
+        ]
+    )
+
+    blockchain = controller.get_df_blockchain()
+
+    assert controller.compact_db() == 3
+    assert controller.compact and is_compact(controller)
+    assert controller.compact_db() == 0
+
+    # La vista `blockchain` devuelve lo mismo que la tabla original
+    assert controller.get_df_blockchain().equals(blockchain)
+    assert controller.get_sums()["groups"] == {"EFECTIVO": 10, "BANCO": 3.75}
+    assert controller.get_sum_of("BANCO", since="2024-02-01") == -1.5
+    assert controller.execute(
+        "SELECT fuente, grupo FROM fuentes ORDER BY fuente_id"
+    ).fetchall() == [("CASH", "EFECTIVO"), ("BANK", "BANCO"), ("CARD", "BANCO")]
+
+    assert controller.update_db("CASH", 0.1) == 0
+    assert controller.execute("SELECT centimos FROM blockchain_data WHERE id=4").fetchone()[0] == 10
+    assert controller.page_blockchain("BANCO", limit=1)["id"].tolist() == [3]
+
+    assert controller.move_data(2)
+    assert controller.undo_move_data()
+
+    # Escritura con SQL directo a través de la vista
+    controller.execute("UPDATE blockchain SET cantidad=20, hora='2024-03-01 00:00:00' WHERE id=1")
+    controller.execute("INSERT INTO blockchain (fuente, cantidad, hora) VALUES ('CASH', 1.1, '2024-03-02 00:00:00')")
+    controller.execute("DELETE FROM blockchain WHERE id=2")
+
+    assert controller.get_sum_of("CASH", since="2024-03-01", until="2024-04-01") == 21.1
+    results = controller.adjust_total()
+
+    assert results["CASH"] == {"old": 10.1, "new": 21.2}
+    assert results["BANK"] == {"old": 5.25, "new": 0}
+
+    # Al reabrir la base de datos se detecta el esquema
+    other = RGController(controller.config, readonly=True)
+
+    assert other.compact
+    assert other.get_sum_of("CASH") == 21.2
+
+    other.close()
+
+
+def test_compact_adjust_total_is_exact(config):
+
+    config["compact"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    assert controller.compact
+
+    # La tabla `total` acumula errores de redondeo (0.1 + 0.2 != 0.3), la suma en céntimos no
+    controller.update_db_many([("CASH", 0.1), ("CASH", 0.2)] * 50)
+
+    assert controller.adjust_total()["CASH"] == "OK"
+
+    controller.update_db_many([("CASH", 0.7)] * 10)
+
+    assert controller.adjust_total()["CASH"] == "OK"
+    assert controller.execute("SELECT cantidad FROM reconciliation WHERE fuente='CASH'").fetchone()[0] == 22
+
+    controller.close()
+
+
+def test_compact_db_rejects_fractions_of_cent(controller):
+
+    controller.update_db_many([("CASH", 10), ("CASH", 0.005)])
+
+    with pytest.raises(ValueError):
+        controller.compact_db()
+
+    assert not controller.compact
+    assert controller.get_sum_of("CASH", ndigits=3) == 10.005
+
+    with pytest.raises(sqlite3.OperationalError):
+        controller.execute("SELECT * FROM blockchain_data")
+
+
+def test_compact_insert_checks(config):
+
+    config["compact"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    # Sin redondear en silencio las fracciones de céntimo
+    with pytest.raises(ValueError):
+        controller.update_db("CASH", 0.005)
+
+    result = controller.update_db_many([("CASH", 10), ("CASH", 1.234), ("CASH", 0.07)])
+
+    assert result["inserted"] == 2
+    assert result["errors"][1].startswith("cantidad con fracciones de céntimo")
+    assert controller.get_sum_of("CASH") == 10.07
+
+    # Una fuente que no está en la tabla `fuentes` se añade, como al insertar a través de la vista
+    controller.execute("DELETE FROM fuentes WHERE fuente='CARD'")
+
+    assert controller.update_db("CARD", 2) == 0
+    assert controller.update_db_many([("CARD", 3)])["inserted"] == 1
+    assert controller.get_sum_of("CARD") == 5
+
+    controller.close()
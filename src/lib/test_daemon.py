@@ -0,0 +1,42 @@
+from threading import Thread
+
+import pytest
+
+from .client import send
+from .daemon import Daemon
+from .rg_controller import RGController
+
+
+@pytest.fixture
+def daemon(config):
+    server = Daemon(config)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_daemon(daemon, config):
+
+    assert send(daemon.route, ["25", "comida"]) == "OK\n\n"
+    assert send(daemon.route, ["bank", "10,5", "nómina", "t", "banco", "q"]).split("\n\n")[:2] == [
+        "OK",
+        "BANCO: 10.50",
+    ]
+
+    # Una sesión sin terminar con `q` también acaba cuando el cliente cierra el socket
+    assert send(daemon.route, ["t"]) == ""
+
+    controller = RGController(config, readonly=True)
+
+    assert controller.get_sums()["fields"] == {"CASH": 25, "BANK": 10.5, "CARD": 0}
+
+    controller.close()
+
+    # Solo puede haber un demonio por socket
+    with pytest.raises(RuntimeError):
+        Daemon(config)
@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+from . import rg_controller
+from .rg_controller import RGController
+
+
+@pytest.fixture(params=[False, True], ids=["normal", "compact"])
+def any_controller(request, config):
+    config["compact"] = request.param
+
+    connection = RGController(config, autocommit=True)
+    connection.create_db()
+
+    assert connection.compact == request.param
+
+    yield connection
+
+    connection.close()
+
+
+def test_update_db_external_id(any_controller, monkeypatch):
+
+    monkeypatch.setattr(rg_controller, "get_time_now", lambda: "2024-01-01 09:00:00")
+
+    assert any_controller.update_db("CASH", 10, "café", external_id="ref-1") == 0
+    assert any_controller.update_db("CASH", 10, "café", external_id="ref-1") == 1
+    assert any_controller.update_db("CASH", 10, "café", external_id="ref-2") == 0
+
+    # Los movimientos escritos a mano sin identificador externo no tienen huella
+    assert any_controller.update_db("CASH", 5, "café") == 0
+    assert any_controller.update_db("CASH", 5, "café") == 0
+
+    rows = any_controller.update_db_many(
+        [
+            ("BANK", 20, "nómina", "2024-01-01 00:00:00", "ref-3"),
+            ("BANK", 20, "nómina", "2024-01-01 00:00:00", "ref-3"),
+        ]
+    )
+
+    assert rows == {"inserted": 1, "errors": {1: "movimiento duplicado"}}
+    assert any_controller.get_sums()["fields"] == {"CASH": 30, "BANK": 20, "CARD": 0}
+
+
+def test_update_db_many_dedup(any_controller):
+
+    batch = [
+        ("CASH", 3, "café", "2024-01-01 09:00:00"),
+        ("CASH", 3, "café", "2024-01-01 09:00:00"),
+        ("BANK", -40.5, "luz", "2024-01-02 00:00:00"),
+    ]
+
+    # Los registros iguales dentro del lote son movimientos distintos
+    assert any_controller.update_db_many(batch, dedup=True) == {"inserted": 3, "errors": {}}
+
+    # Volver a insertar el mismo lote no duplica nada
+    assert any_controller.update_db_many(batch + [("CARD", 1)], dedup=True) == {
+        "inserted": 1,
+        "errors": {0: "movimiento duplicado", 1: "movimiento duplicado", 2: "movimiento duplicado"},
+    }
+
+    assert any_controller.get_sums()["fields"] == {"CASH": 6, "BANK": -40.5, "CARD": 1}
+    assert any_controller.dedup() == {}
+
+    # Sin `dedup` el lote se inserta entero
+    assert any_controller.update_db_many(batch)["inserted"] == 3
+
+
+def test_import_statement_twice(controller, tmp_path):
+
+    route = tmp_path / "extracto.csv"
+    route.write_text("fecha,concepto,cantidad\n2024-01-01,café,-2\n2024-01-01,café,-2\n2024-01-02,nómina,1500\n")
+
+    assert controller.import_statement(str(route)) == {"inserted": 3, "errors": {}}
+
+    result = controller.import_statement(str(route))
+
+    assert result["inserted"] == 0
+    assert set(result["errors"].values()) == {"movimiento duplicado"}
+    assert controller.get_sum_of("CASH") == 1496
+
+
+def test_dedup(any_controller):
+
+    any_controller.update_db_many([("CASH", 10, "comida", "2024-01-01 12:00:00")], dedup=True)
+
+    # Registros sin huella: SQL directo, como en las bases de datos anteriores a la columna `huella`
+    for _ in range(2):
+        any_controller.execute(
+            "INSERT INTO blockchain (fuente, cantidad, hora, description) VALUES ('CASH', 10, '2024-01-01 12:00:00', 'comida')"
+        )
+
+    any_controller.execute(
+        "INSERT INTO blockchain (fuente, cantidad, hora, description) VALUES ('BANK', 7, '2024-01-01 12:00:00', 'otro')"
+    )
+    any_controller.adjust_total(full=True)
+
+    assert any_controller.dedup() == {2: 1, 3: 1}
+    assert any_controller.dedup(delete=True) == {2: 1, 3: 1}
+    assert any_controller.dedup() == {}
+
+    assert any_controller.get_df_blockchain()["id"].tolist() == [1, 4]
+    assert any_controller.get_sums()["fields"] == {"CASH": 10, "BANK": 7, "CARD": 0}
+    assert all(result == "OK" for result in any_controller.adjust_total(full=True).values())
+
+    # Modificar un movimiento le quita la huella y deja de rechazar su contenido anterior
+    any_controller.execute("UPDATE blockchain SET cantidad=11 WHERE id=1")
+
+    assert any_controller.execute("SELECT huella FROM blockchain WHERE id=1").fetchone() == (None,)
+    assert any_controller.update_db_many(
+        [("CASH", 10, "comida", "2024-01-01 12:00:00")], dedup=True
+    )["inserted"] == 1
+
+
+def test_update_db_other_integrity_errors(any_controller):
+
+    table = "blockchain_data" if any_controller.compact else "blockchain"
+
+    any_controller.execute(
+        "CREATE TEMP TRIGGER reject BEFORE INSERT ON main.%s BEGIN SELECT RAISE(ABORT, 'rechazado'); END" % table
+    )
+
+    # Solo una huella repetida devuelve 1: el resto de errores de integridad no se ocultan
+    with pytest.raises(sqlite3.IntegrityError):
+        any_controller.update_db("CASH", 10, "café", external_id="ref-1")
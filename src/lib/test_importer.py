@@ -0,0 +1,81 @@
+import pytest
+
+from .functions import float_from_str
+from .importer import parse_amounts
+
+
+def test_parse_amounts():
+    from pandas import Series
+
+    values = ["+4", "-4", "3,5", ",5", "4.", " 12.25 ", "a4", "1.234,5", "", "0"]
+
+    parsed = parse_amounts(Series(values))
+
+    # Las mismas reglas que `float_from_str`
+    for value, result in zip(values, parsed.tolist()):
+        expected = float_from_str(value.strip())
+
+        if expected is None:
+            assert result != result
+        else:
+            assert result == expected
+
+
+def test_import_statement(controller, tmp_path):
+
+    route = tmp_path / "extracto.csv"
+    route.write_text(
+        "Fecha;Cuenta;Concepto;Importe\n"
+        "03/02/2024;ES11;Nómina;1500,00\n"
+        "01/02/2024;tarjeta;Supermercado;-45,30\n"
+        "02/02/2024;ES11;Recibo luz;-60.5\n"
+        "31/02/2024;ES11;Fecha imposible;10\n"
+        "04/02/2024;ES99;Cuenta desconocida;10\n"
+        "05/02/2024;ES11;Sin importe;\n"
+        "06/02/2024;ES11;Importe cero;0\n",
+        encoding="utf-8",
+    )
+
+    options = {
+        "columns": {
+            "datetime": "Fecha",
+            "field": "Cuenta",
+            "description": "Concepto",
+            "ammount": "Importe",
+        },
+        "accounts": {"ES11": "bank", "TARJETA": "card"},
+        "delimiter": ";",
+        "date_format": "%d/%m/%Y",
+    }
+
+    result = controller.import_statement(str(route), options=options)
+
+    assert result["inserted"] == 3
+    assert list(result["errors"]) == [5, 6, 7, 8]
+    assert result["errors"][5].startswith("fecha no válida")
+    assert result["errors"][6].startswith("fuente no válida")
+    assert result["errors"][7].startswith("cantidad no válida")
+
+    assert controller.get_sums()["fields"] == {"CASH": 0, "BANK": 1439.5, "CARD": -45.3}
+
+    # Se insertan ordenados por fecha
+    df = controller.get_df_blockchain()
+    assert df["description"].tolist() == ["Supermercado", "Recibo luz", "Nómina"]
+    assert df["hora"].tolist()[0] == "2024-02-01 00:00:00"
+
+
+def test_import_statement_single_field(controller, tmp_path):
+
+    route = tmp_path / "extracto.csv"
+    route.write_text("fecha,cantidad\n2024-01-01,10\n2024-01-02,-2.5\n")
+
+    result = controller.import_statement(str(route), "card", {"columns": {"datetime": "fecha", "ammount": "cantidad"}})
+
+    assert result == {"inserted": 2, "errors": {}}
+    assert controller.get_sum_of("CARD") == 7.5
+
+    with pytest.raises(ValueError):
+        controller.import_statement(str(route), "nope", {"columns": {"ammount": "cantidad"}})
+
+    with pytest.raises(ValueError):
+        controller.import_statement(str(route), options={"columns": {"importe": "cantidad"}})
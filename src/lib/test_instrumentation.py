@@ -0,0 +1,83 @@
+import json
+
+from .instrumentation import normalize_statement
+from .mainloop import mainloop
+from .rg_controller import RGController
+from .session import replay_input
+
+
+def test_normalize_statement():
+
+    assert (
+        normalize_statement("SELECT  cantidad FROM total\n WHERE fuente = 'it''s' AND id > 12.5")
+        == "SELECT cantidad FROM total WHERE fuente = ? AND id > ?"
+    )
+
+
+def test_instrumentation(config, tmp_path):
+
+    connection = RGController({**config, "instrument": True}, autocommit=True)
+    connection.create_db()
+
+    instrumentation = connection.instrumentation
+
+    connection.update_db("CASH", 10, "comida")
+    connection.update_db("BANK", 5)
+    connection.get_df_blockchain()
+
+    assert instrumentation.methods["update_db"]["calls"] == 2
+    assert instrumentation.methods["update_db"]["statements"] > 0
+    assert instrumentation.methods["get_df_blockchain"]["rows"] == 2
+
+    # Filas leídas de SQLite, aunque el método devuelva un número
+    connection.invalidate_cache()
+    assert connection.get_sum_of("CASH") == 10
+    assert instrumentation.methods["get_sum_of"]["rows"] >= 1
+    assert any(
+        row["site"] == "get_df_blockchain" and row["statement"].startswith("SELECT") and row["rows"] == 2
+        for row in instrumentation.top_statements(100)
+    )
+
+    # Las sentencias se agrupan sin literales, incluidas las de los triggers
+    sites = {row["site"] for row in instrumentation.top_statements(100)}
+    assert "update_db" in sites
+
+    assert any(
+        row["site"] == "update_db" and row["count"] == 2
+        for row in instrumentation.top_statements(100)
+    )
+
+    instrumentation.detach()
+
+    assert "update_db" not in connection.__dict__
+    connection.update_db("CASH", 1)
+    assert instrumentation.methods["update_db"]["calls"] == 2
+
+    route = instrumentation.export_json(str(tmp_path / "perf.json"))
+
+    with open(route) as file:
+        data = json.load(file)
+
+    assert data["methods"]["update_db"]["calls"] == 2
+    assert data["statements"]
+
+    connection.close()
+
+
+def test_perf_command(controller, tmp_path, capsys):
+
+    route = str(tmp_path / "perf.json")
+
+    mainloop(controller, replay_input(["perf", "t", "banco", "perf", "perf json %s" % route, "q"]))
+
+    output = capsys.readouterr().out
+
+    assert "Instrumentación activada" in output
+    assert "[total: " in output
+    assert "get_sum_of" in output
+
+    with open(route) as file:
+        data = json.load(file)
+
+    assert data["commands"]["total"]["count"] == 1
+    assert data["methods"]["get_sum_of"]["calls"] == 1
@@ -0,0 +1,40 @@
+from .mainloop import sql_shell
+from .session import replay_input
+
+
+def test_sql_shell(controller, capsys):
+
+    for i in range(1, 8):
+        controller.update_db("CASH", i, "movimiento %d" % i)
+
+    sql_shell(
+        controller,
+        max_rows=5,
+        input_fn=replay_input(
+            [
+                "SELECT id, cantidad FROM blockchain ORDER BY id",
+                "select count(*) from blockchain where cantidad > 100",
+                "explain select * from blockchain where fuente = 'CASH' and id > 3",
+                "update total set cantidad = 0 where fuente = 'Total_CASH'",
+                "select * from no_existe",
+                "q",
+            ]
+        ),
+    )
+
+    output = capsys.readouterr().out
+
+    # Solo se muestran <max_rows> filas
+    assert "5 filas en " in output
+    assert "      6" not in output
+    assert "límite de 5 filas" in output
+
+    assert "1 filas en " in output
+    assert "QUERY PLAN" in output
+    assert "USING INDEX" in output
+    assert "1 filas afectadas en " in output
+    assert "no such table: no_existe" in output
+
+    assert controller.execute(
+        "SELECT cantidad FROM total WHERE fuente = 'Total_CASH'"
+    ).fetchone() == (0,)
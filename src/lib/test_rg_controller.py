@@ -0,0 +1,507 @@
+from datetime import date, datetime
+import json
+from os import path
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from .migrations import MIGRATIONS
+from .rg_controller import RGController
+
+
+def get_total(controller, field):
+    return controller.execute(
+        "SELECT cantidad FROM total WHERE fuente=?", ("Total_" + field,)
+    ).fetchone()[0]
+
+
+def test_update_db(controller):
+
+    assert controller.update_db("cash", 10.5, "primero") == 0
+    assert controller.update_db("CASH", -2.5) == 0
+
+    assert get_total(controller, "CASH") == 8.0
+    assert controller.execute("SELECT COUNT(*) FROM blockchain").fetchone()[0] == 2
+
+
+def test_update_db_many(controller):
+
+    result = controller.update_db_many(
+        [
+            ("CASH", 10),
+            ("bank", 5.5, "nómina"),
+            ("NOPE", 3),
+            ("CASH", 0),
+            {"field": "CARD", "ammount": -1.5, "datetime": "2024-01-01 10:00:00"},
+            ("CASH", 2, "", "2024-01-02 10:00:00"),
+            ("CASH", 2, "", "01/02/2024"),
+            ("CASH", 2, "", "2024-01-02"),
+            ("CASH", 2, "", 20240102),
+            ("CASH", float("nan")),
+            ("CASH", float("inf")),
+            ("CASH", float("-inf")),
+        ]
+    )
+
+    assert result["inserted"] == 4
+    assert sorted(result["errors"]) == [2, 3, 6, 7, 8, 9, 10, 11]
+    assert result["errors"][6].startswith("hora no válida")
+    assert result["errors"][9].startswith("cantidad no válida")
+
+    # Con `dedup` la cantidad se rechaza antes de calcular la huella
+    result = controller.update_db_many([("CASH", 1), ("CASH", float("nan")), ("CASH", float("inf"))], dedup=True)
+
+    assert result["inserted"] == 1
+    assert sorted(result["errors"]) == [1, 2]
+
+    assert get_total(controller, "CASH") == 13
+    assert get_total(controller, "BANK") == 5.5
+    assert get_total(controller, "CARD") == -1.5
+    assert controller.execute("SELECT COUNT(*) FROM blockchain").fetchone()[0] == 5
+
+
+def test_update_db_many_is_atomic(controller):
+
+    controller.execute("DROP TABLE total")
+
+    with pytest.raises(sqlite3.OperationalError):
+        controller.update_db_many([("CASH", 10), ("BANK", 5)])
+
+    assert controller.execute("SELECT COUNT(*) FROM blockchain").fetchone()[0] == 0
+
+
+def test_get_sums(controller):
+
+    controller.update_db_many([("CASH", 10), ("BANK", 5.25), ("CARD", -1.5), ("CASH", 1)])
+
+    sums = controller.get_sums()
+
+    assert sums["fields"] == {"CASH": 11, "BANK": 5.25, "CARD": -1.5}
+    assert sums["groups"] == {"EFECTIVO": 11, "BANCO": 3.75}
+
+    assert controller.get_sum_of("CASH") == 11
+    assert controller.get_sum_of("BANCO") == 3.75
+    assert len(controller.get_df_blockchain("BANCO")) == 2
+
+
+def test_migrate_existing_db(config):
+
+    connection = sqlite3.connect(config["db_route"])
+    connection.execute(
+        "CREATE TABLE blockchain ( fuente TEXT NOT NULL, cantidad REAL NOT NULL, hora TEXT NOT NULL, id INTEGER PRIMARY KEY NOT NULL UNIQUE, description TEXT NOT NULL DEFAULT '' )"
+    )
+    connection.execute("CREATE TABLE total ( fuente TEXT NOT NULL, cantidad REAL NOT NULL, hora TEXT NOT NULL )")
+    connection.commit()
+    connection.close()
+
+    controller = RGController(config, autocommit=True)
+
+    assert controller.get_schema_version() == len(MIGRATIONS)
+    assert controller.migrate() == 0
+
+    plan = controller.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM blockchain WHERE fuente=?", ("CASH",)
+    ).fetchall()
+
+    assert "USING INDEX" in plan[0][-1]
+
+    controller.close()
+
+
+def test_adjust_total(controller):
+
+    controller.update_db_many([("CASH", 10), ("BANK", 5)])
+
+    assert controller.adjust_total() == {"CASH": "OK", "BANK": "OK", "CARD": "OK"}
+
+    # Solo se verifican los registros nuevos
+    controller.update_db("CASH", 2, update_total=False)
+
+    assert controller.adjust_total()["CASH"] == {"old": 10, "new": 12}
+    assert get_total(controller, "CASH") == 12
+
+    # Una modificación de registros antiguos obliga a recalcular desde cero
+    controller.execute("UPDATE blockchain SET cantidad=20 WHERE id=1")
+
+    assert controller.adjust_total()["CASH"] == {"old": 12, "new": 22}
+    assert controller.adjust_total()["CASH"] == "OK"
+
+
+def test_get_daily_balance(controller):
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "", "2024-01-01 09:00:00"),
+            ("BANK", 5, "", "2024-01-01 10:00:00"),
+            ("CASH", -3, "", "2024-01-01 18:00:00"),
+            ("CARD", 2, "", "2024-01-03 12:00:00"),
+            ("CASH", 1.5, "", "2024-01-03 12:00:00"),
+        ]
+    )
+
+    cash = controller.get_daily_balance("cash")
+
+    assert cash.dtype == "float64"
+    assert [day.strftime("%Y-%m-%d") for day in cash.index] == ["2024-01-01", "2024-01-03"]
+    assert cash.tolist() == [7, 8.5]
+
+    assert controller.get_daily_balance("BANCO").tolist() == [5, 7]
+    assert controller.get_daily_balance("NOPE") is None
+
+
+def test_daily_balance_rollup(config):
+
+    config["daily_balance"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "", "2024-01-01 09:00:00"),
+            ("CASH", -3, "", "2024-01-03 18:00:00"),
+            ("BANK", 4, "", "2024-01-02 10:00:00"),
+        ]
+    )
+
+    # Un movimiento con fecha anterior actualiza el capital de los días siguientes
+    controller.update_db_many([("CASH", 1, "", "2024-01-02 12:00:00")])
+
+    assert controller.get_daily_balance("CASH").tolist() == [10, 11, 8]
+    assert controller.get_balance_at("CASH", "2024-01-02") == 11
+    assert controller.get_balance_at("CASH", "2023-12-31") == 0
+    assert controller.get_balance_at("BANCO", "2024-01-05") == 4
+
+    # Las modificaciones directas obligan a reconstruir la tabla
+    controller.execute("UPDATE blockchain SET cantidad=20 WHERE id=1")
+
+    assert controller.get_balance_at("CASH", "2024-01-03") == 18
+
+    controller.close()
+
+
+def test_daily_balance_invalid_datetime(config):
+
+    config["daily_balance"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    controller.update_db_many([("CASH", 10, "", "2024-01-01 09:00:00")])
+    assert controller.get_balance_at("CASH", "2024-01-01") == 10
+
+    # Registro con una hora sin día (SQL directo): no entra en la tabla ni rompe la reconstrucción
+    controller.execute("INSERT INTO blockchain (fuente, cantidad, hora) VALUES ('CASH', 5, '01/02/2024')")
+    controller.update_db_many([("CASH", 1, "", "2024-01-02 09:00:00")])
+
+    assert controller.get_daily_balance("CASH").tolist() == [10, 11]
+
+    controller.rebuild_daily_balance()
+
+    assert controller.get_daily_balance("CASH").tolist() == [10, 11]
+    assert controller.get_balance_at("CASH", "2024-01-02") == 11
+
+    controller.close()
+
+
+def test_balance_at_without_rollup(controller):
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "", "2024-01-01 09:00:00"),
+            ("CASH", -3, "", "2024-01-03 18:00:00"),
+        ]
+    )
+
+    assert controller.get_balance_at("CASH", "2024-01-02") == 10
+    assert controller.get_balance_at("EFECTIVO", "2024-01-03") == 7
+
+
+def test_startup_does_not_import_heavy_modules():
+
+    code = (
+        "import sys; import lib.mainloop; "
+        "print(' '.join(m for m in ['pandas', 'matplotlib', 'seaborn'] if m in sys.modules))"
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=path.dirname(path.dirname(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == ""
+
+
+def get_ids(controller):
+    return [
+        row[0]
+        for row in controller.execute("SELECT id FROM blockchain ORDER BY id").fetchall()
+    ]
+
+
+def test_move_data(controller):
+
+    controller.update_db_many([("CASH", i) for i in range(1, 6)])
+
+    def get_rewrites():
+        return controller.execute("SELECT rewrites FROM blockchain_state").fetchone()[0]
+
+    rewrites = get_rewrites()
+
+    assert controller.move_data(2, ammount_to_move=2)
+    assert get_ids(controller) == [1, 4, 5, 6, 7]
+
+    # El desplazamiento cuenta como una sola reescritura, no una por registro
+    assert get_rewrites() == rewrites + 1
+    assert controller.execute("SELECT shifting FROM blockchain_state").fetchone()[0] == 0
+
+    assert controller.move_data(4, include_initial_id=False, ammount_to_move=1)
+    assert get_ids(controller) == [1, 4, 6, 7, 8]
+
+    # El choque con otro id deshace el desplazamiento entero
+    assert not controller.move_data(6, ammount_to_move=-2)
+    assert get_ids(controller) == [1, 4, 6, 7, 8]
+
+    assert not controller.move_data(100)
+
+    assert controller.undo_move_data()
+    assert controller.undo_move_data()
+    assert get_ids(controller) == [1, 2, 3, 4, 5]
+    assert not controller.undo_move_data()
+
+
+@pytest.mark.parametrize("compact", [False, True], ids=["normal", "compact"])
+def test_raw_id_change_is_a_rewrite(config, compact):
+
+    config["compact"] = compact
+    config["daily_balance"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    controller.update_db_many([("CASH", 10, "", "2024-01-01 09:00:00"), ("CASH", 5, "", "2024-01-01 10:00:00")])
+
+    assert controller.adjust_total()["CASH"] == "OK"
+    assert controller.get_balance_at("CASH", "2024-01-01") == 15
+
+    # Con SQL directo el registro pasa a estar después del último id verificado: no se debe contar dos veces
+    controller.execute("UPDATE blockchain SET id=100 WHERE id=1")
+
+    assert controller.adjust_total()["CASH"] == "OK"
+    assert get_total(controller, "CASH") == 15
+    assert controller.get_balance_at("CASH", "2024-01-01") == 15
+    assert controller.get_sum_of("CASH") == 15
+
+    controller.close()
+
+
+def test_sqlite_options(config):
+
+    config["sqlite"] = {
+        "journal_mode": "WAL",
+        "synchronous": "normal",
+        "cache_size": -8000,
+        "busy_timeout": 2000,
+    }
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+    controller.update_db("CASH", 10)
+
+    assert controller.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert controller.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert controller.execute("PRAGMA cache_size").fetchone()[0] == -8000
+
+    backup_route = controller.create_local_backup(verbose=False)
+    backup = sqlite3.connect(backup_route)
+
+    assert backup.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert backup.execute("SELECT COUNT(*) FROM blockchain").fetchone()[0] == 1
+
+    backup.close()
+
+    controller.update_db("CASH", 5)
+
+    assert controller.restore_local_backup(create_backup=False, verbose=False) == 0
+    assert controller.get_sum_of("CASH") == 10
+    assert controller.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    controller.close()
+
+    config["sqlite"] = {"journal_mode": "fast"}
+
+    with pytest.raises(ValueError):
+        RGController(config)
+
+
+def test_read_pool(config):
+
+    config["sqlite"] = {"journal_mode": "wal"}
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+    controller.update_db_many([("CASH", 10), ("BANK", 5), ("CARD", 1)])
+
+    with controller.read_pool(2) as pool:
+        results = pool.run_all(
+            {
+                "sums": (RGController.get_sums,),
+                "cash": (RGController.get_sum_of, "CASH"),
+                "blockchain": (RGController.get_df_blockchain,),
+                "total": (RGController.get_df_total,),
+            }
+        )
+
+        # Las conexiones del pool no pueden escribir
+        with pytest.raises(sqlite3.OperationalError):
+            pool.submit(RGController.update_db, "CASH", 1).result()
+
+    assert results["sums"]["groups"] == {"EFECTIVO": 10, "BANCO": 6}
+    assert results["cash"] == 10
+    assert len(results["blockchain"]) == 3
+    assert len(results["total"]) == 3
+
+    controller.close()
+
+
+def test_export_table(controller, tmp_path):
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "uno", "2024-01-01 09:00:00"),
+            ("BANK", 5, "dos", "2024-01-15 10:00:00"),
+            ("CARD", 2, "tres", "2024-02-01 12:00:00"),
+        ]
+    )
+
+    route = str(tmp_path / "blockchain.csv")
+
+    assert controller.export_table(route, chunk_size=2) == 3
+
+    with open(route) as file:
+        lines = file.readlines()
+
+    # Sin las columnas internas (`epoch`, `huella`): el mismo formato de siempre
+    assert len(lines) == 4
+    assert lines[0].strip() == "fuente,cantidad,hora,id,description"
+    assert controller.get_df_blockchain().columns.tolist() == ["fuente", "cantidad", "hora", "id", "description"]
+
+    route = str(tmp_path / "blockchain.jsonl")
+
+    assert (
+        controller.export_table(
+            route, format="jsonl", fuente="BANCO", since="2024-01-01", until="2024-02-01"
+        )
+        == 1
+    )
+
+    with open(route) as file:
+        assert json.loads(file.readline())["description"] == "dos"
+
+    assert controller.export_table(str(tmp_path / "total.csv"), "total") == 3
+
+
+def test_totals_cache(controller, config):
+
+    controller.update_db_many([("CASH", 10), ("BANK", 5)])
+
+    assert controller.get_sum_of("CASH") == 10
+    assert controller.get_sum_of("CASH") == 10
+    assert controller.get_sums()["groups"] == {"EFECTIVO": 10, "BANCO": 5}
+    assert len(controller.get_df_total()) == 3
+
+    hits = controller.cache_info()["hits"]
+
+    controller.get_sums()["groups"]["BANCO"] = 0
+    controller.get_df_total().drop(index=0, inplace=True)
+
+    assert controller.get_sums()["groups"]["BANCO"] == 5
+    assert len(controller.get_df_total()) == 3
+    assert controller.cache_info()["hits"] == hits + 4
+
+    # Una escritura propia, incluida por SQL directo, invalida la caché
+    controller.update_db("CASH", 2)
+
+    assert controller.get_sum_of("CASH") == 12
+
+    controller.execute("UPDATE blockchain SET cantidad=20 WHERE id=1")
+
+    assert controller.get_sum_of("CASH") == 22
+
+    # Y también la de otra conexión a la misma base de datos (`PRAGMA data_version`)
+    other = RGController(config, autocommit=True)
+    other.update_db("CASH", 3)
+    other.close()
+
+    assert controller.get_sum_of("CASH") == 25
+    assert controller.get_sums()["fields"]["CASH"] == 25
+
+
+def test_page_blockchain(controller):
+
+    controller.update_db_many([(field, i) for i in range(1, 11) for field in ("CASH", "BANK", "CARD")])
+
+    page = controller.page_blockchain("BANCO", limit=4)
+
+    assert page["id"].tolist() == [30, 29, 27, 26]
+
+    page = controller.page_blockchain("BANCO", after_id=26, limit=4)
+
+    assert page["id"].tolist() == [24, 23, 21, 20]
+    assert set(page["fuente"]) == {"BANK", "CARD"}
+    assert page.columns.tolist() == ["fuente", "cantidad", "hora", "id", "description"]
+
+    page = controller.page_blockchain("BANCO", before_id=24, limit=4)
+
+    assert page["id"].tolist() == [30, 29, 27, 26]
+
+    assert controller.page_blockchain("CASH", after_id=4, limit=4)["id"].tolist() == [1]
+    assert controller.page_blockchain(after_id=3)["id"].tolist() == [2, 1]
+    assert controller.page_blockchain(before_id=30).empty
+
+    plan = controller.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM blockchain WHERE fuente=? AND id < ? ORDER BY id DESC LIMIT 4",
+        ("CASH", 10),
+    ).fetchall()
+
+    assert "USING INDEX blockchain_fuente_id" in plan[0][-1]
+
+
+def test_date_range(controller):
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "", "2024-01-01 09:00:00"),
+            ("BANK", 5, "", "2024-01-15 10:00:00"),
+            ("CASH", -3, "", "2024-01-31 23:59:59"),
+            ("CASH", 2, "", "2024-02-01 00:00:00"),
+        ]
+    )
+
+    assert controller.get_sum_of("CASH", since="2024-01-01", until="2024-02-01") == 7
+    assert controller.get_sum_of("CASH", since=date(2024, 2, 1)) == 2
+    assert controller.get_sum_of("EFECTIVO", until=datetime(2024, 1, 31, 23, 59, 59)) == 10
+
+    assert len(controller.get_df_blockchain("CASH", since="2024-01-02")) == 2
+    assert controller.get_df_total(since="2024-01-01", until="2024-02-01").values.tolist() == [
+        ["Total_BANK", 5, "2024-01-15 10:00:00"],
+        ["Total_CASH", 7, "2024-01-31 23:59:59"],
+    ]
+
+    # La columna `epoch` se mantiene al modificar la hora con SQL directo
+    controller.execute("UPDATE blockchain SET hora='2024-03-01 00:00:00' WHERE id=4")
+    controller.execute("INSERT INTO blockchain (fuente, cantidad, hora) VALUES ('CASH', 1, '2024-03-02 00:00:00')")
+
+    assert controller.get_sum_of("CASH", since="2024-03-01") == 3
+
+    plan = controller.execute(
+        "EXPLAIN QUERY PLAN SELECT TOTAL(cantidad) FROM blockchain WHERE fuente IN (?) AND epoch>=? AND epoch<?",
+        ("CASH", 0, 1),
+    ).fetchall()
+
+    assert "USING INDEX blockchain_fuente_epoch (fuente=? AND epoch>? AND epoch<?)" in plan[0][-1]
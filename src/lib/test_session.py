@@ -0,0 +1,33 @@
+import pytest
+
+from .mainloop import command_type, mainloop
+from .session import SessionRecorder, replay_input
+
+
+def test_command_type(controller):
+
+    assert [
+        command_type(controller, cmd)
+        for cmd in ["q", "12,5", "cash", "t", "savetxt", "printb", "csv cash 2024-01-01", "stat banco", "sqlite", "move 3 2", "move undo", "nope"]
+    ] == ["quit", "amount", "field", "total", "report", "view", "export", "stat", "sql", "move", "move_undo", "unknown"]
+
+
+def test_record_and_replay(controller, tmp_path, capsys):
+
+    route = str(tmp_path / "sesion.txt")
+    answers = ["10", "comida", "bank", "5", "", "t", "banco"]
+
+    with SessionRecorder(route, replay_input(answers)) as recorder:
+        with pytest.raises(EOFError):
+            mainloop(controller, recorder)
+
+    with open(route) as file:
+        assert file.read().splitlines() == answers
+
+    assert "BANCO: 5.00" in capsys.readouterr().out
+
+    # Reproducir la sesión grabada repite los mismos movimientos
+    with open(route) as file:
+        mainloop(controller, replay_input(file.readlines() + ["q"]))
+
+    assert controller.get_sums()["fields"] == {"CASH": 20, "BANK": 10, "CARD": 0}
@@ -0,0 +1,70 @@
+from .rg_controller import RGController
+
+
+def test_snapshot(config):
+
+    config["snapshot"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    controller.update_db_many(
+        [
+            ("CASH", 10, "", "2024-01-01 09:00:00"),
+            ("BANK", 5, "", "2024-01-01 10:00:00"),
+            ("CASH", -3, "", "2024-01-03 18:00:00"),
+        ]
+    )
+
+    snapshot = controller.get_snapshot()
+
+    assert snapshot.refresh() == 3
+    assert snapshot.refresh() == 0
+    assert controller.get_sums()["fields"] == {"CASH": 7, "BANK": 5, "CARD": 0}
+
+    # Solo se añaden los registros nuevos
+    controller.update_db_many([("CARD", 2, "", "2024-01-03 12:00:00")] * 2000)
+
+    assert snapshot.refresh() == 2000
+    assert controller.get_sums()["groups"] == {"EFECTIVO": 7, "BANCO": 4005}
+    assert controller.get_daily_balance("cash").tolist() == [10, 7]
+    assert controller.get_daily_balance("BANCO").tolist() == [5, 4005]
+
+    # Modificar registros antiguos obliga a copiar todo de nuevo
+    controller.execute("UPDATE blockchain SET cantidad=20 WHERE id=1")
+
+    assert snapshot.refresh() == 2003
+    assert controller.get_sum_of("CASH") == controller.get_sums()["fields"]["CASH"] == 17
+
+    # Una base de datos nueva en la misma ruta también invalida el snapshot
+    controller.execute("DELETE FROM blockchain")
+    controller.execute("UPDATE blockchain_state SET rewrites=0")
+
+    assert controller.get_sums()["fields"]["CASH"] == 0
+
+    controller.close()
+
+
+def test_snapshot_invalid_datetime(config):
+
+    config["snapshot"] = True
+
+    controller = RGController(config, autocommit=True)
+    controller.create_db()
+
+    controller.update_db_many([("CASH", 10, "", "2024-01-01 09:00:00")])
+
+    # Registro con una hora sin día (SQL directo): cuenta en la suma pero no en el capital diario
+    controller.execute("INSERT INTO blockchain (fuente, cantidad, hora) VALUES ('CASH', 5, '01/02/2024')")
+
+    balance = controller.get_daily_balance("CASH")
+
+    assert [day.strftime("%Y-%m-%d") for day in balance.index] == ["2024-01-01"]
+    assert balance.tolist() == [10]
+    assert controller.get_sums()["fields"]["CASH"] == 15
+
+    controller.snapshot = False
+
+    assert controller.get_daily_balance("CASH").equals(balance)
+
+    controller.close()
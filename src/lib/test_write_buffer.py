@@ -0,0 +1,156 @@
+import sqlite3
+from time import monotonic, sleep
+
+import pytest
+
+from .rg_controller import RGController
+from .write_buffer import WriteBuffer
+
+
+def count_rows(config):
+    connection = RGController(config)
+    count = connection.execute("SELECT COUNT(*) FROM blockchain").fetchone()[0]
+    connection.close()
+
+    return count
+
+
+def wait_until(condition, timeout=10):
+    """
+    Espera a que se cumpla <condition> (p. ej. que el buffer haya hecho una escritura)
+    """
+
+    deadline = monotonic() + timeout
+
+    while not condition():
+        assert monotonic() < deadline, "tiempo de espera agotado"
+        sleep(0.01)
+
+
+def test_write_buffer(config):
+
+    buffer = WriteBuffer(config, max_rows=10, max_delay_ms=60_000)
+
+    for i in range(9):
+        buffer.add("CASH", 1)
+
+    assert buffer.pending() == 9
+    assert count_rows(config) == 0
+
+    buffer.add("CASH", 1)
+
+    wait_until(lambda: buffer.commits == 1)
+
+    assert count_rows(config) == 10
+    assert buffer.pending() == 0
+
+    buffer.add("NOPE", 1)
+    buffer.add("CASH", 1)
+    buffer.flush()
+
+    assert count_rows(config) == 11
+    assert buffer.commits == 2
+    assert buffer.errors[0][0][0] == "NOPE"
+
+    buffer.close()
+
+
+def test_write_buffer_delay(config):
+
+    with WriteBuffer(config, max_rows=1000, max_delay_ms=50) as buffer:
+        buffer.add("CASH", 1)
+        buffer.add("BANK", 2)
+
+        wait_until(lambda: buffer.commits == 1)
+
+        assert buffer.pending() == 0
+
+        buffer.add("CASH", 3)
+
+    assert count_rows(config) == 3
+
+
+def test_write_buffer_keeps_rows_on_error(config):
+
+    config["sqlite"] = {"busy_timeout": 50}
+
+    buffer = WriteBuffer(config, max_rows=1000, max_delay_ms=60_000)
+
+    lock = sqlite3.connect(config["db_route"], isolation_level=None)
+    lock.execute("BEGIN EXCLUSIVE")
+
+    buffer.add("CASH", 1)
+    buffer.add("CASH", 2)
+
+    with pytest.raises(sqlite3.OperationalError):
+        buffer.flush()
+
+    # Los movimientos siguen en el buffer y se escriben cuando se libera la base de datos
+    assert buffer.pending() == 2
+
+    buffer.add("CASH", 3)
+
+    lock.execute("ROLLBACK")
+    lock.close()
+
+    buffer.flush()
+
+    assert buffer.pending() == 0
+    assert count_rows(config) == 3
+
+    buffer.close()
+
+
+def test_write_buffer_skips_rejected_rows(config):
+
+    buffer = WriteBuffer(config, max_rows=1000, max_delay_ms=60_000)
+
+    # Un movimiento que SQLite rechaza siempre: reintentarlo no sirve de nada
+    connection = sqlite3.connect(config["db_route"])
+    connection.execute(
+        "CREATE TRIGGER reject BEFORE INSERT ON blockchain WHEN NEW.description='mal' "
+        "BEGIN SELECT RAISE(ABORT, 'rechazado'); END"
+    )
+    connection.commit()
+    connection.close()
+
+    for i in range(5):
+        buffer.add("CASH", 1)
+
+    buffer.add("CASH", 1, "mal")
+    buffer.flush()
+
+    assert buffer.pending() == 0
+    assert count_rows(config) == 5
+    assert [row[2] for row, reason in buffer.errors] == ["mal"]
+
+    # El buffer sigue escribiendo
+    buffer.add("CASH", 1)
+    buffer.close()
+
+    assert buffer.unwritten == []
+    assert count_rows(config) == 6
+
+
+def test_write_buffer_external_id(config):
+
+    with WriteBuffer(config, max_rows=1000, max_delay_ms=60_000) as buffer:
+        buffer.add("CASH", 10, "café", "2024-01-01 09:00:00", external_id="ref-1")
+        buffer.add("CASH", 10, "café", "2024-01-01 09:00:00", external_id="ref-1")
+        buffer.flush()
+
+        # Un movimiento repetido en otra escritura (p. ej. al volver a recibir el mismo feed)
+        buffer.add("CASH", 10, "café", "2024-01-01 09:00:00", external_id="ref-1")
+        buffer.add("CASH", 10, "café", "2024-01-01 09:00:00", external_id="ref-2")
+
+    assert buffer.written == 2
+    assert [reason for row, reason in buffer.errors] == ["movimiento duplicado"] * 2
+    assert count_rows(config) == 2
+
+
+def test_write_buffer_connection_error(config, tmp_path):
+
+    config["db_route"] = str(tmp_path / "no_existe" / "rgcap.db")
+
+    with pytest.raises(sqlite3.OperationalError):
+        WriteBuffer(config)
@@ -0,0 +1,270 @@
+import atexit
+import sqlite3
+from threading import Condition, Thread
+from time import monotonic
+
+from .functions import get_time_now
+from .rg_controller import RGController
+
+
+class WriteBuffer:
+    """
+    Agrupa los movimientos en memoria y los escribe juntos, en una sola transacción, con `update_db_many`.
+
+    Los movimientos pendientes se escriben cuando se acumulan <max_rows>, cuando el más antiguo lleva
+    <max_delay_ms> milisegundos esperando, al llamar a `flush` y al cerrar el buffer (también al salir
+    del programa). Si el proceso muere solo se pierden los movimientos de esa ventana.
+
+    La escritura se hace en un hilo propio con su propia conexión. La hora de cada movimiento es la del
+    momento en que se añade, no la de la escritura.
+
+    Si una escritura falla porque la base de datos está bloqueada por otra conexión, los movimientos vuelven
+    al buffer y se reintentan pasado <max_delay_ms>; `flush` y `close` lanzan el error. Cualquier otro error
+    no se arregla reintentando: el lote se escribe movimiento a movimiento y los que fallan van a `errors`,
+    para que un movimiento que SQLite rechaza no bloquee a los demás.
+
+        with WriteBuffer(config, max_rows=500, max_delay_ms=200) as buffer:
+            buffer.add("CASH", 10, "café")
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        max_rows: int = 100,
+        max_delay_ms: int = 1000,
+        update_total: bool = True,
+    ):
+        """
+        config:          configuración de rgcap (ver `load_config`)
+        max_rows:        número de movimientos pendientes que provoca una escritura
+        max_delay_ms:    tiempo máximo que un movimiento puede esperar a ser escrito
+        update_total:    actualizar la tabla total automáticamente
+        """
+
+        assert isinstance(max_rows, int) and max_rows > 0
+        assert isinstance(max_delay_ms, (int, float)) and max_delay_ms >= 0
+
+        self.config = config
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.update_total = update_total
+
+        self.closed = False
+        self.commits = 0
+        self.written = 0
+        self.errors = []
+        # Movimientos que quedaron sin escribir al cerrar el buffer por un error de escritura
+        self.unwritten = []
+
+        self.__rows = []
+        self.__deadline = None
+        self.__retry_at = None
+        self.__requested = 0
+        self.__done = 0
+        self.__exception = None
+        self.__condition = Condition()
+
+        # La conexión se abre aquí para que un error al abrirla llegue al que crea el buffer
+        self.__connection = RGController(config, autocommit=True, check_same_thread=False)
+
+        try:
+            self.__connection.create_db()
+
+        except BaseException:
+            self.__connection.close()
+            raise
+
+        self.__thread = Thread(target=self.__run, name="rgcap-buffer", daemon=True)
+        self.__thread.start()
+
+        atexit.register(self.close)
+
+    def add(
+        self,
+        field: str,
+        ammount: float,
+        description: str = "",
+        datetime: str | None = None,
+        external_id: str | None = None,
+    ):
+        """
+        Añade un movimiento al buffer. Los movimientos no válidos y los duplicados (mismo <external_id> y
+        contenido que uno ya escrito, ver `lib.fingerprint`) se guardan en `errors` al escribirse.
+        Los errores de escritura no se lanzan aquí: los movimientos se reintentan y `flush` los lanza.
+        """
+
+        row = (field, ammount, description, datetime or get_time_now(), external_id)
+
+        with self.__condition:
+            if self.closed:
+                raise RuntimeError("WriteBuffer cerrado")
+
+            if not self.__thread.is_alive():
+                raise RuntimeError("El hilo de escritura de WriteBuffer terminó inesperadamente")
+
+            self.__rows.append(row)
+
+            # El hilo de escritura tiene que empezar a contar el plazo del primer movimiento pendiente
+            if self.__deadline is None:
+                self.__deadline = monotonic() + self.max_delay
+                self.__condition.notify_all()
+
+            elif len(self.__rows) >= self.max_rows:
+                self.__condition.notify_all()
+
+    def pending(self) -> int:
+        """
+        Devuelve el número de movimientos pendientes de escribir
+        """
+
+        with self.__condition:
+            return len(self.__rows)
+
+    def flush(self):
+        """
+        Escribe todos los movimientos pendientes y espera a que terminen de escribirse
+        """
+
+        with self.__condition:
+            self.__requested += 1
+            target = self.__requested
+
+            self.__condition.notify_all()
+            self.__condition.wait_for(
+                lambda: self.__done >= target or not self.__thread.is_alive()
+            )
+
+            self.__raise_pending_exception()
+
+    def close(self):
+        """
+        Escribe los movimientos pendientes y termina el hilo de escritura. Si esa última escritura falla
+        lanza el error, y los movimientos que no se pudieron escribir quedan en `unwritten`
+        """
+
+        with self.__condition:
+            if self.closed:
+                return
+
+            self.closed = True
+            self.__condition.notify_all()
+
+        self.__thread.join()
+
+        atexit.unregister(self.close)
+
+        with self.__condition:
+            self.unwritten, self.__rows = self.__rows, []
+            self.__raise_pending_exception()
+
+    def __raise_pending_exception(self):
+        if self.__exception is not None:
+            exception, self.__exception = self.__exception, None
+            raise exception
+
+    def __must_write(self) -> bool:
+        if self.closed or self.__requested > self.__done:
+            return True
+
+        # Después de un error no se reintenta por tamaño hasta que pase <max_delay_ms>
+        if self.__retry_at is not None and monotonic() < self.__retry_at:
+            return False
+
+        return len(self.__rows) >= self.max_rows or (
+            self.__deadline is not None and monotonic() >= self.__deadline
+        )
+
+    def __wait_timeout(self) -> float | None:
+        wakeups = [time for time in [self.__deadline, self.__retry_at] if time is not None]
+
+        return max(min(wakeups) - monotonic(), 0) if wakeups else None
+
+    def __run(self):
+        connection = self.__connection
+
+        try:
+            while True:
+                with self.__condition:
+                    while not self.__must_write():
+                        self.__condition.wait(self.__wait_timeout())
+
+                    rows, self.__rows = self.__rows, []
+                    self.__deadline = None
+                    target = self.__requested
+                    closing = self.closed
+
+                retry, error = [], None
+
+                if rows:
+                    try:
+                        self.__write(connection, rows)
+
+                    except Exception as e:
+                        retry, error = rows, e
+
+                        if not self.__is_transient(e):
+                            retry, error = self.__write_one_by_one(connection, rows)
+
+                with self.__condition:
+                    if retry:
+                        # Los movimientos vuelven al principio del buffer, delante de los añadidos mientras tanto
+                        self.__exception = error
+                        self.__rows[:0] = retry
+                        self.__deadline = self.__retry_at = monotonic() + self.max_delay
+
+                    elif rows:
+                        # La escritura funcionó: no se ha perdido nada
+                        self.__retry_at = None
+                        self.__exception = None
+
+                    self.__done = max(self.__done, target)
+                    self.__condition.notify_all()
+
+                if closing:
+                    break
+
+        finally:
+            connection.close()
+
+    def __write(self, connection: RGController, rows: list[tuple]):
+        result = connection.update_db_many(rows, self.update_total)
+
+        self.commits += 1
+        self.written += result["inserted"]
+        self.errors.extend((rows[index], reason) for index, reason in result["errors"].items())
+
+    def __write_one_by_one(
+        self, connection: RGController, rows: list[tuple]
+    ) -> tuple[list[tuple], Exception | None]:
+        """
+        Escribe <rows> de uno en uno después de que falle el lote entero. Los movimientos que fallan se guardan
+        en `errors`. Si la base de datos se bloquea, devuelve los movimientos que faltan y el error
+        """
+
+        for position, row in enumerate(rows):
+            try:
+                self.__write(connection, [row])
+
+            except Exception as e:
+                if self.__is_transient(e):
+                    return rows[position:], e
+
+                self.errors.append((row, "error de escritura: %s" % e))
+
+        return [], None
+
+    @staticmethod
+    def __is_transient(error: Exception) -> bool:
+        """
+        Indica si <error> se puede arreglar reintentando: la base de datos está bloqueada por otra conexión
+        """
+
+        return isinstance(error, sqlite3.OperationalError) and (
+            error.sqlite_errorcode & 0xFF in [sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED]
+        )
+
+    def __enter__(self) -> "WriteBuffer":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,19 +1,41 @@
 from os import makedirs, path
+import sys
 
-from lib.functions import load_config
-from lib.mainloop import mainloop
-from lib.rg_controller import RGController
+from lib.functions import get_socket_route, load_config
 
 
 def main():
     config = load_config()
 
+    # `main.py client [respuestas...]` envía los comandos al demonio sin abrir la base de datos
+    if sys.argv[1:2] == ["client"]:
+        from lib.client import main as client_main
+
+        sys.exit(client_main(get_socket_route(config), sys.argv[2:]))
+
     db_route = path.expanduser(config["db_route"])
 
     db_route_dir = path.dirname(db_route)
 
     makedirs(db_route_dir, exist_ok=True)
 
+    if sys.argv[1:2] == ["daemon"]:
+        from lib.daemon import serve
+
+        serve(config)
+        return
+
+    from lib.mainloop import mainloop
+    from lib.rg_controller import RGController
+
+    input_fn = input
+
+    # `main.py record <archivo>` guarda las respuestas de la sesión (ver `SessionRecorder`)
+    if sys.argv[1:2] == ["record"] and len(sys.argv) == 3:
+        from lib.session import SessionRecorder
+
+        input_fn = SessionRecorder(sys.argv[2])
+
     connection = RGController(
         config,
         autocommit=True,
@@ -25,9 +47,9 @@ def main():
         print("Base de datos creada con éxito!\n")
 
     try:
-        mainloop(connection)
+        mainloop(connection, input_fn)
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, EOFError):
         pass
 
 